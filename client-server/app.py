@@ -4,7 +4,7 @@ import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime
 from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, BotCommand
@@ -43,6 +43,8 @@ if PARSING_SERVER_URL and not PARSING_SERVER_URL.startswith(('http://', 'https:/
     PARSING_SERVER_URL = f"https://{PARSING_SERVER_URL}"
 # URL мини-приложения (должен быть HTTPS для Telegram WebApp)
 MINIAPP_URL = os.getenv("MINIAPP_URL", f"http://localhost:{PORT}/miniapp")
+# Сколько профилей показывает команда /profile (полный список - в мини-приложении)
+PROFILE_LIST_LIMIT = 10
 
 # Настройка хранилища
 UPLOADS_DIR = "uploads"
@@ -506,16 +508,17 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /profile - показывает список загруженных профилей"""
     try:
-        # Получаем список всех профилей из Parsing Server
+        # Получаем последние обновленные профили из Parsing Server (список постраничный)
         async with aiohttp.ClientSession() as session:
             users_url = f"{PARSING_SERVER_URL}/api/users"
             if not users_url.startswith(('http://', 'https://')):
                 users_url = f"https://{users_url}"
             
-            async with session.get(users_url) as response:
+            async with session.get(users_url, params={"limit": PROFILE_LIST_LIMIT}) as response:
                 if response.status == 200:
                     data = await response.json()
                     profiles = data.get('users', [])
+                    has_more = data.get('has_more', False)
                     
                     if not profiles:
                         await update.message.reply_text(
@@ -525,11 +528,14 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         return
                     
                     # Формируем сообщение со списком профилей
-                    message = f"📊 Ваши профили ({len(profiles)}):\n\n"
+                    if has_more:
+                        message = f"📊 Ваши профили (последние {len(profiles)}):\n\n"
+                    else:
+                        message = f"📊 Ваши профили ({len(profiles)}):\n\n"
                     
                     # Создаем кнопки для каждого профиля
                     keyboard = []
-                    for i, profile in enumerate(profiles[:10], 1):  # Показываем максимум 10 профилей
+                    for i, profile in enumerate(profiles, 1):
                         username = profile.get('username', 'N/A')
                         followers = profile.get('followers', 0)
                         posts_count = profile.get('posts_count', 0)
@@ -552,8 +558,8 @@ async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             )
                         ])
                     
-                    if len(profiles) > 10:
-                        message += f"\n... и еще {len(profiles) - 10} профилей"
+                    if has_more:
+                        message += "\n... остальные профили - в мини-приложении"
                     
                     # Добавляем кнопку для открытия мини-приложения
                     keyboard.append([
@@ -953,9 +959,13 @@ async def get_user_report(username: str):
 
 
 @app.post("/api/analyze-link-only/{username}")
-async def analyze_link_only_endpoint(username: str):
+async def analyze_link_only_endpoint(username: str, draft: bool = False):
     """
     Проксирует запрос на анализ профиля только по ссылке (без скриншота) к parsing-server
+    
+    Args:
+        draft: Не ждать GPT отчета: parsing-server вернет готовый отчет из кэша,
+               сохраненный или черновой, а GPT отчет сгенерирует в фоне
     """
     async with aiohttp.ClientSession() as session:
         try:
@@ -966,7 +976,8 @@ async def analyze_link_only_endpoint(username: str):
             logger.info(f"Запрос на анализ только по ссылке: {analyze_url}")
             
             timeout = aiohttp.ClientTimeout(total=180)  # 3 минуты для GPT анализа
-            async with session.post(analyze_url, timeout=timeout) as response:
+            params = {"draft": "true"} if draft else None
+            async with session.post(analyze_url, params=params, timeout=timeout) as response:
                 if response.status == 200:
                     data = await response.json()
                     return JSONResponse(content=data)
@@ -982,6 +993,49 @@ async def analyze_link_only_endpoint(username: str):
             raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
 
+@app.post("/api/analyze-link-only/{username}/stream")
+async def analyze_link_only_stream_endpoint(username: str):
+    """
+    Проксирует потоковый анализ профиля (Server-Sent Events) от parsing-server без буферизации
+    """
+    stream_url = f"{PARSING_SERVER_URL}/api/analyze-link-only/{username}/stream"
+    if not stream_url.startswith(('http://', 'https://')):
+        stream_url = f"https://{stream_url}"
+    
+    logger.info(f"Запрос на потоковый анализ только по ссылке: {stream_url}")
+    
+    session = aiohttp.ClientSession()
+    try:
+        # Ограничиваем только паузу между фрагментами, а не общее время генерации
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=120)
+        response = await session.post(stream_url, timeout=timeout)
+    except aiohttp.ClientError as e:
+        await session.close()
+        logger.error(f"Ошибка соединения с parsing server: {e}")
+        raise HTTPException(status_code=503, detail=f"Parsing Server недоступен: {str(e)}")
+    
+    if response.status != 200:
+        error_text = await response.text()
+        response.release()
+        await session.close()
+        logger.error(f"Ошибка от parsing server: {response.status} - {error_text}")
+        raise HTTPException(status_code=response.status, detail=error_text)
+    
+    async def relay():
+        try:
+            async for chunk in response.content.iter_any():
+                yield chunk
+        finally:
+            response.release()
+            await session.close()
+    
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/api/create-screenshot/{username}")
 async def create_screenshot_endpoint(username: str):
     """
@@ -1025,8 +1079,8 @@ async def create_screenshot_endpoint(username: str):
 
 
 @app.get("/api/users")
-async def get_all_users():
-    """Получение списка всех пользователей"""
+async def get_all_users(request: Request):
+    """Получение списка пользователей (параметры страницы и фильтры передаются в Parsing Server)"""
     try:
         async with aiohttp.ClientSession() as session:
             # Формируем правильный URL
@@ -1034,7 +1088,7 @@ async def get_all_users():
             if not users_url.startswith(('http://', 'https://')):
                 users_url = f"https://{users_url}"
             
-            async with session.get(users_url) as response:
+            async with session.get(users_url, params=dict(request.query_params)) as response:
                 if response.status == 200:
                     data = await response.json()
                     # Обеспечиваем совместимость с форматом {"users": [...]}
@@ -1,18 +1,43 @@
 import os
+import json
+import math
+import asyncio
 import logging
+from typing import Optional
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, delete
 from sqlalchemy.exc import IntegrityError
-from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer_group
+from datetime import datetime, timedelta
 import aiofiles
 from dotenv import load_dotenv
-from database import init_db, get_db, InstagramProfile
+from database import (
+    get_db, engine, InstagramProfile, SessionLocal, REPORT_STATUS_DRAFT, REPORT_STATUS_FINAL,
+    upsert_profile, update_profile, save_report, list_profiles, PROFILE_SORT_COLUMNS,
+    SNAPSHOT_RAW, SNAPSHOT_DAY, SNAPSHOT_WEEK, REPORT_TEXT_GROUP
+)
+from db_pool import pool_metrics
+from migrations import check_schema
 from image_parser import InstagramScreenshotParser
 from screenshot_service import InstagramScreenshotService
-from gpt_analyzer import GPTAnalyzer
+from gpt_analyzer import GPTAnalyzer, PROMPT_VERSION, build_prompt_data
+from token_budget import REPORT_DEPTHS
 from profile_scraper import InstagramProfileScraper
+from browser_pool import BrowserPool, PRIORITY_BACKGROUND
+from refresh_scheduler import ProfileRefreshScheduler
+from capture_strategy import ProfileCapture, STRATEGIES as CAPTURE_STRATEGIES
+from latency_tracker import LatencyTracker
+from report_cache import ReportCache
+from report_sections import ReportSectionStore
+from profile_history import ProfileHistory, SNAPSHOT_METRICS, snapshot_point
+from cohort_stats import CohortStats, COHORT_METRICS, COHORT_ALL, cohort_label
+from singleflight import SingleFlight
+from event_loop_monitor import EventLoopLagMonitor
+from llm_metrics import LLMMetrics
+from draft_report import render_draft_report, DRAFT_MODEL, DRAFT_VERSION
 
 load_dotenv()
 
@@ -26,39 +51,309 @@ logger = logging.getLogger(__name__)
 # Инициализация парсера
 parser = InstagramScreenshotParser()
 
+# Общий пул браузера для скриншотов и скрапинга
+browser_pool = BrowserPool()
+
+# Гистограммы задержек браузерных операций для адаптивных таймаутов
+latency_tracker = LatencyTracker()
+
 # Инициализация сервиса скриншотов
-screenshot_service = InstagramScreenshotService()
+screenshot_service = InstagramScreenshotService(browser_pool, latency_tracker)
 
 # Инициализация скрапера профилей
-profile_scraper = InstagramProfileScraper()
+profile_scraper = InstagramProfileScraper(browser_pool, latency_tracker)
+
+# Получение данных профиля для анализа по ссылке (HTML и/или скриншот + OCR)
+profile_capture = ProfileCapture(profile_scraper, screenshot_service, parser)
 
 # GPT анализатор будет инициализирован при первом использовании
 gpt_analyzer = None
 
+# Кэш отчетов по отпечатку входных данных промпта
+report_cache = ReportCache()
+
+# Разделы последнего отчета для регенерации только изменившихся разделов
+report_sections = ReportSectionStore()
+
+# История метрик профиля: снимок на каждый анализ, свертка старых снимков по дням и неделям
+profile_history = ProfileHistory(SessionLocal)
+
+# Перцентили профиля в когорте по подписчикам и лидерборды (периодически пересчитываемые распределения)
+cohort_stats = CohortStats(SessionLocal)
+
+# Объединение одновременных одинаковых запросов по (операция, username)
+single_flight = SingleFlight()
+
+# Задержка event loop (блокирующий код, перегрузка воркера)
+loop_lag_monitor = EventLoopLagMonitor()
+
+# Учет вызовов LLM: токены, задержки, стоимость, причины ошибок
+llm_metrics = LLMMetrics()
+
+# Фоновые генерации LLM отчетов, которые заменят отданные черновики
+pending_report_tasks = set()
+
 def get_gpt_analyzer():
     """Ленивая инициализация GPT анализатора"""
     global gpt_analyzer
     if gpt_analyzer is None:
         try:
-            gpt_analyzer = GPTAnalyzer()
+            gpt_analyzer = GPTAnalyzer(call_recorder=llm_metrics.record)
         except Exception as e:
             logger.error(f"Ошибка инициализации GPT анализатора: {e}")
             gpt_analyzer = None
     return gpt_analyzer
 
+async def generate_report_cached(
+    analyzer: GPTAnalyzer,
+    db: AsyncSession,
+    profile_dict: dict,
+    screenshot_data: dict,
+    force_refresh: bool = False,
+    depth: Optional[str] = None
+) -> dict:
+    """
+    Возвращает закэшированный отчет для тех же входных данных или генерирует новый.
+    Разделы прошлого отчета, входные данные которых не изменились, переиспользуются
+    (force_refresh генерирует отчет целиком)
+    
+    Args:
+        analyzer: GPT анализатор
+        db: Сессия базы данных
+        profile_dict: Данные профиля для промпта
+        screenshot_data: Данные из скриншота для промпта
+        force_refresh: Не использовать кэш и сгенерировать отчет заново
+        depth: Глубина отчета (None - REPORT_DEPTH)
+        
+    Returns:
+        dict: {"ru": ..., "en": ..., "cached": bool}
+    """
+    username = profile_dict.get("username")
+    fingerprint = analyzer.report_fingerprint(profile_dict, screenshot_data, depth)
+    
+    previous_sections = None
+    if force_refresh:
+        report_cache.record_bypass()
+    else:
+        cached = await report_cache.get(db, fingerprint)
+        if cached:
+            logger.info(f"Отчет для {username} взят из кэша")
+            return {**cached, "cached": True}
+        previous_sections = await report_sections.load(db, username)
+    
+    gpt_reports = await analyzer.generate_report(profile_dict, screenshot_data, depth=depth, previous_sections=previous_sections)
+    if gpt_reports.get("ru") or gpt_reports.get("en"):
+        await report_cache.put(db, fingerprint, username, analyzer.model, PROMPT_VERSION, gpt_reports)
+        await save_report_sections(db, username, gpt_reports, analyzer.model)
+    return {**gpt_reports, "cached": False}
+
+
+async def save_report_sections(db: AsyncSession, username: str, gpt_reports: dict, model: str):
+    """Сохраняет разделы нового отчета для следующей инкрементальной регенерации"""
+    report_sections.record(gpt_reports.get("meta"), gpt_reports.get("sections"))
+    await report_sections.save(db, username, gpt_reports.get("sections"), model, PROMPT_VERSION)
+
+
+def draft_reports(profile: InstagramProfile) -> dict:
+    """Черновой отчет по правилам из текущих метрик профиля (строится за миллисекунды)"""
+    profile_dict, screenshot_data = build_prompt_data(profile)
+    return {"ru": render_draft_report(profile_dict, screenshot_data), "en": "", "draft": True}
+
+
+async def stored_final_report(analyzer: GPTAnalyzer, db: AsyncSession, profile: InstagramProfile, profile_dict: dict, screenshot_data: dict, force_refresh: bool, depth: Optional[str]) -> Optional[dict]:
+    """
+    Уже готовый итоговый отчет профиля для ответа с draft=True вместо чернового
+    
+    Args:
+        force_refresh: Не использовать кэш отчетов (сохраненный отчет профиля отдается)
+        
+    Returns:
+        Optional[dict]: Отчет из кэша для тех же входных данных ({"cached": True}),
+                        последний сохраненный итоговый отчет ({"stale": True}) или None
+    """
+    if not force_refresh:
+        cached = await report_cache.get(db, analyzer.report_fingerprint(profile_dict, screenshot_data, depth))
+        if cached:
+            logger.info(f"Отчет для {profile.username} взят из кэша вместо чернового")
+            return {**cached, "cached": True}
+    if profile.has_final_report:
+        # Тексты отчета не загружаются вместе с профилем
+        await db.refresh(profile, ["report_ru", "report_en"])
+        if profile.report_ru or profile.report_en:
+            logger.info(f"Для {profile.username} отдан сохраненный отчет вместо чернового, новый генерируется в фоне")
+            return {"ru": profile.report_ru or "", "en": profile.report_en or "", "stale": True}
+    return None
+
+
+async def degraded_report(db: AsyncSession, profile: InstagramProfile, gpt_reports: dict) -> dict:
+    """
+    Отчет при временной недоступности LLM провайдера: последний сохраненный итоговый
+    отчет профиля или черновик по правилам вместо ожидания, пока провайдер восстановится
+    
+    Args:
+        db: Сессия базы данных
+        profile: Профиль из базы данных
+        gpt_reports: Результат генерации с retry_after
+        
+    Returns:
+        dict: {"ru": ..., "en": ..., "stale": True, "retry_after": ...}
+              или черновик {"ru": ..., "en": "", "draft": True, "retry_after": ...}
+    """
+    retry_after = gpt_reports.get("retry_after") or 0
+    if profile.has_final_report:
+        # Тексты отчета не загружаются вместе с профилем
+        await db.refresh(profile, ["report_ru", "report_en"])
+        logger.warning(f"LLM недоступен, для {profile.username} отдан сохраненный отчет")
+        return {"ru": profile.report_ru or "", "en": profile.report_en or "", "stale": True, "retry_after": retry_after}
+    logger.warning(f"LLM недоступен, для {profile.username} построен черновой отчет")
+    return {**draft_reports(profile), "retry_after": retry_after}
+
+
+async def store_report(db: AsyncSession, profile: InstagramProfile, gpt_reports: dict, model: Optional[str], analyzed: bool = False) -> InstagramProfile:
+    """
+    Сохраняет отчет в профиль: итоговый отчет, черновик (только если итогового еще нет)
+    или ничего, если отдан ранее сохраненный отчет
+    
+    Args:
+        analyzed: Обновить analyzed_at профиля, даже если отчет не записан
+        
+    Returns:
+        InstagramProfile: Профиль после записи
+    """
+    saved = None
+    if gpt_reports.get("draft"):
+        saved = await save_report(db, profile.username, gpt_reports, DRAFT_MODEL, DRAFT_VERSION, status=REPORT_STATUS_DRAFT, analyzed=analyzed)
+    elif not gpt_reports.get("stale"):
+        saved = await save_report(db, profile.username, gpt_reports, model, PROMPT_VERSION, analyzed=analyzed)
+    if saved is None and analyzed:
+        saved = await update_profile(db, profile.username, {"analyzed_at": datetime.utcnow()})
+    return saved or profile
+
+
+def report_status(gpt_reports: dict) -> str:
+    return REPORT_STATUS_DRAFT if gpt_reports.get("draft") else REPORT_STATUS_FINAL
+
+
+def validate_depth(depth: Optional[str]):
+    """Проверяет глубину отчета из параметра запроса"""
+    if depth and depth not in REPORT_DEPTHS:
+        raise HTTPException(status_code=400, detail=f"Неизвестная глубина отчета: {depth}. Доступны: {', '.join(REPORT_DEPTHS)}")
+
+
 # Конфигурация
 PORT = int(os.getenv("PORT", 8001))
 UPLOAD_DIR = "uploads"
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", 100))
+USERS_PAGE_SIZE_MAX = int(os.getenv("USERS_PAGE_SIZE_MAX", 500))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
+async def run_single_flight(operation: str, username: str, fn, *args):
+    """
+    Выполняет fn(db, username, *args) один раз для всех одновременных запросов
+    с теми же operation, username и args
+    
+    Аргументы входят в ключ: запрос с force_refresh, другой глубиной отчета или
+    стратегией получения данных не должен получить результат чужого запроса
+    
+    Общая задача работает со своей сессией базы данных, чтобы не зависеть
+    от жизненного цикла запроса, который ее запустил
+    """
+    async def run():
+        async with SessionLocal() as db:
+            return await fn(db, username, *args)
+    
+    return await single_flight.do((operation, username, *args), run)
+
+
+def schedule_final_report(username: str, force_refresh: bool, depth: Optional[str]):
+    """Запускает генерацию LLM отчета в фоне; готовый отчет заменит черновик профиля"""
+    task = asyncio.create_task(run_single_flight("final-report", username, _complete_final_report, force_refresh, depth))
+    pending_report_tasks.add(task)
+    task.add_done_callback(pending_report_tasks.discard)
+
+
+async def _complete_final_report(db: AsyncSession, username: str, force_refresh: bool, depth: Optional[str]):
+    """Генерирует LLM отчет и сохраняет его вместо чернового (одно выполнение на username)"""
+    try:
+        profile = await db.scalar(select(InstagramProfile).where(InstagramProfile.username == username))
+        analyzer = get_gpt_analyzer()
+        if not profile or not analyzer or not analyzer.client:
+            return
+        
+        profile_dict, screenshot_data = build_prompt_data(profile)
+        gpt_reports = await generate_report_cached(analyzer, db, profile_dict, screenshot_data, force_refresh, depth)
+        if not gpt_reports.get("ru") and not gpt_reports.get("en"):
+            logger.warning(f"Итоговый отчет для {username} не сгенерирован, остается черновик")
+            return
+        
+        await save_report(db, username, gpt_reports, analyzer.model, PROMPT_VERSION)
+        logger.info(f"Черновой отчет {username} заменен итоговым, длина: {len(gpt_reports.get('ru', ''))} символов")
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Ошибка фоновой генерации отчета для {username}: {e}")
+
+
+async def refresh_profile_in_background(username: str) -> bool:
+    """
+    Обновляет метрики профиля в фоне (используется планировщиком)
+    
+    Args:
+        username: Username Instagram пользователя
+        
+    Returns:
+        bool: True, если данные получены и сохранены
+    """
+    parsed_data = await profile_scraper.scrape_profile_data(username, priority=PRIORITY_BACKGROUND)
+    if parsed_data.get('followers', 0) == 0 and parsed_data.get('posts_count', 0) == 0:
+        return False
+    
+    # Обновляем только извлеченные поля, как в update-profile
+    values = {}
+    if parsed_data.get('followers', 0) > 0:
+        values['followers'] = parsed_data['followers']
+    if parsed_data.get('following', 0) > 0:
+        values['following'] = parsed_data['following']
+    if parsed_data.get('posts_count', 0) > 0:
+        values['posts_count'] = parsed_data['posts_count']
+    if parsed_data.get('bio'):
+        values['bio'] = parsed_data['bio']
+    
+    async with SessionLocal() as db:
+        profile = await update_profile(db, username, values)
+    if profile is None:
+        return False
+    await profile_history.record(profile, "refresh")
+    return True
+
+
+# Планировщик фонового обновления устаревших профилей
+refresh_scheduler = ProfileRefreshScheduler(browser_pool, refresh_profile_in_background, SessionLocal)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    init_db()
-    logger.info("Database initialized")
+    # Только проверка версии схемы: миграции применяет python migrations.py upgrade
+    await check_schema()
+    logger.info("Database schema is up to date")
+    refresh_scheduler.start()
+    loop_lag_monitor.start()
+    profile_history.start()
+    cohort_stats.start()
     yield
-    # Shutdown (если нужно что-то сделать при остановке)
+    # Shutdown
+    for task in pending_report_tasks:
+        task.cancel()
+    await asyncio.gather(*pending_report_tasks, return_exceptions=True)
+    await loop_lag_monitor.stop()
+    await profile_history.stop()
+    await cohort_stats.stop()
+    await refresh_scheduler.stop()
+    await browser_pool.close()
+    if gpt_analyzer is not None:
+        await gpt_analyzer.close()
+    await engine.dispose()
 
 
 # FastAPI приложение
@@ -79,12 +374,55 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """
+    Возвращает внутренние метрики сервера
+    
+    Returns:
+        dict: Состояние пула браузера, фонового обновления, стратегий получения данных,
+              текущие адаптивные таймауты, статистика кэша отчетов и объединенных запросов,
+              задержка event loop, вызовы LLM, квота и размыкатель цепи LLM,
+              пул соединений с базой
+    """
+    return {
+        "browser_pool": browser_pool.stats(),
+        "refresh_scheduler": refresh_scheduler.stats(),
+        "capture": profile_capture.stats(),
+        "timeouts": latency_tracker.stats(),
+        "report_cache": report_cache.stats(),
+        "report_sections": report_sections.stats(),
+        "profile_history": profile_history.stats(),
+        "cohort_stats": cohort_stats.stats(),
+        "single_flight": single_flight.stats(),
+        "event_loop": loop_lag_monitor.stats(),
+        "llm": llm_metrics.stats(),
+        "llm_resilience": gpt_analyzer.resilience_stats() if gpt_analyzer else None,
+        "pending_final_reports": len(pending_report_tasks),
+        "db_pool": pool_metrics.stats()
+    }
+
+
+@app.get("/api/llm-calls/summary")
+async def get_llm_calls_summary(hours: float = 24, db: AsyncSession = Depends(get_db)):
+    """
+    Сводка вызовов LLM из базы: число вызовов, токены, стоимость и задержки по моделям,
+    ошибки по классам
+    
+    Args:
+        hours: За сколько последних часов
+    """
+    return await LLMMetrics.summary(db, hours)
+
+
 @app.post("/api/analyze")
 async def analyze_instagram(
     username: str = Form(...),
     screenshot: UploadFile = File(...),
     screenshot_type: str = Form(None),  # Тип скриншота: main_page или stats
-    db: Session = Depends(get_db)
+    force_refresh: bool = False,
+    depth: str = None,
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Анализирует скриншот Instagram профиля и сохраняет данные в базу
@@ -92,10 +430,14 @@ async def analyze_instagram(
     Args:
         username: Username Instagram пользователя
         screenshot: Файл скриншота статистики
+        force_refresh: Сгенерировать отчет заново, не используя кэш
+        depth: Глубина отчета: short, standard или full
         
     Returns:
         dict: Результат анализа
     """
+    validate_depth(depth)
+    
     try:
         # Сохраняем загруженный файл
         screenshot_type_suffix = f"_{screenshot_type}" if screenshot_type else ""
@@ -122,50 +464,24 @@ async def analyze_instagram(
                 'engagement_rate': None
             }
         
-        # Сохраняем или обновляем данные в базе
-        profile = db.query(InstagramProfile).filter(
-            InstagramProfile.username == username
-        ).first()
-        
-        if profile:
-            # Обновляем существующий профиль
-            profile.followers = parsed_data.get('followers', 0)
-            profile.following = parsed_data.get('following', 0)
-            profile.posts_count = parsed_data.get('posts_count', 0)
-            profile.bio = parsed_data.get('bio')
-            profile.engagement_rate = parsed_data.get('engagement_rate')
-            profile.screenshot_path = file_path
-            # Сохраняем дополнительные данные из скриншота
-            profile.views = parsed_data.get('views', 0)
-            profile.interactions = parsed_data.get('interactions', 0)
-            profile.new_followers = parsed_data.get('new_followers', 0)
-            profile.messages = parsed_data.get('messages', 0)
-            profile.shares = parsed_data.get('shares', 0)
-            profile.analyzed_at = datetime.utcnow()
-            profile.updated_at = datetime.utcnow()
-        else:
-            # Создаем новый профиль
-            profile = InstagramProfile(
-                username=username,
-                followers=parsed_data.get('followers', 0),
-                following=parsed_data.get('following', 0),
-                posts_count=parsed_data.get('posts_count', 0),
-                bio=parsed_data.get('bio'),
-                engagement_rate=parsed_data.get('engagement_rate'),
-                screenshot_path=file_path,
-                # Сохраняем дополнительные данные из скриншота
-                views=parsed_data.get('views', 0),
-                interactions=parsed_data.get('interactions', 0),
-                new_followers=parsed_data.get('new_followers', 0),
-                messages=parsed_data.get('messages', 0),
-                shares=parsed_data.get('shares', 0),
-                analyzed_at=datetime.utcnow()
-            )
-            db.add(profile)
-        
         try:
-            db.commit()
-            db.refresh(profile)
+            # Создаем или обновляем профиль одним запросом
+            profile = await upsert_profile(db, username, {
+                "followers": parsed_data.get('followers', 0),
+                "following": parsed_data.get('following', 0),
+                "posts_count": parsed_data.get('posts_count', 0),
+                "bio": parsed_data.get('bio'),
+                "engagement_rate": parsed_data.get('engagement_rate'),
+                "screenshot_path": file_path,
+                # Сохраняем дополнительные данные из скриншота
+                "views": parsed_data.get('views', 0),
+                "interactions": parsed_data.get('interactions', 0),
+                "new_followers": parsed_data.get('new_followers', 0),
+                "messages": parsed_data.get('messages', 0),
+                "shares": parsed_data.get('shares', 0),
+                "analyzed_at": datetime.utcnow()
+            })
+            await profile_history.record(profile, "analyze")
             
             # Генерируем детальный отчет
             profile_dict = {
@@ -191,7 +507,7 @@ async def analyze_instagram(
             analyzer = get_gpt_analyzer()
             if analyzer and analyzer.client:
                 try:
-                    gpt_reports = analyzer.generate_report(profile_dict, screenshot_data)
+                    gpt_reports = await generate_report_cached(analyzer, db, profile_dict, screenshot_data, force_refresh, depth)
                 except Exception as e:
                     logger.error(f"Ошибка генерации GPT отчета: {e}")
                     gpt_reports = {"ru": "", "en": ""}
@@ -200,11 +516,7 @@ async def analyze_instagram(
             
             # Сохраняем GPT отчеты в базу
             if gpt_reports.get("ru") or gpt_reports.get("en"):
-                profile.report_ru = gpt_reports.get("ru")
-                profile.report_en = gpt_reports.get("en")
-                profile.report_generated_at = datetime.utcnow()
-                db.commit()
-                db.refresh(profile)
+                await save_report(db, username, gpt_reports, analyzer.model, PROMPT_VERSION)
                 logger.info("GPT отчеты сохранены в базу данных")
             else:
                 logger.warning(f"GPT отчет не был сгенерирован для {username}. Проверьте OPENAI_API_KEY.")
@@ -217,10 +529,11 @@ async def analyze_instagram(
                 "report": {
                     "ru": gpt_reports.get("ru") or "",
                     "en": gpt_reports.get("en") or ""
-                }
+                },
+                "report_cached": gpt_reports.get("cached", False)
             }
         except IntegrityError as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Ошибка целостности данных: {e}")
             raise HTTPException(status_code=400, detail="Ошибка при сохранении данных")
             
@@ -229,112 +542,99 @@ async def analyze_instagram(
         raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(e)}")
 
 
+async def capture_and_save_profile(username: str, capture_strategy: Optional[str], db: AsyncSession) -> tuple:
+    """
+    Получает актуальные данные профиля по стратегии и сохраняет их в базу
+    
+    Если данные получить не удалось, используется существующий профиль
+    (или создается пустой), чтобы GPT анализ все равно был выполнен
+    
+    Args:
+        username: Username Instagram пользователя
+        capture_strategy: Стратегия получения данных (None - по умолчанию)
+        db: Сессия базы данных
+        
+    Returns:
+        tuple: (InstagramProfile, информация о стратегии получения данных или None)
+    """
+    capture_info = None
+    
+    # ВСЕГДА получаем актуальные данные профиля через скриншот перед GPT анализом
+    # Это гарантирует, что GPT получит свежие данные для анализа
+    logger.info(f"Получение актуальных данных профиля {username} для GPT анализа")
+    
+    try:
+        # Получаем данные по стратегии (HTML скрапинг и/или скриншот + OCR)
+        capture = await profile_capture.capture(username, strategy=capture_strategy)
+        parsed_data = capture["data"]
+        screenshot_path = capture["screenshot_path"]
+        capture_info = capture["capture"]
+        logger.info(f"Результаты получения данных для {username}: followers={parsed_data.get('followers')}, posts={parsed_data.get('posts_count')}, bio={bool(parsed_data.get('bio'))}")
+        
+        # Создаем профиль или обновляем существующий актуальными данными
+        metrics = {
+            "followers": parsed_data.get('followers', 0),
+            "following": parsed_data.get('following', 0),
+            "posts_count": parsed_data.get('posts_count', 0),
+            "bio": parsed_data.get('bio'),
+            "engagement_rate": parsed_data.get('engagement_rate')
+        }
+        if screenshot_path:
+            metrics["screenshot_path"] = screenshot_path
+        profile = await upsert_profile(db, username, metrics)
+        await profile_history.record(profile, "link")
+        logger.info(f"Данные профиля {username} получены и обновлены: {profile.followers} подписчиков, {profile.posts_count} постов, bio: {bool(profile.bio)}")
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Ошибка при получении данных профиля через скриншот: {e}")
+        # Если не удалось получить данные, используем профиль с существующими данными
+        # (или создаем пустой) - один запрос, строка существующего профиля не меняется
+        profile = await upsert_profile(db, username, {})
+        logger.warning(f"Используем существующие данные профиля {username} для GPT анализа")
+    
+    return profile, capture_info
+
+
 @app.post("/api/analyze-link-only/{username}")
-async def analyze_link_only(username: str, db: Session = Depends(get_db)):
+async def analyze_link_only(username: str, capture_strategy: str = None, force_refresh: bool = False, depth: str = None, draft: bool = False):
     """
     Анализирует профиль только по ссылке (без скриншота статистики)
     Создает или обновляет профиль и генерирует GPT отчет на основе публичных данных
+    Одновременные запросы для одного username выполняются один раз
+    
+    Если GPT анализатор недоступен, возвращается черновой отчет по правилам (report_status=draft)
     
     Args:
         username: Username Instagram пользователя
+        capture_strategy: Стратегия получения данных: sequential, hedged или parallel
+        force_refresh: Сгенерировать отчет заново, не используя кэш
+        depth: Глубина отчета: short, standard или full
+        draft: Не ждать генерации: вернуть отчет из кэша или сохраненный итоговый отчет,
+               а если его нет - черновой; GPT отчет генерируется в фоне (готовый отчет
+               появится в GET /api/data/{username} с report_status=final)
         
     Returns:
-        dict: Данные профиля с GPT отчетом
+        dict: Данные профиля с GPT или черновым отчетом
     """
+    if capture_strategy and capture_strategy not in CAPTURE_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Неизвестная стратегия: {capture_strategy}. Доступны: {', '.join(CAPTURE_STRATEGIES)}")
+    validate_depth(depth)
+    
+    operation = "analyze-link-only:draft" if draft else "analyze-link-only"
+    return await run_single_flight(operation, username, _analyze_link_only, capture_strategy, force_refresh, depth, draft)
+
+
+async def _analyze_link_only(db: AsyncSession, username: str, capture_strategy: Optional[str], force_refresh: bool, depth: Optional[str], draft: bool = False) -> dict:
+    """Анализ профиля только по ссылке (одно выполнение на username)"""
     try:
-        # Проверяем, есть ли профиль в базе
-        profile = db.query(InstagramProfile).filter(
-            InstagramProfile.username == username
-        ).first()
-        
-        # ВСЕГДА получаем актуальные данные профиля через скриншот перед GPT анализом
-        # Это гарантирует, что GPT получит свежие данные для анализа
-        logger.info(f"Получение актуальных данных профиля {username} для GPT анализа")
-        
-        try:
-            # ПРИОРИТЕТ 1: Извлекаем данные напрямую из HTML (быстрее и точнее чем OCR)
-            logger.info(f"Извлечение данных профиля {username} из HTML")
-            try:
-                parsed_data = await profile_scraper.scrape_profile_data(username)
-                logger.info(f"Данные извлечены из HTML для {username}: followers={parsed_data.get('followers')}, posts={parsed_data.get('posts_count')}, bio={bool(parsed_data.get('bio'))}")
-                
-                # Если данные не извлечены, используем скриншот как fallback
-                if parsed_data.get('followers', 0) == 0 and parsed_data.get('posts_count', 0) == 0:
-                    logger.info(f"Данные из HTML неполные, используем скриншот как fallback для {username}")
-                    screenshot_path = await screenshot_service.take_profile_screenshot(username)
-                    screenshot_data = parser.parse_screenshot(screenshot_path)
-                    # Объединяем данные (приоритет HTML, затем скриншот)
-                    parsed_data = {**screenshot_data, **{k: v for k, v in parsed_data.items() if v}}
-            except Exception as scrape_error:
-                logger.warning(f"Ошибка при извлечении данных из HTML: {scrape_error}, используем скриншот")
-                # Fallback на скриншот
-                screenshot_path = await screenshot_service.take_profile_screenshot(username)
-                parsed_data = parser.parse_screenshot(screenshot_path)
-                logger.info(f"Результаты парсинга скриншота для {username}: followers={parsed_data.get('followers')}, posts={parsed_data.get('posts_count')}, bio={bool(parsed_data.get('bio'))}")
-            
-            if not profile:
-                # Создаем новый профиль с данными
-                profile = InstagramProfile(
-                    username=username,
-                    followers=parsed_data.get('followers', 0),
-                    following=parsed_data.get('following', 0),
-                    posts_count=parsed_data.get('posts_count', 0),
-                    bio=parsed_data.get('bio'),
-                    engagement_rate=parsed_data.get('engagement_rate'),
-                    screenshot_path=screenshot_path
-                )
-                db.add(profile)
-            else:
-                # Обновляем существующий профиль актуальными данными
-                profile.followers = parsed_data.get('followers', 0)
-                profile.following = parsed_data.get('following', 0)
-                profile.posts_count = parsed_data.get('posts_count', 0)
-                profile.bio = parsed_data.get('bio')
-                profile.engagement_rate = parsed_data.get('engagement_rate')
-                profile.screenshot_path = screenshot_path
-                profile.updated_at = datetime.utcnow()
-            
-            db.commit()
-            db.refresh(profile)
-            logger.info(f"Данные профиля {username} получены и обновлены: {profile.followers} подписчиков, {profile.posts_count} постов, bio: {bool(profile.bio)}")
-        except Exception as e:
-            logger.error(f"Ошибка при получении данных профиля через скриншот: {e}")
-            # Если не удалось получить данные, создаем/используем профиль с существующими данными
-            if not profile:
-                profile = InstagramProfile(
-                    username=username,
-                    followers=0,
-                    following=0,
-                    posts_count=0,
-                    bio=None,
-                    engagement_rate=None
-                )
-                db.add(profile)
-                db.commit()
-                db.refresh(profile)
-            logger.warning(f"Используем существующие данные профиля {username} для GPT анализа")
+        profile, capture_info = await capture_and_save_profile(username, capture_strategy, db)
         
         # ВАЖНО: GPT анализ выполняется ВСЕГДА, даже если данные неполные
         # GPT может проанализировать аккаунт на основе биографии и других доступных данных
         logger.info(f"Подготовка данных для GPT анализа {username}: followers={profile.followers}, posts={profile.posts_count}, bio={bool(profile.bio)}")
         
         # Используем актуальные данные профиля
-        profile_dict = {
-            "username": profile.username,
-            "followers": profile.followers,
-            "following": profile.following,
-            "posts_count": profile.posts_count,
-            "bio": profile.bio,
-            "engagement_rate": profile.engagement_rate
-        }
-        
-        screenshot_data = {
-            "views": profile.views,
-            "interactions": profile.interactions,
-            "new_followers": profile.new_followers,
-            "messages": profile.messages,
-            "shares": profile.shares
-        }
+        profile_dict, screenshot_data = build_prompt_data(profile)
         
         # ВАЖНО: Генерируем GPT отчет на основе актуальных данных профиля
         # GPT анализ ВСЕГДА выполняется перед возвратом результата
@@ -342,42 +642,35 @@ async def analyze_link_only(username: str, db: Session = Depends(get_db)):
         
         analyzer = get_gpt_analyzer()
         if not analyzer or not analyzer.client:
-            logger.error("GPT анализатор недоступен. Проверьте OPENAI_API_KEY.")
-            raise HTTPException(status_code=503, detail="GPT анализатор недоступен. Проверьте OPENAI_API_KEY.")
-        
-        try:
-            logger.info(f"Генерация GPT отчета для {username} (анализ только по ссылке)")
-            gpt_reports = analyzer.generate_report(profile_dict, screenshot_data)
-            
-            # Проверяем, что отчет был сгенерирован
-            if not gpt_reports.get("ru") and not gpt_reports.get("en"):
-                logger.error(f"GPT отчет не был сгенерирован для {username}")
-                raise HTTPException(status_code=500, detail="GPT отчет не был сгенерирован. Попробуйте позже.")
-            
-            logger.info(f"GPT отчет успешно сгенерирован для {username}, длина: {len(gpt_reports.get('ru', ''))} символов")
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Ошибка генерации GPT отчета для {username}: {e}")
-            raise HTTPException(status_code=500, detail=f"Ошибка генерации GPT отчета: {str(e)}")
+            logger.error("GPT анализатор недоступен. Проверьте OPENAI_API_KEY. Возвращается черновой отчет")
+            gpt_reports = draft_reports(profile)
+        elif draft:
+            # Готовый отчет (кэш или сохраненный итоговый) лучше черновика; черновик
+            # отдается, только если его нет, и GPT отчет заменит его по готовности
+            gpt_reports = await stored_final_report(analyzer, db, profile, profile_dict, screenshot_data, force_refresh, depth)
+            if gpt_reports is None:
+                gpt_reports = draft_reports(profile)
+            if not gpt_reports.get("cached"):
+                schedule_final_report(username, force_refresh, depth)
+        else:
+            gpt_reports = await _generate_link_only_report(analyzer, db, profile, profile_dict, screenshot_data, force_refresh, depth)
         
-        # Сохраняем GPT отчет в базу данных
+        # Сохраняем отчет в базу данных
         if gpt_reports.get("ru") or gpt_reports.get("en"):
-            # Сохраняем GPT отчет в базу
-            profile.report_ru = gpt_reports.get("ru")
-            profile.report_en = gpt_reports.get("en")
-            profile.report_generated_at = datetime.utcnow()
-            profile.analyzed_at = datetime.utcnow()
-            db.commit()
-            db.refresh(profile)
+            # Сохраненный ранее отчет не перезаписываем, черновик - только поверх черновика
+            profile = await store_report(db, profile, gpt_reports, analyzer.model if analyzer else None, analyzed=True)
             
             profile_dict["report"] = {
                 "ru": gpt_reports.get("ru") or "",
                 "en": gpt_reports.get("en") or ""
             }
-            profile_dict["report_generated_at"] = profile.report_generated_at.isoformat()
+            profile_dict["report_generated_at"] = profile.report_generated_at.isoformat() if profile.report_generated_at else None
             profile_dict["analyzed_at"] = profile.analyzed_at.isoformat()
             profile_dict["screenshot_data"] = screenshot_data
+            profile_dict["capture"] = capture_info
+            profile_dict["report_cached"] = gpt_reports.get("cached", False)
+            profile_dict["report_stale"] = gpt_reports.get("stale", False)
+            profile_dict["report_status"] = report_status(gpt_reports)
             
             return {
                 "success": True,
@@ -390,32 +683,187 @@ async def analyze_link_only(username: str, db: Session = Depends(get_db)):
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Ошибка при анализе профиля только по ссылке: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
 
+async def _generate_link_only_report(analyzer: GPTAnalyzer, db: AsyncSession, profile: InstagramProfile, profile_dict: dict, screenshot_data: dict, force_refresh: bool, depth: Optional[str]) -> dict:
+    """GPT отчет для анализа по ссылке; при недоступности провайдера - сохраненный или черновой"""
+    username = profile.username
+    try:
+        logger.info(f"Генерация GPT отчета для {username} (анализ только по ссылке)")
+        gpt_reports = await generate_report_cached(analyzer, db, profile_dict, screenshot_data, force_refresh, depth)
+        if not gpt_reports.get("ru") and not gpt_reports.get("en") and gpt_reports.get("retry_after") is not None:
+            gpt_reports = await degraded_report(db, profile, gpt_reports)
+        
+        # Проверяем, что отчет был сгенерирован
+        if not gpt_reports.get("ru") and not gpt_reports.get("en"):
+            logger.error(f"GPT отчет не был сгенерирован для {username}")
+            raise HTTPException(status_code=500, detail="GPT отчет не был сгенерирован. Попробуйте позже.")
+        
+        logger.info(f"GPT отчет успешно сгенерирован для {username}, длина: {len(gpt_reports.get('ru', ''))} символов")
+        return gpt_reports
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка генерации GPT отчета для {username}: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка генерации GPT отчета: {str(e)}")
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Форматирует событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/analyze-link-only/{username}/stream")
+async def analyze_link_only_stream(username: str, capture_strategy: str = None, force_refresh: bool = False, depth: str = None):
+    """
+    Анализирует профиль только по ссылке и передает GPT отчет потоком (Server-Sent Events)
+    
+    События:
+        status: текущий этап (capture, report)
+        profile: актуальные данные профиля
+        draft: черновой отчет по правилам (сразу, до первого токена GPT отчета)
+        token: очередной фрагмент текста отчета
+        done: итоговые данные профиля, отчет сохранен в report_ru
+        error: описание ошибки
+    
+    Args:
+        username: Username Instagram пользователя
+        capture_strategy: Стратегия получения данных: sequential, hedged или parallel
+        force_refresh: Сгенерировать отчет заново, не используя кэш
+        depth: Глубина отчета: short, standard или full
+    """
+    if capture_strategy and capture_strategy not in CAPTURE_STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Неизвестная стратегия: {capture_strategy}. Доступны: {', '.join(CAPTURE_STRATEGIES)}")
+    validate_depth(depth)
+    
+    analyzer = get_gpt_analyzer()
+    if not analyzer or not analyzer.client:
+        # Вместо 503 поток отдаст черновой отчет по правилам
+        logger.error("GPT анализатор недоступен. Проверьте OPENAI_API_KEY.")
+        analyzer = None
+    
+    async def event_stream():
+        # Собственная сессия: поток живет дольше зависимостей запроса
+        db = SessionLocal()
+        try:
+            yield sse_event("status", {"stage": "capture", "username": username})
+            profile, capture_info = await capture_and_save_profile(username, capture_strategy, db)
+            profile_dict, screenshot_data = build_prompt_data(profile)
+            yield sse_event("profile", {**profile_dict, "screenshot_data": screenshot_data, "capture": capture_info})
+            
+            yield sse_event("status", {"stage": "report"})
+            cached = None
+            previous_sections = None
+            fingerprint = analyzer.report_fingerprint(profile_dict, screenshot_data, depth) if analyzer else None
+            if analyzer and force_refresh:
+                report_cache.record_bypass()
+            elif analyzer:
+                cached = await report_cache.get(db, fingerprint)
+                previous_sections = None if cached else await report_sections.load(db, username)
+            
+            if analyzer is None:
+                gpt_reports = draft_reports(profile)
+                yield sse_event("token", {"text": gpt_reports["ru"]})
+            elif cached:
+                gpt_reports = cached
+                yield sse_event("token", {"text": cached["ru"]})
+            else:
+                # Черновик показывается, пока не придут первые токены GPT отчета
+                yield sse_event("draft", {"text": draft_reports(profile)["ru"]})
+                chunks = []
+                call_meta = {}
+                streamed_reports = {}
+                try:
+                    async for delta in analyzer.stream_report(profile_dict, screenshot_data, depth=depth, meta=call_meta, reports=streamed_reports, previous_sections=previous_sections):
+                        chunks.append(delta)
+                        yield sse_event("token", {"text": delta})
+                    gpt_reports = {**streamed_reports, "meta": call_meta}
+                except Exception as e:
+                    # Провайдер временно недоступен и текст еще не отправлен: сохраненный или черновой отчет
+                    retry_after = analyzer.retry_after_hint(e)
+                    if retry_after is None or chunks:
+                        raise
+                    gpt_reports = await degraded_report(db, profile, {"retry_after": retry_after})
+                    yield sse_event("token", {"text": gpt_reports["ru"]})
+                if gpt_reports["ru"] and not gpt_reports.get("stale") and not gpt_reports.get("draft"):
+                    await report_cache.put(db, fingerprint, username, analyzer.model, PROMPT_VERSION, gpt_reports)
+                    await save_report_sections(db, username, gpt_reports, analyzer.model)
+            
+            if not gpt_reports.get("ru") and not gpt_reports.get("en"):
+                logger.error(f"GPT отчет не был сгенерирован для {username}")
+                yield sse_event("error", {"detail": "GPT отчет не был сгенерирован. Попробуйте позже."})
+                return
+            
+            # Сохраняем итоговый текст отчета в базу
+            profile = await store_report(db, profile, gpt_reports, analyzer.model if analyzer else None, analyzed=True)
+            logger.info(f"Потоковый GPT отчет сохранен для {username}, длина: {len(gpt_reports.get('ru', ''))} символов")
+            
+            yield sse_event("done", {
+                **profile_dict,
+                "report": {
+                    "ru": gpt_reports.get("ru") or "",
+                    "en": gpt_reports.get("en") or ""
+                },
+                "report_generated_at": profile.report_generated_at.isoformat() if profile.report_generated_at else None,
+                "analyzed_at": profile.analyzed_at.isoformat(),
+                "screenshot_data": screenshot_data,
+                "capture": capture_info,
+                "report_cached": cached is not None,
+                "report_stale": gpt_reports.get("stale", False),
+                "report_status": report_status(gpt_reports)
+            })
+        except HTTPException as e:
+            await db.rollback()
+            logger.error(f"Ошибка при потоковом анализе профиля {username}: {e.detail}")
+            yield sse_event("error", {"detail": e.detail, "retry_after": (e.headers or {}).get("Retry-After")})
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Ошибка при потоковом анализе профиля {username}: {e}")
+            yield sse_event("error", {"detail": f"Ошибка: {str(e)}"})
+        finally:
+            await db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.post("/api/screenshot/{username}")
-async def create_screenshot(username: str, db: Session = Depends(get_db)):
+async def create_screenshot(username: str, force_refresh: bool = False, depth: str = None):
     """
     Создает скриншот главной страницы Instagram профиля
+    Одновременные запросы для одного username выполняются один раз
     
     Args:
         username: Username Instagram профиля
+        force_refresh: Сгенерировать отчет заново, не используя кэш
+        depth: Глубина отчета: short, standard или full
         
     Returns:
         dict: Результат создания скриншота
     """
+    validate_depth(depth)
+    
+    # Извлекаем username из текста (может быть URL)
+    if 'instagram.com' in username:
+        import re
+        match = re.search(r'instagram\.com/([^/?&#]+)', username)
+        if match:
+            username = match.group(1)
+    
+    username = username.lstrip('@').strip()
+    
+    return await run_single_flight("screenshot", username, _create_screenshot, force_refresh, depth)
+
+
+async def _create_screenshot(db: AsyncSession, username: str, force_refresh: bool, depth: Optional[str]) -> dict:
+    """Создание скриншота, парсинг и GPT отчет (одно выполнение на username)"""
     try:
-        # Извлекаем username из текста (может быть URL)
-        if 'instagram.com' in username:
-            import re
-            match = re.search(r'instagram\.com/([^/?&#]+)', username)
-            if match:
-                username = match.group(1)
-        
-        username = username.lstrip('@').strip()
-        
         logger.info(f"Создание скриншота для: {username}")
         
         # Создаем скриншот
@@ -426,44 +874,21 @@ async def create_screenshot(username: str, db: Session = Depends(get_db)):
         
         # Сохраняем в базу данных
         try:
-            profile = db.query(InstagramProfile).filter(
-                InstagramProfile.username == username
-            ).first()
-            
-            if profile:
-                # Обновляем существующий профиль
-                profile.followers = parsed_data.get('followers', 0)
-                profile.following = parsed_data.get('following', 0)
-                profile.posts_count = parsed_data.get('posts_count', 0)
-                profile.bio = parsed_data.get('bio')
-                profile.engagement_rate = parsed_data.get('engagement_rate')
-                profile.screenshot_path = screenshot_path
-                profile.views = parsed_data.get('views', 0)
-                profile.interactions = parsed_data.get('interactions', 0)
-                profile.new_followers = parsed_data.get('new_followers', 0)
-                profile.messages = parsed_data.get('messages', 0)
-                profile.shares = parsed_data.get('shares', 0)
-                profile.updated_at = datetime.utcnow()
-            else:
-                # Создаем новый профиль
-                profile = InstagramProfile(
-                    username=username,
-                    followers=parsed_data.get('followers', 0),
-                    following=parsed_data.get('following', 0),
-                    posts_count=parsed_data.get('posts_count', 0),
-                    bio=parsed_data.get('bio'),
-                    engagement_rate=parsed_data.get('engagement_rate'),
-                    screenshot_path=screenshot_path,
-                    views=parsed_data.get('views', 0),
-                    interactions=parsed_data.get('interactions', 0),
-                    new_followers=parsed_data.get('new_followers', 0),
-                    messages=parsed_data.get('messages', 0),
-                    shares=parsed_data.get('shares', 0)
-                )
-                db.add(profile)
-            
-            db.commit()
-            db.refresh(profile)
+            # Создаем или обновляем профиль одним запросом
+            profile = await upsert_profile(db, username, {
+                "followers": parsed_data.get('followers', 0),
+                "following": parsed_data.get('following', 0),
+                "posts_count": parsed_data.get('posts_count', 0),
+                "bio": parsed_data.get('bio'),
+                "engagement_rate": parsed_data.get('engagement_rate'),
+                "screenshot_path": screenshot_path,
+                "views": parsed_data.get('views', 0),
+                "interactions": parsed_data.get('interactions', 0),
+                "new_followers": parsed_data.get('new_followers', 0),
+                "messages": parsed_data.get('messages', 0),
+                "shares": parsed_data.get('shares', 0)
+            })
+            await profile_history.record(profile, "screenshot")
             
             # Генерируем GPT отчет
             profile_dict = {
@@ -487,7 +912,7 @@ async def create_screenshot(username: str, db: Session = Depends(get_db)):
             analyzer = get_gpt_analyzer()
             if analyzer and analyzer.client:
                 try:
-                    gpt_reports = analyzer.generate_report(profile_dict, screenshot_data)
+                    gpt_reports = await generate_report_cached(analyzer, db, profile_dict, screenshot_data, force_refresh, depth)
                 except Exception as e:
                     logger.error(f"Ошибка генерации GPT отчета: {e}")
                     gpt_reports = {"ru": "", "en": ""}
@@ -496,11 +921,7 @@ async def create_screenshot(username: str, db: Session = Depends(get_db)):
             
             # Сохраняем GPT отчеты в базу
             if gpt_reports.get("ru") or gpt_reports.get("en"):
-                profile.report_ru = gpt_reports.get("ru")
-                profile.report_en = gpt_reports.get("en")
-                profile.report_generated_at = datetime.utcnow()
-                db.commit()
-                db.refresh(profile)
+                await save_report(db, username, gpt_reports, analyzer.model, PROMPT_VERSION)
             
             return {
                 "success": True,
@@ -518,11 +939,12 @@ async def create_screenshot(username: str, db: Session = Depends(get_db)):
                         "ru": gpt_reports.get("ru") or "",
                         "en": gpt_reports.get("en") or ""
                     },
-                    "report_generated_at": profile.report_generated_at.isoformat() if profile.report_generated_at else None
+                    "report_generated_at": profile.report_generated_at.isoformat() if profile.report_generated_at else None,
+                    "report_cached": gpt_reports.get("cached", False)
                 }
             }
         except IntegrityError as e:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Ошибка при сохранении в БД: {e}")
             raise HTTPException(status_code=400, detail="Ошибка при сохранении данных")
             
@@ -532,7 +954,7 @@ async def create_screenshot(username: str, db: Session = Depends(get_db)):
 
 
 @app.get("/api/data/{username}")
-async def get_user_data(username: str, db: Session = Depends(get_db)):
+async def get_user_data(username: str, db: AsyncSession = Depends(get_db)):
     """
     Получает данные пользователя из базы данных
     
@@ -544,9 +966,11 @@ async def get_user_data(username: str, db: Session = Depends(get_db)):
     """
     try:
         logger.info(f"Запрос данных для профиля: {username}")
-        profile = db.query(InstagramProfile).filter(
-            InstagramProfile.username == username
-        ).first()
+        profile = await db.scalar(
+            select(InstagramProfile)
+            .options(undefer_group(REPORT_TEXT_GROUP))
+            .where(InstagramProfile.username == username)
+        )
         
         logger.info(f"Профиль найден: {profile is not None}")
         
@@ -574,9 +998,13 @@ async def get_user_data(username: str, db: Session = Depends(get_db)):
                     "ru": "",
                     "en": ""
                 },
-                "report_generated_at": None
+                "report_generated_at": None,
+                "report_status": None
             }
         
+        # Учитываем только существующие профили: иначе любые username копились бы в планировщике
+        refresh_scheduler.record_view(username)
+        
         # Формируем базовый словарь с безопасной обработкой всех полей
         profile_dict = {
             "username": str(profile.username) if profile.username else "",
@@ -624,12 +1052,14 @@ async def get_user_data(username: str, db: Session = Depends(get_db)):
                     profile_dict["report_generated_at"] = profile.report_generated_at.isoformat() if profile.report_generated_at else None
                 except:
                     profile_dict["report_generated_at"] = None
+                profile_dict["report_status"] = profile.report_status or REPORT_STATUS_FINAL
             else:
                 profile_dict["report"] = {
                     "ru": "",
                     "en": ""
                 }
                 profile_dict["report_generated_at"] = None
+                profile_dict["report_status"] = None
         except Exception as e:
             logger.warning(f"Ошибка при обработке отчета для {username}: {e}")
             profile_dict["report"] = {"ru": "", "en": ""}
@@ -645,14 +1075,51 @@ async def get_user_data(username: str, db: Session = Depends(get_db)):
 
 
 @app.get("/api/users")
-async def get_all_users(db: Session = Depends(get_db)):
+async def get_all_users(
+    limit: int = USERS_PAGE_SIZE,
+    cursor: str = None,
+    sort: str = "updated_at",
+    order: str = "desc",
+    has_report: Optional[bool] = None,
+    min_followers: Optional[int] = None,
+    q: str = None,
+    db: AsyncSession = Depends(get_db)
+):
     """
-    Получает список всех пользователей
+    Получает страницу списка пользователей (keyset пагинация)
     
+    Args:
+        limit: Размер страницы (не больше USERS_PAGE_SIZE_MAX)
+        cursor: next_cursor из предыдущего ответа
+        sort: Колонка сортировки: updated_at, created_at или followers
+        order: desc или asc
+        has_report: Только профили с отчетом (true) или без него (false)
+        min_followers: Минимальное число подписчиков
+        q: Начало username
+        
     Returns:
-        dict: Список всех пользователей с дополнительными данными
+        dict: Пользователи страницы, next_cursor (None - последняя страница) и has_more
     """
-    profiles = db.query(InstagramProfile).all()
+    if sort not in PROFILE_SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Неизвестная сортировка: {sort}. Доступны: {', '.join(PROFILE_SORT_COLUMNS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order должен быть asc или desc")
+    if limit < 1 or limit > USERS_PAGE_SIZE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {USERS_PAGE_SIZE_MAX}")
+    
+    try:
+        rows, next_cursor = await list_profiles(
+            db,
+            limit,
+            sort=sort,
+            descending=order == "desc",
+            cursor=cursor,
+            has_report=has_report,
+            min_followers=min_followers,
+            username_prefix=q
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     return {
         "users": [
@@ -670,18 +1137,172 @@ async def get_all_users(db: Session = Depends(get_db)):
                 "shares": p.shares,
                 "analyzed_at": p.analyzed_at.isoformat() if p.analyzed_at else None,
                 "updated_at": p.updated_at.isoformat() if p.updated_at else None,
-                "has_gpt_report": bool(p.report_ru or p.report_en),
-                "report_generated_at": p.report_generated_at.isoformat() if p.report_generated_at else None
+                "has_gpt_report": bool(p.has_gpt_report),
+                "report_generated_at": p.report_generated_at.isoformat() if p.report_generated_at else None,
+                "report_status": p.report_status
             }
-            for p in profiles
+            for p in rows
+        ],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None
+    }
+
+
+@app.get("/api/data/{username}/history")
+async def get_profile_history(
+    username: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    resolution: str = None,
+    limit: int = 1000,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    История метрик профиля за период
+    
+    Свежие точки - снимки каждого анализа, более старые - свертки по дням и неделям
+    
+    Args:
+        username: Username Instagram пользователя
+        since: Начало периода (по умолчанию - 90 дней назад)
+        until: Конец периода (по умолчанию - сейчас)
+        resolution: Только точки этого разрешения: raw, day или week
+        limit: Максимум точек (не больше 5000)
+        
+    Returns:
+        dict: Точки истории по возрастанию времени и изменение метрик за период
+    """
+    if resolution and resolution not in (SNAPSHOT_RAW, SNAPSHOT_DAY, SNAPSHOT_WEEK):
+        raise HTTPException(status_code=400, detail=f"Неизвестное разрешение: {resolution}. Доступны: {SNAPSHOT_RAW}, {SNAPSHOT_DAY}, {SNAPSHOT_WEEK}")
+    if limit < 1 or limit > 5000:
+        raise HTTPException(status_code=400, detail="limit должен быть от 1 до 5000")
+    
+    until = until or datetime.utcnow()
+    since = since or until - timedelta(days=90)
+    snapshots = await profile_history.range(db, username, since, until, resolution, limit)
+    if not snapshots and not await db.scalar(select(InstagramProfile.id).where(InstagramProfile.username == username)):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    change = None
+    if len(snapshots) > 1:
+        first, last = snapshots[0], snapshots[-1]
+        days = (last.captured_at - first.captured_at).total_seconds() / 86400
+        change = {
+            "from": first.captured_at.isoformat(),
+            "to": last.captured_at.isoformat(),
+            **{
+                metric: getattr(last, metric) - getattr(first, metric)
+                for metric in SNAPSHOT_METRICS
+                if getattr(last, metric) is not None and getattr(first, metric) is not None
+            },
+            "followers_per_day": round((last.followers - first.followers) / days, 2)
+            if days > 0 and last.followers is not None and first.followers is not None else None
+        }
+    
+    return {
+        "username": username,
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "points": [snapshot_point(snapshot) for snapshot in snapshots],
+        "change": change
+    }
+
+
+@app.post("/api/history/compact")
+async def compact_profile_history():
+    """
+    Запускает свертку истории метрик вне расписания
+    
+    Returns:
+        dict: Сколько точек свернуто, записано и удалено
+    """
+    return {"status": "success", **await profile_history.compact()}
+
+
+@app.get("/api/data/{username}/percentiles")
+async def get_profile_percentiles(username: str, db: AsyncSession = Depends(get_db)):
+    """
+    Перцентили подписчиков, вовлеченности и просмотров за 30 дней профиля
+    среди проанализированных профилей той же когорты (порядок числа подписчиков)
+    
+    Распределения пересчитываются периодически (см. cohort_stats.py), поэтому
+    только что обновленные метрики могут сравниваться с распределением до обновления
+    
+    Args:
+        username: Username Instagram пользователя
+        
+    Returns:
+        dict: Когорта, перцентили по метрикам в когорте и среди всех профилей, время пересчета
+    """
+    profile = (await db.execute(
+        select(InstagramProfile.followers, InstagramProfile.engagement_rate, InstagramProfile.views)
+        .where(InstagramProfile.username == username)
+    )).first()
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    return {"username": username, **await cohort_stats.percentiles(db, profile)}
+
+
+@app.get("/api/leaderboard")
+async def get_leaderboard(
+    metric: str = "followers",
+    cohort: Optional[int] = None,
+    limit: int = 10,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Топ профилей по метрике
+    
+    Args:
+        metric: followers, engagement_rate или views_30d
+        cohort: Порядок числа подписчиков (3 - 1K-10K, 4 - 10K-100K, ...); не задан - все профили
+        limit: Размер топа (не больше 100)
+        
+    Returns:
+        dict: Профили по убыванию метрики
+    """
+    if metric not in COHORT_METRICS:
+        raise HTTPException(status_code=400, detail=f"Неизвестная метрика: {metric}. Доступны: {', '.join(COHORT_METRICS)}")
+    if cohort is not None and not 0 <= cohort <= 12:
+        raise HTTPException(status_code=400, detail="cohort должен быть от 0 до 12")
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit должен быть от 1 до 100")
+    
+    cohort = COHORT_ALL if cohort is None else cohort
+    rows = await cohort_stats.leaderboard(db, metric, cohort, limit)
+    return {
+        "metric": metric,
+        "cohort": None if cohort == COHORT_ALL else {"scale": cohort, "label": cohort_label(cohort)},
+        "users": [
+            {
+                "rank": rank,
+                "username": row.username,
+                "followers": row.followers,
+                "engagement_rate": row.engagement_rate,
+                "views_30d": row.views
+            }
+            for rank, row in enumerate(rows, start=1)
         ]
     }
 
 
+@app.post("/api/cohort-stats/refresh")
+async def refresh_cohort_stats():
+    """
+    Пересчитывает распределения метрик по когортам вне расписания
+    
+    Returns:
+        dict: Число просмотренных профилей и записанных распределений
+    """
+    return {"status": "success", **await cohort_stats.refresh()}
+
+
 @app.post("/api/data/{username}/update-profile")
-async def update_profile_data(username: str, db: Session = Depends(get_db)):
+async def update_profile_data(username: str):
     """
     Принудительно обновляет данные профиля из скриншота Instagram
+    Одновременные запросы для одного username выполняются один раз
     
     Args:
         username: Username Instagram пользователя
@@ -689,10 +1310,13 @@ async def update_profile_data(username: str, db: Session = Depends(get_db)):
     Returns:
         dict: Обновленные данные профиля
     """
+    return await run_single_flight("update-profile", username, _update_profile_data)
+
+
+async def _update_profile_data(db: AsyncSession, username: str) -> dict:
+    """Обновление данных профиля из скриншота (одно выполнение на username)"""
     try:
-        profile = db.query(InstagramProfile).filter(
-            InstagramProfile.username == username
-        ).first()
+        profile = await db.scalar(select(InstagramProfile).where(InstagramProfile.username == username))
         
         if not profile:
             raise HTTPException(status_code=404, detail="User not found")
@@ -705,21 +1329,23 @@ async def update_profile_data(username: str, db: Session = Depends(get_db)):
         # Парсим скриншот
         parsed_data = parser.parse_screenshot(screenshot_path)
         
-        # Обновляем данные профиля
+        # Обновляем только извлеченные поля профиля
+        values = {}
         if parsed_data.get('followers', 0) > 0:
-            profile.followers = parsed_data.get('followers', profile.followers)
+            values['followers'] = parsed_data['followers']
         if parsed_data.get('following', 0) > 0:
-            profile.following = parsed_data.get('following', profile.following)
+            values['following'] = parsed_data['following']
         if parsed_data.get('posts_count', 0) > 0:
-            profile.posts_count = parsed_data.get('posts_count', profile.posts_count)
+            values['posts_count'] = parsed_data['posts_count']
         if parsed_data.get('bio'):
-            profile.bio = parsed_data.get('bio', profile.bio)
+            values['bio'] = parsed_data['bio']
         if parsed_data.get('engagement_rate'):
-            profile.engagement_rate = parsed_data.get('engagement_rate', profile.engagement_rate)
+            values['engagement_rate'] = parsed_data['engagement_rate']
         
-        profile.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(profile)
+        profile = await update_profile(db, username, values)
+        if not profile:
+            raise HTTPException(status_code=404, detail="User not found")
+        await profile_history.record(profile, "update")
         
         logger.info(f"Данные профиля {username} обновлены: followers={profile.followers}, posts={profile.posts_count}")
         
@@ -739,25 +1365,36 @@ async def update_profile_data(username: str, db: Session = Depends(get_db)):
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Ошибка при обновлении данных профиля: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
 
 @app.post("/api/data/{username}/regenerate-report")
-async def regenerate_gpt_report(username: str, db: Session = Depends(get_db)):
+async def regenerate_gpt_report(username: str, force_refresh: bool = False, depth: str = None):
     """
     Принудительно регенерирует GPT отчет для профиля
     
+    Если данные профиля не изменились с прошлой генерации, отчет берется из кэша
+    (force_refresh=true отключает кэш). Одновременные запросы для одного username
+    выполняются один раз
+    
     Args:
         username: Username Instagram пользователя
+        force_refresh: Сгенерировать отчет заново, не используя кэш
+        depth: Глубина отчета: short, standard или full
         
     Returns:
         dict: Обновленные данные профиля с новым отчетом
     """
-    profile = db.query(InstagramProfile).filter(
-        InstagramProfile.username == username
-    ).first()
+    validate_depth(depth)
+    
+    return await run_single_flight("regenerate-report", username, _regenerate_gpt_report, force_refresh, depth)
+
+
+async def _regenerate_gpt_report(db: AsyncSession, username: str, force_refresh: bool, depth: Optional[str]) -> dict:
+    """Регенерация GPT отчета (одно выполнение на username)"""
+    profile = await db.scalar(select(InstagramProfile).where(InstagramProfile.username == username))
     
     if not profile:
         raise HTTPException(status_code=404, detail="User not found")
@@ -787,21 +1424,38 @@ async def regenerate_gpt_report(username: str, db: Session = Depends(get_db)):
         analyzer = get_gpt_analyzer()
         if analyzer and analyzer.client:
             try:
-                gpt_reports = analyzer.generate_report(profile_dict, screenshot_data)
-                logger.info(f"GPT отчет регенерирован для {username}")
+                gpt_reports = await generate_report_cached(analyzer, db, profile_dict, screenshot_data, force_refresh, depth)
+                if not gpt_reports.get("ru") and not gpt_reports.get("en") and gpt_reports.get("retry_after") is not None:
+                    gpt_reports = await degraded_report(db, profile, gpt_reports)
+                else:
+                    logger.info(f"GPT отчет регенерирован для {username}")
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Ошибка генерации GPT отчета: {e}")
                 raise HTTPException(status_code=500, detail=f"Ошибка генерации отчета: {str(e)}")
         else:
             raise HTTPException(status_code=503, detail="GPT анализатор недоступен. Проверьте OPENAI_API_KEY.")
         
+        if gpt_reports.get("stale") or gpt_reports.get("draft"):
+            profile = await store_report(db, profile, gpt_reports, analyzer.model)
+            profile_dict["report"] = {"ru": gpt_reports["ru"], "en": gpt_reports["en"]}
+            profile_dict["report_generated_at"] = profile.report_generated_at.isoformat() if profile.report_generated_at else None
+            profile_dict["screenshot_data"] = screenshot_data
+            profile_dict["report_stale"] = gpt_reports.get("stale", False)
+            profile_dict["report_status"] = report_status(gpt_reports)
+            kind = "черновой" if gpt_reports.get("draft") else "сохраненный"
+            return {
+                "status": "degraded",
+                "message": f"GPT анализатор временно недоступен, возвращен {kind} отчет. Повторите через {math.ceil(gpt_reports['retry_after'])} с.",
+                "data": profile_dict
+            }
+        
         if gpt_reports.get("ru") or gpt_reports.get("en"):
             # Сохраняем новый отчет в базу
-            profile.report_ru = gpt_reports.get("ru")
-            profile.report_en = gpt_reports.get("en")
-            profile.report_generated_at = datetime.utcnow()
-            db.commit()
-            db.refresh(profile)
+            profile = await save_report(db, username, gpt_reports, analyzer.model, PROMPT_VERSION)
+            if not profile:
+                raise HTTPException(status_code=404, detail="User not found")
             
             profile_dict["report"] = {
                 "ru": gpt_reports.get("ru") or "",
@@ -809,6 +1463,8 @@ async def regenerate_gpt_report(username: str, db: Session = Depends(get_db)):
             }
             profile_dict["report_generated_at"] = profile.report_generated_at.isoformat()
             profile_dict["screenshot_data"] = screenshot_data
+            profile_dict["report_cached"] = gpt_reports.get("cached", False)
+            profile_dict["report_status"] = REPORT_STATUS_FINAL
             
             return {
                 "status": "success",
@@ -825,8 +1481,84 @@ async def regenerate_gpt_report(username: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
 
+@app.post("/api/data/{username}/translate-report")
+async def translate_gpt_report(username: str, force: bool = False):
+    """
+    Заполняет английскую версию отчета переводом сохраненного русского отчета
+    
+    Перевод - отдельный дешевый запрос (OPENAI_TRANSLATION_MODEL) без повторного анализа профиля.
+    Одновременные запросы для одного username выполняются один раз
+    
+    Args:
+        username: Username Instagram пользователя
+        force: Перевести заново, даже если английский отчет уже есть
+        
+    Returns:
+        dict: Отчет на обоих языках
+    """
+    return await run_single_flight("translate-report", username, _translate_gpt_report, force)
+
+
+async def _translate_gpt_report(db: AsyncSession, username: str, force: bool) -> dict:
+    """Перевод GPT отчета (одно выполнение на username)"""
+    profile = await db.scalar(
+        select(InstagramProfile)
+        .options(undefer_group(REPORT_TEXT_GROUP))
+        .where(InstagramProfile.username == username)
+    )
+    
+    if not profile:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not profile.report_ru:
+        raise HTTPException(status_code=404, detail="Отчет на русском языке еще не сгенерирован")
+    
+    if profile.report_en and not force:
+        return {
+            "status": "success",
+            "message": "Английский отчет уже есть",
+            "report": {"ru": profile.report_ru, "en": profile.report_en},
+            "translated": False
+        }
+    
+    analyzer = get_gpt_analyzer()
+    if not analyzer or not analyzer.client:
+        raise HTTPException(status_code=503, detail="GPT анализатор недоступен. Проверьте OPENAI_API_KEY.")
+    
+    translation = await analyzer.translate_report(profile.report_ru, username)
+    if not translation.get("en"):
+        retry_after = translation.get("retry_after")
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=503,
+                detail=f"GPT анализатор временно недоступен. Повторите через {math.ceil(retry_after)} с.",
+                headers={"Retry-After": str(max(math.ceil(retry_after), 1))}
+            )
+        raise HTTPException(status_code=500, detail="Перевод отчета не был сгенерирован")
+    
+    try:
+        # Отчет не перегенерирован: дата, модель и вызов LLM остаются от русского отчета
+        profile = await update_profile(db, username, {"report_en": translation["en"]})
+        if not profile:
+            raise HTTPException(status_code=404, detail="User not found")
+        await report_cache.attach_translation(db, username, profile.report_ru, profile.report_en)
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Ошибка при сохранении перевода отчета: {e}")
+        raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
+    
+    logger.info(f"Отчет переведен на английский для {username}, длина: {len(profile.report_en)} символов")
+    return {
+        "status": "success",
+        "message": "Отчет переведен на английский",
+        "report": {"ru": profile.report_ru, "en": profile.report_en},
+        "translated": True
+    }
+
+
 @app.delete("/api/data/{username}")
-async def delete_user_data(username: str, db: Session = Depends(get_db)):
+async def delete_user_data(username: str, db: AsyncSession = Depends(get_db)):
     """
     Удаляет данные пользователя из базы данных
     
@@ -836,9 +1568,7 @@ async def delete_user_data(username: str, db: Session = Depends(get_db)):
     Returns:
         dict: Результат удаления
     """
-    profile = db.query(InstagramProfile).filter(
-        InstagramProfile.username == username
-    ).first()
+    profile = await db.scalar(select(InstagramProfile).where(InstagramProfile.username == username))
     
     if not profile:
         raise HTTPException(status_code=404, detail="User not found")
@@ -850,14 +1580,17 @@ async def delete_user_data(username: str, db: Session = Depends(get_db)):
         except Exception as e:
             logger.warning(f"Не удалось удалить файл {profile.screenshot_path}: {e}")
     
-    db.delete(profile)
-    db.commit()
+    await db.delete(profile)
+    await db.commit()
+    await report_cache.invalidate(db, username)
+    await report_sections.invalidate(db, username)
+    await profile_history.delete(db, username)
     
     return {"status": "success", "message": f"Данные пользователя {username} удалены"}
 
 
 @app.delete("/api/users/all")
-async def delete_all_users(db: Session = Depends(get_db)):
+async def delete_all_users(db: AsyncSession = Depends(get_db)):
     """
     Удаляет все профили из базы данных
     
@@ -865,7 +1598,7 @@ async def delete_all_users(db: Session = Depends(get_db)):
         dict: Результат удаления
     """
     try:
-        profiles = db.query(InstagramProfile).all()
+        profiles = (await db.scalars(select(InstagramProfile))).all()
         count = len(profiles)
         
         # Удаляем файлы скриншотов
@@ -877,8 +1610,11 @@ async def delete_all_users(db: Session = Depends(get_db)):
                     logger.warning(f"Не удалось удалить файл {profile.screenshot_path}: {e}")
         
         # Удаляем все профили из базы
-        db.query(InstagramProfile).delete()
-        db.commit()
+        await db.execute(delete(InstagramProfile))
+        await db.commit()
+        await report_cache.invalidate(db)
+        await report_sections.invalidate(db)
+        await profile_history.delete(db)
         
         logger.info(f"Удалено {count} профилей из базы данных")
         return {
@@ -887,11 +1623,40 @@ async def delete_all_users(db: Session = Depends(get_db)):
             "deleted_count": count
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Ошибка при удалении всех профилей: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении: {str(e)}")
 
 
+@app.delete("/api/report-cache/{username}")
+async def invalidate_report_cache(username: str, db: AsyncSession = Depends(get_db)):
+    """
+    Сбрасывает закэшированные отчеты профиля
+    
+    Args:
+        username: Username Instagram пользователя
+        
+    Returns:
+        dict: Число удаленных записей кэша
+    """
+    count = await report_cache.invalidate(db, username)
+    await report_sections.invalidate(db, username)
+    return {"status": "success", "deleted_count": count}
+
+
+@app.delete("/api/report-cache")
+async def clear_report_cache(db: AsyncSession = Depends(get_db)):
+    """
+    Полностью очищает кэш отчетов (например, после изменения промпта без смены версии)
+    
+    Returns:
+        dict: Число удаленных записей кэша
+    """
+    count = await report_cache.invalidate(db)
+    await report_sections.invalidate(db)
+    return {"status": "success", "deleted_count": count}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=PORT)
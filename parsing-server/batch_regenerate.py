@@ -0,0 +1,374 @@
+"""
+Пакетная регенерация GPT отчетов после изменения промпта (PROMPT_VERSION) или модели (OPENAI_MODEL)
+
+Примеры:
+    # Отчеты, сгенерированные другой моделью или версией промпта (по умолчанию)
+    python batch_regenerate.py --concurrency 8
+
+    # Через Batch API провайдера (дешевле, результат в течение 24 часов)
+    python batch_regenerate.py --mode batch
+
+    # Против локального mock LLM сервера
+    OPENAI_API_KEY=test OPENAI_BASE_URL=http://localhost:8090/v1 python batch_regenerate.py --all
+
+Прогресс сохраняется в --progress-file: повторный запуск продолжает с места остановки
+(в режиме batch - дожидается уже отправленного пакета). Прогресс привязан к модели, версии
+промпта и глубине отчетов: после их изменения регенерация начинается заново. Когда все
+выбранные профили обработаны без ошибок, файл прогресса удаляется.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List
+from dotenv import load_dotenv
+from sqlalchemy import or_, select
+from database import SessionLocal, InstagramProfile, ReportCacheEntry
+from gpt_analyzer import GPTAnalyzer, PROMPT_VERSION, build_prompt_data
+from token_budget import REPORT_DEPTHS
+from llm_metrics import LLMMetrics
+
+logger = logging.getLogger(__name__)
+
+MODE_FANOUT = "fanout"  # параллельные запросы с ограничением конкурентности
+MODE_BATCH = "batch"  # Batch API провайдера
+
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchProgress:
+    """
+    Прогресс регенерации в JSON файле (для возобновления после остановки)
+
+    Сохраненный прогресс используется, только если он получен той же моделью, версией
+    промпта и глубиной: иначе готовые отчеты устарели и профили нужно сгенерировать заново
+    """
+
+    def __init__(self, path: str, model: str, prompt_version: str, depth: str):
+        self.path = path
+        target = {"model": model, "prompt_version": prompt_version, "depth": depth}
+        self.state = {
+            **target,
+            "started_at": datetime.utcnow().isoformat(),
+            "completed": [],
+            "failed": {},
+            "batch_id": None,
+            "batch_fingerprints": {},
+        }
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            saved_target = {key: saved.get(key) for key in target}
+            if saved_target == target:
+                self.state.update(saved)
+                logger.info(f"Продолжение регенерации: уже готово {len(self.state['completed'])} отчетов")
+            else:
+                logger.warning(
+                    f"Прогресс в {path} получен для {saved_target}, сейчас {target}: регенерация начинается заново"
+                    + (f" (пакет {saved['batch_id']} не будет обработан)" if saved.get("batch_id") else "")
+                )
+        self.completed = set(self.state["completed"])
+
+    def mark_completed(self, usernames: List[str]):
+        self.completed.update(usernames)
+        self.state["completed"] = sorted(self.completed)
+        for username in usernames:
+            self.state["failed"].pop(username, None)
+
+    def mark_failed(self, username: str, reason: str):
+        self.state["failed"][username] = reason
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def drained(self) -> bool:
+        """Все выбранные профили обработаны успешно и отправленного пакета нет"""
+        return not self.state["failed"] and not self.state["batch_id"]
+
+    def finish(self):
+        """Удаляет файл прогресса: следующий запуск выбирает профили заново"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        logger.info(f"Регенерация завершена, файл прогресса {self.path} удален")
+
+
+class Throughput:
+    """Счетчики и скорость регенерации"""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done - self.failed
+        return {
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "elapsed_seconds": round(elapsed, 1),
+            "reports_per_minute": round(rate * 60, 1),
+            "eta_seconds": round(remaining / rate) if rate > 0 else None,
+        }
+
+    def log(self):
+        s = self.summary()
+        logger.info(
+            f"Готово {s['done']}/{s['total']} (ошибок {s['failed']}), "
+            f"{s['reports_per_minute']} отчетов/мин, осталось ~{s['eta_seconds']} с"
+        )
+
+
+class ReportWriter:
+    """Записывает отчеты в базу пачками: одна транзакция на chunk_size отчетов"""
+
+    def __init__(self, model: str, chunk_size: int, progress: BatchProgress, throughput: Throughput):
+        self.model = model
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.throughput = throughput
+        self._pending = []
+
+    @property
+    def full(self) -> bool:
+        return len(self._pending) >= self.chunk_size
+
+    def add(self, username: str, fingerprint: str, reports: Dict[str, str]):
+        self._pending.append((username, fingerprint, reports))
+
+    async def flush(self):
+        if not self._pending:
+            return
+        chunk, self._pending = self._pending, []
+
+        async with SessionLocal() as db:
+            usernames = [username for username, _, _ in chunk]
+            profiles = {
+                p.username: p
+                for p in await db.scalars(select(InstagramProfile).where(InstagramProfile.username.in_(usernames)))
+            }
+            for username, fingerprint, reports in chunk:
+                profile = profiles.get(username)
+                if profile is None:
+                    continue
+                profile.set_report(reports, self.model, PROMPT_VERSION)
+                await db.merge(ReportCacheEntry(
+                    fingerprint=fingerprint,
+                    username=username,
+                    model=self.model,
+                    prompt_version=PROMPT_VERSION,
+                    report_ru=reports.get("ru"),
+                    report_en=reports.get("en"),
+                    hits=0,
+                    created_at=datetime.utcnow(),
+                ))
+            await db.commit()
+
+        self.progress.mark_completed(usernames)
+        self.progress.save()
+        self.throughput.done += len(chunk)
+        self.throughput.log()
+
+
+async def select_jobs(analyzer: GPTAnalyzer, args, progress: BatchProgress) -> list:
+    """
+    Выбирает профили для регенерации и строит входные данные промптов
+
+    Returns:
+        list: [(username, profile_dict, screenshot_data, fingerprint)]
+    """
+    async with SessionLocal() as db:
+        query = select(InstagramProfile)
+        if args.usernames:
+            query = query.where(InstagramProfile.username.in_(args.usernames))
+        elif not args.all:
+            # Отчет отсутствует или получен другой моделью / версией промпта
+            query = query.where(or_(
+                InstagramProfile.report_model.is_(None),
+                InstagramProfile.report_model != analyzer.model,
+                InstagramProfile.report_prompt_version.is_(None),
+                InstagramProfile.report_prompt_version != PROMPT_VERSION,
+            ))
+        query = query.order_by(InstagramProfile.id)
+        if args.limit:
+            query = query.limit(args.limit)
+
+        jobs = []
+        for profile in await db.scalars(query):
+            if profile.username in progress.completed:
+                continue
+            profile_dict, screenshot_data = build_prompt_data(profile)
+            jobs.append((
+                profile.username,
+                profile_dict,
+                screenshot_data,
+                analyzer.report_fingerprint(profile_dict, screenshot_data, args.depth),
+            ))
+        return jobs
+
+
+async def run_fanout(analyzer: GPTAnalyzer, jobs: list, writer: ReportWriter, progress: BatchProgress, concurrency: int, depth: str = None):
+    """Параллельная генерация через обычный API с ограничением числа одновременных запросов"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def regenerate(job):
+        username, profile_dict, screenshot_data, fingerprint = job
+        try:
+            async with semaphore:
+                reports = await analyzer.generate_report(profile_dict, screenshot_data, depth=depth)
+        except Exception as e:
+            # Ошибка одного профиля не должна прерывать весь gather
+            logger.error(f"Не удалось регенерировать отчет {username}: {e}")
+            progress.mark_failed(username, f"{type(e).__name__}: {e}")
+            writer.throughput.failed += 1
+            return
+        if not reports.get("ru") and not reports.get("en"):
+            progress.mark_failed(username, "empty report")
+            writer.throughput.failed += 1
+            return
+        writer.add(username, fingerprint, reports)
+        if writer.full:
+            await writer.flush()
+
+    await asyncio.gather(*(regenerate(job) for job in jobs))
+    await writer.flush()
+
+
+async def run_provider_batch(analyzer: GPTAnalyzer, jobs: list, writer: ReportWriter, progress: BatchProgress, poll_interval: float, depth: str = None):
+    """Генерация через Batch API: один файл запросов, ожидание результата, запись пачками"""
+    client = analyzer.client
+
+    if not progress.state["batch_id"]:
+        if not jobs:
+            return
+        lines = [
+            json.dumps({
+                "custom_id": username,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": analyzer.completion_params(profile_dict, screenshot_data, depth),
+            }, ensure_ascii=False)
+            for username, profile_dict, screenshot_data, _ in jobs
+        ]
+        batch_file = await client.files.create(
+            file=("reports.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        progress.state["batch_id"] = batch.id
+        progress.state["batch_fingerprints"] = {username: fingerprint for username, _, _, fingerprint in jobs}
+        progress.save()
+        logger.info(f"Отправлен пакет {batch.id}: {len(lines)} запросов")
+
+    while True:
+        batch = await client.batches.retrieve(progress.state["batch_id"])
+        counts = batch.request_counts
+        logger.info(
+            f"Пакет {batch.id}: {batch.status}"
+            + (f", выполнено {counts.completed}/{counts.total}, ошибок {counts.failed}" if counts else "")
+        )
+        if batch.status in BATCH_FINAL_STATUSES:
+            break
+        await asyncio.sleep(poll_interval)
+
+    fingerprints = progress.state["batch_fingerprints"]
+    writer.throughput.total = len(fingerprints)
+    if batch.output_file_id:
+        content = await client.files.content(batch.output_file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            username = record["custom_id"]
+            if username in progress.completed:
+                continue
+            try:
+                text = record["response"]["body"]["choices"][0]["message"]["content"].strip()
+            except (KeyError, IndexError, TypeError):
+                text = ""
+            if not text:
+                progress.mark_failed(username, json.dumps(record.get("error") or "empty report", ensure_ascii=False))
+                writer.throughput.failed += 1
+                continue
+            writer.add(username, fingerprints.get(username), analyzer.parse_report_output(text))
+            if writer.full:
+                await writer.flush()
+    await writer.flush()
+
+    missing = [u for u in fingerprints if u not in progress.completed and u not in progress.state["failed"]]
+    for username in missing:
+        progress.mark_failed(username, f"batch {batch.status}")
+        writer.throughput.failed += 1
+
+    # Пакет обработан: следующий запуск отправит новый пакет для оставшихся профилей
+    progress.state["batch_id"] = None
+    progress.state["batch_fingerprints"] = {}
+    progress.save()
+
+
+async def run(args) -> dict:
+    llm_metrics = LLMMetrics()
+    analyzer = GPTAnalyzer(call_recorder=llm_metrics.record)
+    if not analyzer.client:
+        raise SystemExit("OPENAI_API_KEY не установлен")
+
+    depth = args.depth or analyzer.default_depth
+    progress = BatchProgress(args.progress_file, analyzer.model, PROMPT_VERSION, depth)
+    jobs = await select_jobs(analyzer, args, progress)
+    logger.info(f"К регенерации выбрано {len(jobs)} профилей (модель {analyzer.model}, промпт v{PROMPT_VERSION})")
+
+    throughput = Throughput(len(jobs))
+    if args.dry_run:
+        return {"selected": [job[0] for job in jobs], **throughput.summary()}
+
+    writer = ReportWriter(analyzer.model, args.chunk_size, progress, throughput)
+    try:
+        if args.mode == MODE_BATCH:
+            await run_provider_batch(analyzer, jobs, writer, progress, args.poll_interval, args.depth)
+        else:
+            await run_fanout(analyzer, jobs, writer, progress, args.concurrency, args.depth)
+    finally:
+        progress.save()
+        await analyzer.close()
+
+    if progress.drained:
+        progress.finish()
+
+    return {**throughput.summary(), "llm": llm_metrics.stats()}
+
+
+def main():
+    load_dotenv()
+    arg_parser = argparse.ArgumentParser(description="Пакетная регенерация GPT отчетов")
+    arg_parser.add_argument("--mode", choices=(MODE_FANOUT, MODE_BATCH), default=MODE_FANOUT)
+    arg_parser.add_argument("--all", action="store_true", help="Все профили, а не только с устаревшими отчетами")
+    arg_parser.add_argument("--usernames", nargs="*", help="Только указанные профили")
+    arg_parser.add_argument("--limit", type=int, default=None)
+    arg_parser.add_argument("--depth", choices=REPORT_DEPTHS, default=None, help="Глубина отчетов (по умолчанию REPORT_DEPTH)")
+    arg_parser.add_argument("--concurrency", type=int, default=8, help="Одновременных запросов в режиме fanout")
+    arg_parser.add_argument("--chunk-size", type=int, default=50, help="Отчетов в одной транзакции")
+    arg_parser.add_argument("--poll-interval", type=float, default=30, help="Интервал опроса пакета, с")
+    arg_parser.add_argument("--progress-file", default="batch_regenerate_progress.json")
+    arg_parser.add_argument("--dry-run", action="store_true", help="Только показать выбранные профили")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Общий пул браузера Playwright для скрапера профилей и сервиса скриншотов
+"""
+import os
+import asyncio
+import heapq
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from playwright.async_api import async_playwright
+from page_archive import PageArchive
+
+logger = logging.getLogger(__name__)
+
+# Чем меньше число, тем выше приоритет
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class BrowserPool:
+    """
+    Один запущенный Chromium на процесс и ограниченное число одновременных страниц.
+
+    Слоты выдаются по приоритету: интерактивные запросы всегда обслуживаются раньше
+    фоновых, а если все слоты заняты фоновыми задачами, одна из них отменяется.
+    """
+
+    def __init__(self, max_concurrency: int = None, page_archive: PageArchive = None):
+        self.max_concurrency = max_concurrency or int(os.getenv("BROWSER_POOL_SIZE", 3))
+        self.page_archive = page_archive or PageArchive()
+        self._playwright = None
+        self._browser = None
+        self._launch_lock = asyncio.Lock()
+        self._in_use = 0
+        self._waiters = []  # heap: (priority, seq, future)
+        self._seq = itertools.count()
+        self._background_holders = set()
+        self._stats = {
+            "acquired_interactive": 0,
+            "acquired_background": 0,
+            "preempted_background": 0,
+            "browser_launches": 0,
+        }
+
+    async def _get_browser(self):
+        """Запускает браузер при первом обращении или после падения"""
+        async with self._launch_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+                self._stats["browser_launches"] += 1
+                logger.info("Браузер пула запущен")
+        return self._browser
+
+    def is_idle(self) -> bool:
+        """True, если нет занятых слотов и никто не ждет"""
+        return self._in_use == 0 and not any(not fut.done() for _, _, fut in self._waiters)
+
+    def has_free_slot(self) -> bool:
+        return self._in_use < self.max_concurrency and not any(not fut.done() for _, _, fut in self._waiters)
+
+    async def _acquire(self, priority: int):
+        if self.has_free_slot():
+            self._in_use += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if priority == PRIORITY_INTERACTIVE:
+            self._preempt_background()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот мог быть выдан в момент отмены - возвращаем его
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _preempt_background(self):
+        """Отменяет одну фоновую задачу, чтобы освободить слот для интерактивного запроса"""
+        if self._in_use < self.max_concurrency:
+            return
+        for task in list(self._background_holders):
+            if not task.done():
+                logger.info("Фоновая задача браузера вытеснена интерактивным запросом")
+                self._stats["preempted_background"] += 1
+                task.cancel()
+                return
+
+    def _release(self):
+        self._in_use -= 1
+        while self._waiters and self._in_use < self.max_concurrency:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._in_use += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def page(self, priority: int = PRIORITY_INTERACTIVE, archive_key: str = None, **context_options):
+        """
+        Выдает новую страницу в отдельном контексте браузера
+
+        Args:
+            priority: PRIORITY_INTERACTIVE или PRIORITY_BACKGROUND
+            archive_key: Ключ записи в архиве страниц (используется в режимах record/replay)
+            **context_options: Параметры browser.new_context (viewport, user_agent, ...)
+        """
+        await self._acquire(priority)
+        task = asyncio.current_task()
+        if priority == PRIORITY_INTERACTIVE:
+            self._stats["acquired_interactive"] += 1
+        else:
+            self._stats["acquired_background"] += 1
+            self._background_holders.add(task)
+
+        context = None
+        try:
+            browser = await self._get_browser()
+            context = await browser.new_context(**context_options)
+            await self.page_archive.attach(context, archive_key)
+            yield await context.new_page()
+        finally:
+            self._background_holders.discard(task)
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception as e:
+                    logger.warning(f"Не удалось закрыть контекст браузера: {e}")
+            self._release()
+
+    async def close(self):
+        """Закрывает браузер и Playwright при остановке сервера"""
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                logger.warning(f"Ошибка при закрытии браузера: {e}")
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "capture_mode": self.page_archive.mode,
+            "in_use": self._in_use,
+            "waiting": sum(1 for _, _, fut in self._waiters if not fut.done()),
+            "background_in_use": len(self._background_holders),
+            **self._stats,
+        }
@@ -0,0 +1,196 @@
+"""
+Стратегии получения данных профиля: HTML скрапинг и скриншот + OCR
+"""
+import os
+import asyncio
+import logging
+import time
+from typing import Optional
+from image_parser import InstagramScreenshotParser
+from profile_scraper import InstagramProfileScraper
+from screenshot_service import InstagramScreenshotService
+
+logger = logging.getLogger(__name__)
+
+STRATEGY_SEQUENTIAL = "sequential"  # HTML, затем скриншот если HTML не дал данных
+STRATEGY_HEDGED = "hedged"  # HTML, скриншот стартует после задержки и они соревнуются
+STRATEGY_PARALLEL = "parallel"  # оба пути стартуют сразу
+
+STRATEGIES = (STRATEGY_SEQUENTIAL, STRATEGY_HEDGED, STRATEGY_PARALLEL)
+
+SOURCE_HTML = "html"
+SOURCE_SCREENSHOT = "screenshot"
+SOURCE_MERGED = "merged"
+SOURCE_NONE = "none"
+
+
+def is_complete(data: Optional[dict]) -> bool:
+    """Проверка полноты: есть хотя бы подписчики или публикации"""
+    return bool(data) and (data.get('followers', 0) > 0 or data.get('posts_count', 0) > 0)
+
+
+def merge_capture_data(html_data: Optional[dict], screenshot_data: Optional[dict]) -> dict:
+    """Объединяет данные (приоритет HTML, затем скриншот)"""
+    return {**(screenshot_data or {}), **{k: v for k, v in (html_data or {}).items() if v}}
+
+
+class ProfileCapture:
+    """Получение данных профиля по выбранной стратегии со статистикой побед"""
+
+    def __init__(
+        self,
+        profile_scraper: InstagramProfileScraper,
+        screenshot_service: InstagramScreenshotService,
+        parser: InstagramScreenshotParser,
+    ):
+        self.profile_scraper = profile_scraper
+        self.screenshot_service = screenshot_service
+        self.parser = parser
+
+        self.default_strategy = os.getenv("CAPTURE_STRATEGY", STRATEGY_SEQUENTIAL)
+        if self.default_strategy not in STRATEGIES:
+            logger.warning(f"Неизвестная стратегия CAPTURE_STRATEGY={self.default_strategy}, используется {STRATEGY_SEQUENTIAL}")
+            self.default_strategy = STRATEGY_SEQUENTIAL
+        self.hedge_delay = float(os.getenv("CAPTURE_HEDGE_DELAY_SECONDS", 5))
+
+        self._stats = {
+            strategy: {
+                "requests": 0,
+                "failures": 0,
+                "wins": {SOURCE_HTML: 0, SOURCE_SCREENSHOT: 0, SOURCE_MERGED: 0, SOURCE_NONE: 0},
+                "total_ms": 0.0,
+            }
+            for strategy in STRATEGIES
+        }
+
+    async def _capture_html(self, username: str) -> dict:
+        return await self.profile_scraper.scrape_profile_data(username)
+
+    async def _capture_screenshot(self, username: str) -> tuple:
+        screenshot_path = await self.screenshot_service.take_profile_screenshot(username)
+        # OCR выполняется в потоке, чтобы не блокировать event loop
+        data = await asyncio.to_thread(self.parser.parse_screenshot, screenshot_path)
+        return data, screenshot_path
+
+    async def _sequential(self, username: str) -> tuple:
+        try:
+            html_data = await self._capture_html(username)
+        except Exception as e:
+            logger.warning(f"Ошибка при извлечении данных из HTML: {e}, используем скриншот")
+            data, screenshot_path = await self._capture_screenshot(username)
+            return data, screenshot_path, SOURCE_SCREENSHOT if is_complete(data) else SOURCE_NONE
+
+        if is_complete(html_data):
+            return html_data, None, SOURCE_HTML
+
+        logger.info(f"Данные из HTML неполные, используем скриншот как fallback для {username}")
+        screenshot_data, screenshot_path = await self._capture_screenshot(username)
+        data = merge_capture_data(html_data, screenshot_data)
+        return data, screenshot_path, SOURCE_MERGED if is_complete(data) else SOURCE_NONE
+
+    async def _race(self, username: str, hedge_delay: float) -> tuple:
+        html_task = asyncio.create_task(self._capture_html(username))
+        tasks = {html_task}
+        screenshot_task = None
+
+        try:
+            if hedge_delay > 0:
+                await asyncio.wait(tasks, timeout=hedge_delay)
+            if html_task.done() and not html_task.exception() and is_complete(html_task.result()):
+                return html_task.result(), None, SOURCE_HTML
+
+            screenshot_task = asyncio.create_task(self._capture_screenshot(username))
+            tasks.add(screenshot_task)
+
+            pending = {task for task in tasks if not task.done()}
+            while pending:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if html_task.done() and not html_task.exception() and is_complete(html_task.result()):
+                    return html_task.result(), None, SOURCE_HTML
+                if screenshot_task.done() and not screenshot_task.exception():
+                    data, screenshot_path = screenshot_task.result()
+                    if is_complete(data):
+                        return data, screenshot_path, SOURCE_SCREENSHOT
+
+            # Ни один путь не дал полных данных - объединяем то, что есть
+            html_data = html_task.result() if not html_task.exception() else None
+            screenshot_data, screenshot_path = (
+                screenshot_task.result() if not screenshot_task.exception() else (None, None)
+            )
+            if html_data is None and screenshot_data is None:
+                raise screenshot_task.exception()
+            data = merge_capture_data(html_data, screenshot_data)
+            return data, screenshot_path, SOURCE_MERGED if is_complete(data) else SOURCE_NONE
+        finally:
+            # Проигравший путь отменяется
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def capture(self, username: str, strategy: Optional[str] = None) -> dict:
+        """
+        Получает данные профиля по стратегии
+
+        Args:
+            username: Username Instagram профиля
+            strategy: sequential, hedged или parallel (по умолчанию CAPTURE_STRATEGY)
+
+        Returns:
+            dict: {"data": ..., "screenshot_path": ..., "capture": {стратегия, победитель, время}}
+        """
+        strategy = strategy or self.default_strategy
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия получения данных: {strategy}")
+
+        stats = self._stats[strategy]
+        stats["requests"] += 1
+        started = time.perf_counter()
+        try:
+            if strategy == STRATEGY_SEQUENTIAL:
+                data, screenshot_path, winner = await self._sequential(username)
+            else:
+                hedge_delay = self.hedge_delay if strategy == STRATEGY_HEDGED else 0
+                data, screenshot_path, winner = await self._race(username, hedge_delay)
+        except Exception:
+            stats["failures"] += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats["total_ms"] += elapsed_ms
+
+        stats["wins"][winner] += 1
+        logger.info(f"Данные профиля {username} получены стратегией {strategy}: источник {winner}, {elapsed_ms:.0f} мс")
+        return {
+            "data": data,
+            "screenshot_path": screenshot_path,
+            "capture": {
+                "strategy": strategy,
+                "winner": winner,
+                "elapsed_ms": round(elapsed_ms),
+                "hedge_delay_seconds": self.hedge_delay if strategy == STRATEGY_HEDGED else 0,
+                "win_rate": self._win_rate(strategy),
+            },
+        }
+
+    def _win_rate(self, strategy: str) -> dict:
+        stats = self._stats[strategy]
+        completed = sum(stats["wins"].values())
+        if not completed:
+            return {source: 0.0 for source in stats["wins"]}
+        return {source: round(count / completed, 3) for source, count in stats["wins"].items()}
+
+    def stats(self) -> dict:
+        return {
+            "default_strategy": self.default_strategy,
+            "hedge_delay_seconds": self.hedge_delay,
+            "strategies": {
+                strategy: {
+                    "requests": stats["requests"],
+                    "failures": stats["failures"],
+                    "wins": dict(stats["wins"]),
+                    "win_rate": self._win_rate(strategy),
+                    "avg_ms": round(stats["total_ms"] / stats["requests"]) if stats["requests"] else 0,
+                }
+                for strategy, stats in self._stats.items()
+            },
+        }
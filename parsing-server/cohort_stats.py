@@ -0,0 +1,295 @@
+"""
+Перцентили профиля внутри когорты по числу подписчиков и лидерборды
+
+Распределения метрик по когортам периодически пересчитываются в таблицу cohort_percentiles
+(один проход по трем колонкам instagram_profiles) и держатся в памяти процесса, поэтому
+перцентиль профиля считается без запросов к instagram_profiles. Лидерборды читаются по
+индексам (метрика, id) и кэшируются на COHORT_LEADERBOARD_CACHE_SECONDS
+"""
+import asyncio
+import bisect
+import json
+import os
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import InstagramProfile, CohortPercentile
+from gpt_analyzer import audience_scale
+
+logger = logging.getLogger(__name__)
+
+# Когорта "все профили"
+COHORT_ALL = -1
+
+# Метрика -> колонка instagram_profiles (views - просмотры за 30 дней из статистики аккаунта)
+COHORT_METRICS = {
+    "followers": InstagramProfile.followers,
+    "engagement_rate": InstagramProfile.engagement_rate,
+    "views_30d": InstagramProfile.views,
+}
+
+
+def cohort_bounds(cohort: int) -> Tuple[int, Optional[int]]:
+    """Границы когорты по подписчикам [from, to); to=None - без верхней границы"""
+    if cohort == COHORT_ALL:
+        return 0, None
+    return (10 ** cohort if cohort > 0 else 0), 10 ** (cohort + 1)
+
+
+def cohort_label(cohort: int) -> str:
+    """Подпись когорты: 10K-100K, 1M-10M, ..."""
+    if cohort == COHORT_ALL:
+        return "all"
+
+    def short(value: int) -> str:
+        for suffix, size in (("B", 10 ** 9), ("M", 10 ** 6), ("K", 10 ** 3)):
+            if value >= size:
+                return f"{value // size}{suffix}"
+        return str(value)
+
+    lower, upper = cohort_bounds(cohort)
+    return f"{short(lower)}-{short(upper)}"
+
+
+def breakpoints(values: List[float]) -> List[float]:
+    """Значения перцентилей p0..p100 (линейная интерполяция) по отсортированным значениям"""
+    last = len(values) - 1
+    result = []
+    for q in range(101):
+        position = q / 100 * last
+        low = int(position)
+        high = min(low + 1, last)
+        result.append(values[low] + (values[high] - values[low]) * (position - low))
+    return result
+
+
+def percentile_of(value: float, points: List[float]) -> float:
+    """
+    Перцентиль значения по точкам p0..p100
+
+    Между точками - линейная интерполяция; значение, совпадающее с несколькими
+    точками (много одинаковых значений), получает середину их диапазона
+    """
+    low = bisect.bisect_left(points, value)
+    high = bisect.bisect_right(points, value)
+    if high > low:
+        return (low + high - 1) / 2
+    if high == 0:
+        return 0.0
+    if high == len(points):
+        return 100.0
+    return high - 1 + (value - points[high - 1]) / (points[high] - points[high - 1])
+
+
+class CohortStats:
+    """
+    Распределения метрик по когортам (порядок числа подписчиков, как audience_scale в отчете)
+    и лидерборды
+
+    Пересчет раз в COHORT_STATS_REFRESH_MINUTES пишет распределения в cohort_percentiles;
+    каждая реплика перечитывает таблицу не чаще раза в COHORT_STATS_CACHE_SECONDS, поэтому
+    пересчет на одной реплике виден на всех
+    """
+
+    def __init__(self, session_factory: Callable):
+        self.session_factory = session_factory
+        self.enabled = os.getenv("COHORT_STATS_ENABLED", "true").lower() == "true"
+        self.interval = float(os.getenv("COHORT_STATS_REFRESH_MINUTES", 60)) * 60
+        self.cache_ttl = float(os.getenv("COHORT_STATS_CACHE_SECONDS", 300))
+        self.leaderboard_ttl = float(os.getenv("COHORT_LEADERBOARD_CACHE_SECONDS", 300))
+        self.min_profiles = int(os.getenv("COHORT_MIN_PROFILES", 10))  # В меньшей когорте перцентиль не считается
+        self._distributions: Dict[Tuple[int, str], Tuple[int, List[float]]] = {}
+        self._refreshed_at: Optional[datetime] = None
+        self._loaded_at: Optional[float] = None
+        self._leaderboards: Dict[tuple, Tuple[float, list]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"refreshes": 0, "profiles_scanned": 0, "loads": 0, "leaderboard_hits": 0, "leaderboard_misses": 0}
+
+    async def refresh(self) -> dict:
+        """
+        Пересчитывает распределения метрик по когортам и заменяет ими cohort_percentiles
+
+        Returns:
+            dict: Число просмотренных профилей и записанных распределений
+        """
+        values: Dict[Tuple[int, str], List[float]] = {}
+        scanned = 0
+        async with self.session_factory() as db:
+            result = await db.stream(
+                select(*COHORT_METRICS.values()).execution_options(yield_per=1000)
+            )
+            async for row in result:
+                scanned += 1
+                cohort = audience_scale(row.followers)
+                for metric, value in zip(COHORT_METRICS, row):
+                    # 0 - метрика неизвестна (не удалось получить или не было статистики)
+                    if value is None or value <= 0:
+                        continue
+                    values.setdefault((cohort, metric), []).append(value)
+                    values.setdefault((COHORT_ALL, metric), []).append(value)
+
+            refreshed_at = datetime.utcnow()
+            distributions = {}
+            for key, metric_values in values.items():
+                metric_values.sort()
+                distributions[key] = (len(metric_values), breakpoints(metric_values))
+
+            await db.execute(delete(CohortPercentile))
+            if distributions:
+                await db.execute(
+                    CohortPercentile.__table__.insert(),
+                    [
+                        {
+                            "cohort": cohort,
+                            "metric": metric,
+                            "profiles": profiles,
+                            "breakpoints": json.dumps(points),
+                            "refreshed_at": refreshed_at,
+                        }
+                        for (cohort, metric), (profiles, points) in distributions.items()
+                    ]
+                )
+            await db.commit()
+
+        self._set(distributions, refreshed_at)
+        self._leaderboards.clear()
+        self._stats["refreshes"] += 1
+        self._stats["profiles_scanned"] += scanned
+        logger.info(f"Распределения метрик по когортам пересчитаны: {scanned} профилей, {len(distributions)} распределений")
+        return {"profiles_scanned": scanned, "distributions": len(distributions), "refreshed_at": refreshed_at.isoformat()}
+
+    def _set(self, distributions: Dict[Tuple[int, str], Tuple[int, List[float]]], refreshed_at: Optional[datetime]):
+        self._distributions = distributions
+        self._refreshed_at = refreshed_at
+        self._loaded_at = time.monotonic()
+
+    async def _ensure_loaded(self, db: AsyncSession):
+        """Перечитывает cohort_percentiles, если копия в памяти старше cache_ttl"""
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.cache_ttl:
+            return
+        rows = (await db.scalars(select(CohortPercentile))).all()
+        self._set(
+            {(row.cohort, row.metric): (row.profiles, json.loads(row.breakpoints)) for row in rows},
+            max((row.refreshed_at for row in rows), default=None)
+        )
+        self._stats["loads"] += 1
+
+    async def percentiles(self, db: AsyncSession, profile) -> dict:
+        """
+        Перцентили метрик профиля в его когорте и среди всех профилей
+
+        Args:
+            profile: Профиль или строка с колонками followers, engagement_rate, views
+
+        Returns:
+            dict: Когорта, перцентили по метрикам (None - метрика неизвестна или когорта
+                  меньше COHORT_MIN_PROFILES) и время пересчета распределений
+        """
+        await self._ensure_loaded(db)
+        cohort = audience_scale(profile.followers)
+        metrics = {}
+        for metric, column in COHORT_METRICS.items():
+            value = getattr(profile, column.key)
+            metrics[metric] = {
+                "value": value,
+                "cohort_percentile": self._percentile(cohort, metric, value),
+                "overall_percentile": self._percentile(COHORT_ALL, metric, value),
+            }
+
+        lower, upper = cohort_bounds(cohort)
+        return {
+            "cohort": {
+                "scale": cohort,
+                "label": cohort_label(cohort),
+                "followers_from": lower,
+                "followers_to": upper,
+                "profiles": self._distributions.get((cohort, "followers"), (0, None))[0],
+            },
+            "metrics": metrics,
+            "refreshed_at": self._refreshed_at.isoformat() if self._refreshed_at else None,
+        }
+
+    def _percentile(self, cohort: int, metric: str, value) -> Optional[float]:
+        if value is None or value <= 0:
+            return None
+        profiles, points = self._distributions.get((cohort, metric), (0, None))
+        if profiles < self.min_profiles:
+            return None
+        return round(percentile_of(value, points), 1)
+
+    async def leaderboard(self, db: AsyncSession, metric: str, cohort: int = COHORT_ALL, limit: int = 10) -> list:
+        """
+        Топ профилей по метрике (в когорте или среди всех)
+
+        Returns:
+            list: Строки username, followers, engagement_rate, views по убыванию метрики
+        """
+        key = (metric, cohort, limit)
+        cached = self._leaderboards.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.leaderboard_ttl:
+            self._stats["leaderboard_hits"] += 1
+            return cached[1]
+        self._stats["leaderboard_misses"] += 1
+
+        column = COHORT_METRICS[metric]
+        statement = select(
+            InstagramProfile.username,
+            InstagramProfile.followers,
+            InstagramProfile.engagement_rate,
+            InstagramProfile.views,
+        ).where(column > 0)
+        if cohort != COHORT_ALL:
+            lower, upper = cohort_bounds(cohort)
+            statement = statement.where(InstagramProfile.followers >= lower, InstagramProfile.followers < upper)
+        statement = statement.order_by(column.desc(), InstagramProfile.id.desc()).limit(limit)
+
+        rows = (await db.execute(statement)).all()
+        self._leaderboards[key] = (time.monotonic(), rows)
+        return rows
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Пересчет распределений по когортам запущен (интервал {self.interval / 60:.0f} мин)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        # После перезапуска не пересчитываем, если свежие распределения уже есть в таблице
+        try:
+            async with self.session_factory() as db:
+                await self._ensure_loaded(db)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить распределения по когортам: {e}")
+        if self._refreshed_at is not None:
+            age = (datetime.utcnow() - self._refreshed_at).total_seconds()
+            if age < self.interval:
+                await asyncio.sleep(self.interval - age)
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка пересчета распределений по когортам: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "refresh_interval_minutes": self.interval / 60,
+            "distributions": len(self._distributions),
+            "refreshed_at": self._refreshed_at.isoformat() if self._refreshed_at else None,
+            "leaderboards_cached": len(self._leaderboards),
+            **self._stats,
+        }
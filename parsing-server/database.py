@@ -1,10 +1,17 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Text, inspect
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, Boolean, Index, select, update, and_, or_, func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import text
+from sqlalchemy.orm import deferred
 import os
+import json
+import base64
 from datetime import datetime
+from typing import Optional, List, Tuple
 import logging
+from db_pool import pool_options, pool_metrics, MeteredQueuePool
 
 logger = logging.getLogger(__name__)
 
@@ -25,11 +32,63 @@ DATABASE_URL = DATABASE_URL.strip()
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def async_database_url(database_url: str) -> tuple:
+    """
+    Переводит DATABASE_URL на асинхронный драйвер: postgresql -> asyncpg, sqlite -> aiosqlite
+    
+    asyncpg не понимает параметр sslmode из строки подключения (Railway, Heroku),
+    поэтому он передается драйверу отдельно как ssl
+    
+    Returns:
+        tuple: (URL для create_async_engine, connect_args)
+    """
+    url = make_url(database_url)
+    connect_args = {}
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        if sslmode:
+            connect_args["ssl"] = sslmode
+        url = url.set(drivername="postgresql+asyncpg", query=query)
+    elif backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url, connect_args
+
+
+ASYNC_DATABASE_URL, _connect_args = async_database_url(DATABASE_URL)
+
+# Асинхронный движок: запросы к базе не блокируют event loop.
+# expire_on_commit=False - после commit атрибуты объектов читаются без повторного запроса.
+# Для PostgreSQL пул настраивается из переменных окружения (DB_POOL_*); SQLite использует пул по умолчанию
+if ASYNC_DATABASE_URL.get_backend_name() == "postgresql":
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args=_connect_args,
+        poolclass=MeteredQueuePool,
+        **pool_options()
+    )
+else:
+    engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=_connect_args)
+pool_metrics.attach(engine.sync_engine.pool)
+SessionLocal = async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
+def upsert(model):
+    """INSERT с поддержкой ON CONFLICT для текущей базы (PostgreSQL, локально - SQLite)"""
+    insert = sqlite_insert if engine.dialect.name == "sqlite" else pg_insert
+    return insert(model)
+
+# Состояние отчета профиля: черновик по правилам (ждет LLM отчет) или итоговый отчет
+REPORT_STATUS_DRAFT = "draft"
+REPORT_STATUS_FINAL = "final"
+
+# Группа отложенных колонок с текстами отчетов (report_ru, report_en)
+REPORT_TEXT_GROUP = "report_text"
+
+
 class InstagramProfile(Base):
     """Модель для хранения данных Instagram профиля"""
     __tablename__ = "instagram_profiles"
@@ -53,54 +112,379 @@ class InstagramProfile(Base):
     messages = Column(Integer, default=0)
     shares = Column(Integer, default=0)
     
-    # Поля для GPT отчетов
-    report_ru = Column(Text, nullable=True)  # Отчет на русском языке
-    report_en = Column(Text, nullable=True)  # Отчет на английском языке
+    # Поля для GPT отчетов. Тексты отчетов (килобайты) не загружаются вместе с профилем:
+    # их читают только эндпоинты, которые отдают отчет (undefer_group(REPORT_TEXT_GROUP)).
+    # raiseload - случайное обращение к незагруженному тексту сразу дает ошибку, а не лишний запрос
+    report_ru = deferred(Column(Text, nullable=True), group=REPORT_TEXT_GROUP, raiseload=True)  # Отчет на русском языке
+    report_en = deferred(Column(Text, nullable=True), group=REPORT_TEXT_GROUP, raiseload=True)  # Отчет на английском языке
     report_generated_at = Column(DateTime, nullable=True)  # Дата генерации отчета
+    report_model = Column(String, nullable=True)  # Модель, которой сгенерирован отчет
+    report_prompt_version = Column(String, nullable=True)  # Версия шаблона промпта
+    report_llm_call_id = Column(Integer, nullable=True)  # Вызов LLM в llm_calls (None - отчет из кэша)
+    report_status = Column(String, nullable=True)  # draft или final (None - отчет до появления черновиков)
+    
+    # Индексы для постраничного списка профилей (keyset по колонке сортировки и id)
+    __table_args__ = (
+        Index("ix_instagram_profiles_updated_at_id", "updated_at", "id"),
+        Index("ix_instagram_profiles_created_at_id", "created_at", "id"),
+        Index("ix_instagram_profiles_followers_id", "followers", "id"),
+        # Лидерборды по вовлеченности и просмотрам
+        Index("ix_instagram_profiles_engagement_rate_id", "engagement_rate", "id"),
+        Index("ix_instagram_profiles_views_id", "views", "id"),
+    )
+    
+    def set_report(self, reports: dict, model: str, prompt_version: str):
+        """Сохраняет отчеты вместе с моделью и версией промпта, которыми они получены"""
+        self.report_ru = reports.get("ru")
+        self.report_en = reports.get("en")
+        self.report_generated_at = datetime.utcnow()
+        self.report_model = model
+        self.report_prompt_version = prompt_version
+        self.report_llm_call_id = (reports.get("meta") or {}).get("call_id")
+        self.report_status = REPORT_STATUS_FINAL
+    
+    @property
+    def has_final_report(self) -> bool:
+        # По колонкам без текстов отчета: дата генерации пишется вместе с каждым отчетом
+        return self.report_generated_at is not None and self.report_status != REPORT_STATUS_DRAFT
 
 
-def init_db():
-    """Инициализация базы данных - создание таблиц и миграция"""
-    # Создаем таблицы, если их нет
-    Base.metadata.create_all(bind=engine)
+class ReportCacheEntry(Base):
+    """Кэш GPT отчетов по отпечатку входных данных промпта"""
+    __tablename__ = "report_cache"
     
-    # Проверяем и добавляем недостающие колонки
-    inspector = inspect(engine)
-    if inspector.has_table("instagram_profiles"):
-        columns = [col['name'] for col in inspector.get_columns("instagram_profiles")]
+    fingerprint = Column(String(64), primary_key=True)  # sha256 входных данных + модель + версия промпта
+    username = Column(String, index=True, nullable=False)
+    model = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    report_ru = Column(Text, nullable=True)
+    report_en = Column(Text, nullable=True)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, nullable=True)
+
+
+class ReportSection(Base):
+    """Разделы последнего отчета профиля с хэшем входных данных, от которых зависит раздел"""
+    __tablename__ = "report_sections"
+    
+    username = Column(String, primary_key=True)
+    section = Column(String, primary_key=True)  # Ключ раздела: metrics, audience, partners, ...
+    content = Column(Text, nullable=False)  # Текст раздела без заголовка
+    input_hash = Column(String(64), nullable=False)  # sha256 входных данных раздела + модель + версия промпта
+    model = Column(String, nullable=True)
+    prompt_version = Column(String, nullable=True)
+    generated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# Разрешение точки истории метрик: исходный снимок или свертка за день / неделю
+SNAPSHOT_RAW = "raw"
+SNAPSHOT_DAY = "day"
+SNAPSHOT_WEEK = "week"
+
+
+class ProfileSnapshot(Base):
+    """История метрик профиля: снимок на каждый анализ (только добавление), старые снимки свернуты по дням и неделям"""
+    __tablename__ = "profile_snapshots"
+    
+    id = Column(Integer, primary_key=True)
+    username = Column(String, nullable=False)
+    captured_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # Время снимка или начало периода свертки
+    resolution = Column(String, nullable=False, default=SNAPSHOT_RAW)  # raw, day или week
+    samples = Column(Integer, nullable=False, default=1)  # Сколько снимков свернуто в эту точку
+    source = Column(String, nullable=True)  # Откуда метрики: analyze, screenshot, link, update, refresh
+    followers = Column(Integer, nullable=True)
+    following = Column(Integer, nullable=True)
+    posts_count = Column(Integer, nullable=True)
+    engagement_rate = Column(Float, nullable=True)
+    views = Column(Integer, nullable=True)
+    interactions = Column(Integer, nullable=True)
+    new_followers = Column(Integer, nullable=True)
+    messages = Column(Integer, nullable=True)
+    shares = Column(Integer, nullable=True)
+    
+    __table_args__ = (
+        # История профиля за период
+        Index("ix_profile_snapshots_username_captured_at", "username", "captured_at"),
+        # Сканы по времени для свертки и очистки: BRIN компактен для таблицы, куда строки
+        # добавляются в порядке времени (в SQLite - обычный индекс)
+        Index("ix_profile_snapshots_captured_at", "captured_at", postgresql_using="brin"),
+    )
+
+
+class CohortPercentile(Base):
+    """Распределение метрики среди профилей когорты (пересчитывается периодически, см. cohort_stats.py)"""
+    __tablename__ = "cohort_percentiles"
+    
+    cohort = Column(Integer, primary_key=True)  # Порядок числа подписчиков (audience_scale); -1 - все профили
+    metric = Column(String, primary_key=True)  # followers, engagement_rate или views_30d
+    profiles = Column(Integer, nullable=False)  # Число профилей с известным значением метрики
+    breakpoints = Column(Text, nullable=False)  # JSON: значения перцентилей p0..p100
+    refreshed_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LLMCall(Base):
+    """Журнал вызовов LLM: токены, задержки, стоимость и причины ошибок"""
+    __tablename__ = "llm_calls"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String, index=True, nullable=True)
+    model = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=True)
+    depth = Column(String, nullable=True)  # Глубина отчета: short, standard, full
+    section = Column(String, nullable=True)  # Раздел отчета в режиме sectioned (None - весь отчет)
+    mode = Column(String, nullable=True)  # single, sectioned, incremental, bilingual или translation
+    streaming = Column(Boolean, default=False)  # Текст отдавался клиенту потоком
+    status = Column(String, nullable=False)  # ok или error
+    error_class = Column(String, nullable=True)  # timeout, rate_limit, connection, server_error, ...
+    error_message = Column(Text, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    usage_estimated = Column(Boolean, default=False)  # Провайдер не вернул usage - токены посчитаны локально
+    ttft_ms = Column(Integer, nullable=True)  # Время до первого токена
+    duration_ms = Column(Integer, nullable=True)
+    cost_usd = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+# Репозиторий профилей: каждая запись - один SQL запрос вместо SELECT + изменение + commit + refresh.
+# RETURNING с populate_existing обновляет объект профиля, уже загруженный в сессию
+
+async def upsert_profile(db: AsyncSession, username: str, metrics: dict) -> InstagramProfile:
+    """
+    Создает профиль или обновляет его метрики одним INSERT ... ON CONFLICT (username) DO UPDATE ... RETURNING
+    
+    Args:
+        db: Сессия базы данных
+        username: Username Instagram пользователя
+        metrics: Значения колонок профиля; пустой dict - только получить или создать профиль
         
-        # Список колонок, которые нужно добавить
-        new_columns = {
-            'views': Integer,
-            'interactions': Integer,
-            'new_followers': Integer,
-            'messages': Integer,
-            'shares': Integer,
-            'report_ru': Text,
-            'report_en': Text,
-            'report_generated_at': DateTime
-        }
+    Returns:
+        InstagramProfile: Профиль после записи
+    """
+    statement = upsert(InstagramProfile).values(username=username, **metrics)
+    if metrics:
+        set_ = {name: statement.excluded[name] for name in metrics}
+        set_["updated_at"] = datetime.utcnow()
+    else:
+        # Профиль уже есть: строка не меняется, но RETURNING ее вернет
+        set_ = {"username": statement.excluded.username}
+    statement = statement.on_conflict_do_update(
+        index_elements=[InstagramProfile.username],
+        set_=set_
+    ).returning(InstagramProfile)
+    profile = await db.scalar(statement, execution_options={"populate_existing": True})
+    await db.commit()
+    return profile
+
+
+async def update_profile(db: AsyncSession, username: str, values: dict) -> Optional[InstagramProfile]:
+    """
+    Обновляет колонки существующего профиля одним UPDATE ... RETURNING (updated_at - через onupdate)
+    
+    Returns:
+        InstagramProfile: Профиль после записи или None, если профиля нет
+    """
+    statement = (
+        update(InstagramProfile)
+        .where(InstagramProfile.username == username)
+        .values(**values)
+        .returning(InstagramProfile)
+    )
+    profile = await db.scalar(statement, execution_options={"populate_existing": True})
+    await db.commit()
+    return profile
+
+
+def has_report_clause():
+    """
+    SQL-условие "у профиля есть отчет" (черновой или итоговый)
+    
+    Сравнение с пустой строкой в PostgreSQL не распаковывает TOAST: длины разные - ответ сразу
+    """
+    return or_(func.coalesce(InstagramProfile.report_ru, "") != "", func.coalesce(InstagramProfile.report_en, "") != "")
+
+
+def _has_final_report():
+    """SQL-условие, аналогичное InstagramProfile.has_final_report"""
+    return and_(
+        has_report_clause(),
+        or_(InstagramProfile.report_status.is_(None), InstagramProfile.report_status != REPORT_STATUS_DRAFT)
+    )
+
+
+async def save_report(
+    db: AsyncSession,
+    username: str,
+    reports: dict,
+    model: str,
+    prompt_version: str,
+    status: str = REPORT_STATUS_FINAL,
+    analyzed: bool = False
+) -> Optional[InstagramProfile]:
+    """
+    Записывает отчет профиля отдельным UPDATE только колонок отчета
+    
+    Черновик записывается тем же запросом с условием, что итогового отчета еще нет,
+    поэтому готовый LLM отчет не будет перезаписан черновиком даже при гонке
+    
+    Args:
+        reports: {"ru": ..., "en": ..., "meta": ...}
+        status: REPORT_STATUS_FINAL или REPORT_STATUS_DRAFT
+        analyzed: Обновить и analyzed_at
         
-        # Добавляем недостающие колонки
-        with engine.connect() as conn:
-            for col_name, col_type in new_columns.items():
-                if col_name not in columns:
-                    logger.info(f"Добавление колонки {col_name} в таблицу instagram_profiles")
-                    if col_type == Integer:
-                        conn.execute(text(f"ALTER TABLE instagram_profiles ADD COLUMN {col_name} INTEGER DEFAULT 0"))
-                    elif col_type == Text:
-                        conn.execute(text(f"ALTER TABLE instagram_profiles ADD COLUMN {col_name} TEXT"))
-                    elif col_type == DateTime:
-                        conn.execute(text(f"ALTER TABLE instagram_profiles ADD COLUMN {col_name} TIMESTAMP"))
-                    conn.commit()
-                    logger.info(f"Колонка {col_name} успешно добавлена")
-
-
-def get_db():
-    """Получение сессии базы данных"""
-    db = SessionLocal()
+    Returns:
+        InstagramProfile: Профиль после записи или None, если отчет не записан
+    """
+    values = {
+        "report_ru": reports.get("ru"),
+        "report_en": reports.get("en"),
+        "report_generated_at": datetime.utcnow(),
+        "report_model": model,
+        "report_prompt_version": prompt_version,
+        "report_llm_call_id": (reports.get("meta") or {}).get("call_id"),
+        "report_status": status,
+    }
+    if analyzed:
+        values["analyzed_at"] = datetime.utcnow()
+    
+    statement = update(InstagramProfile).where(InstagramProfile.username == username)
+    if status == REPORT_STATUS_DRAFT:
+        statement = statement.where(~_has_final_report())
+    statement = statement.values(**values).returning(InstagramProfile)
+    profile = await db.scalar(statement, execution_options={"populate_existing": True})
+    await db.commit()
+    return profile
+
+
+# Колонки, по которым можно сортировать список профилей (для каждой есть индекс с id)
+PROFILE_SORT_COLUMNS = {
+    "updated_at": InstagramProfile.updated_at,
+    "created_at": InstagramProfile.created_at,
+    "followers": InstagramProfile.followers,
+}
+
+# Колонки списка профилей: без текстов отчетов
+PROFILE_LIST_COLUMNS = (
+    InstagramProfile.id,
+    InstagramProfile.username,
+    InstagramProfile.followers,
+    InstagramProfile.following,
+    InstagramProfile.posts_count,
+    InstagramProfile.bio,
+    InstagramProfile.engagement_rate,
+    InstagramProfile.views,
+    InstagramProfile.interactions,
+    InstagramProfile.new_followers,
+    InstagramProfile.messages,
+    InstagramProfile.shares,
+    InstagramProfile.analyzed_at,
+    InstagramProfile.created_at,
+    InstagramProfile.updated_at,
+    InstagramProfile.report_generated_at,
+    InstagramProfile.report_status,
+)
+
+
+def encode_cursor(sort: str, value, profile_id: int) -> str:
+    """Непрозрачный курсор следующей страницы: значение колонки сортировки и id последней строки"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, value, profile_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple:
+    """
+    Returns:
+        tuple: (значение колонки сортировки, id)
+        
+    Raises:
+        ValueError: Курсор поврежден или получен для другой сортировки
+    """
     try:
-        yield db
-    finally:
-        db.close()
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, profile_id = json.loads(payload)
+    except Exception:
+        raise ValueError("Некорректный cursor")
+    if cursor_sort != sort:
+        raise ValueError("cursor получен для другой сортировки")
+    if value is not None and isinstance(PROFILE_SORT_COLUMNS[sort].type, DateTime):
+        value = datetime.fromisoformat(value)
+    return value, int(profile_id)
 
+
+def _after_cursor(sort_column, value, last_id: int, descending: bool):
+    """
+    Условие "строка после курсора" для порядка (колонка сортировки, id) с NULL в конце
+
+    Сравнение кортежей с NULL дает NULL, поэтому строки с NULL в колонке сортировки
+    обрабатываются отдельно: они идут после всех значений и упорядочены по id
+    """
+    id_after = InstagramProfile.id < last_id if descending else InstagramProfile.id > last_id
+    if value is None:
+        return and_(sort_column.is_(None), id_after)
+    key = tuple_(sort_column, InstagramProfile.id)
+    return or_(key < tuple_(value, last_id) if descending else key > tuple_(value, last_id), sort_column.is_(None))
+
+
+async def list_profiles(
+    db: AsyncSession,
+    limit: int,
+    sort: str = "updated_at",
+    descending: bool = True,
+    cursor: Optional[str] = None,
+    has_report: Optional[bool] = None,
+    min_followers: Optional[int] = None,
+    username_prefix: Optional[str] = None
+) -> Tuple[List, Optional[str]]:
+    """
+    Страница списка профилей с keyset пагинацией по (колонка сортировки, id)
+    
+    Читаются только колонки списка, has_gpt_report вычисляется в SQL, поэтому
+    время и память запроса не зависят от размера таблицы и длины отчетов.
+    Профили без значения колонки сортировки (NULL) идут в конце при любом порядке
+    
+    Args:
+        limit: Размер страницы
+        sort: Колонка сортировки из PROFILE_SORT_COLUMNS
+        descending: Сначала большие значения
+        cursor: next_cursor предыдущей страницы
+        has_report: Только профили с отчетом (True) или без него (False)
+        min_followers: Минимальное число подписчиков
+        username_prefix: Начало username
+        
+    Returns:
+        tuple: (строки страницы, next_cursor или None для последней страницы)
+    """
+    sort_column = PROFILE_SORT_COLUMNS[sort]
+    statement = select(*PROFILE_LIST_COLUMNS, has_report_clause().label("has_gpt_report"))
+    
+    if has_report is not None:
+        statement = statement.where(has_report_clause() if has_report else ~has_report_clause())
+    if min_followers is not None:
+        statement = statement.where(InstagramProfile.followers >= min_followers)
+    if username_prefix:
+        statement = statement.where(InstagramProfile.username.startswith(username_prefix, autoescape=True))
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        statement = statement.where(_after_cursor(sort_column, value, last_id, descending))
+    
+    if descending:
+        order = (sort_column.desc().nulls_last(), InstagramProfile.id.desc())
+    else:
+        order = (sort_column.asc().nulls_last(), InstagramProfile.id.asc())
+    rows = (await db.execute(statement.order_by(*order).limit(limit + 1))).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, sort), last.id)
+    return rows, next_cursor
+
+
+async def get_db():
+    """Получение сессии базы данных"""
+    async with SessionLocal() as db:
+        yield db
@@ -0,0 +1,119 @@
+"""
+Настройки пула соединений с базой и его метрики: ожидание соединения, загрузка пула, переподключения
+"""
+import os
+import logging
+import time
+from collections import deque
+from typing import Any, Dict
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from latency_tracker import latency_summary
+
+logger = logging.getLogger(__name__)
+
+
+def pool_options() -> Dict[str, Any]:
+    """
+    Параметры пула для create_async_engine из переменных окружения
+
+    Прокси Postgres в Railway закрывает простаивающие соединения, поэтому по умолчанию
+    соединения пересоздаются раньше его таймаута (DB_POOL_RECYCLE) и проверяются перед
+    выдачей (DB_POOL_PRE_PING); LIFO держит в работе самые свежие соединения
+
+    Returns:
+        dict: pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping, pool_use_lifo
+    """
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 300)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_use_lifo": os.getenv("DB_POOL_USE_LIFO", "true").lower() == "true",
+    }
+
+
+class PoolMetrics:
+    """
+    Собирает метрики пула соединений: время получения соединения, новые подключения
+    (в том числе пересоздание по pool_recycle) и инвалидации (разорванные соединения,
+    неудачный pre-ping)
+    """
+
+    def __init__(self):
+        self._wait_ms = deque(maxlen=int(os.getenv("DB_POOL_METRICS_WINDOW", 500)))
+        self._checkouts = 0
+        self._connects = 0
+        self._invalidations = 0
+        self._timeouts = 0
+        self._pool = None
+        self._max_overflow = 0
+
+    def attach(self, pool):
+        """Подписывается на события пула движка"""
+        self._pool = pool
+        if isinstance(pool, QueuePool):
+            # Пул создан с теми же pool_options (см. database.py)
+            self._max_overflow = pool_options()["max_overflow"]
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "invalidate", self._on_invalidate)
+        event.listen(pool, "soft_invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self._connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self._invalidations += 1
+        if exception is not None:
+            logger.warning(f"Соединение с базой инвалидировано: {exception}")
+
+    def record_checkout(self, wait_ms: float, timed_out: bool = False):
+        if timed_out:
+            self._timeouts += 1
+            return
+        self._checkouts += 1
+        self._wait_ms.append(wait_ms)
+
+    def stats(self) -> dict:
+        result = {
+            "pool": type(self._pool).__name__ if self._pool is not None else None,
+            "checkouts": self._checkouts,
+            "checkout_timeouts": self._timeouts,
+            "connects": self._connects,
+            "invalidations": self._invalidations,
+            "checkout_wait": latency_summary(self._wait_ms, ndigits=1),
+        }
+        if isinstance(self._pool, QueuePool):
+            capacity = self._pool.size() + max(self._max_overflow, 0)
+            checked_out = self._pool.checkedout()
+            result.update({
+                "size": self._pool.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": checked_out,
+                "checked_in": self._pool.checkedin(),
+                "overflow": max(self._pool.overflow(), 0),
+                "utilization": round(checked_out / capacity, 3) if capacity else 0.0,
+            })
+        return result
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool, который измеряет время получения соединения: ожидание
+    свободного слота, подключение новых соединений и pre-ping
+    """
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_metrics.record_checkout((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        pool_metrics.record_checkout((time.perf_counter() - started) * 1000)
+        return connection
@@ -0,0 +1,326 @@
+"""
+Черновой отчет по правилам: та же структура из шести разделов, что и у GPT отчета,
+строится за миллисекунды из метрик профиля, пока LLM отчет не готов или недоступен
+"""
+from typing import Any, Dict, Optional
+from gpt_analyzer import SECTION_TITLES
+
+# Записывается в report_model / report_prompt_version вместо модели и версии промпта
+DRAFT_MODEL = "draft-rules"
+DRAFT_VERSION = "1"
+
+# Категории аккаунтов по подписчикам: (верхняя граница, название, ER ниже нормы, ER высокий)
+FOLLOWER_TIERS = (
+    (10_000, "нано-блогер", 0.03, 0.06),
+    (100_000, "микро-блогер", 0.02, 0.04),
+    (500_000, "блогер среднего уровня", 0.015, 0.03),
+    (1_000_000, "макро-блогер", 0.01, 0.025),
+    (None, "мега-блогер", 0.008, 0.02),
+)
+
+# Фаза роста по доле новых подписчиков за период статистики: (нижняя граница, фаза)
+GROWTH_PHASES = (
+    (0.10, "взрывной рост"),
+    (0.03, "активный рост"),
+    (0.005, "стабильный рост"),
+    (0.0, "плато"),
+)
+
+# Ниши по ключевым словам биографии
+NICHES = {
+    "psychology": {
+        "label": "психология и отношения",
+        "keywords": ("психолог", "психотерап", "коуч", "отношени", "терапи", "самооценк", "mindset"),
+        "style": "экспертный и доверительный: разборы, ответы на вопросы, личные истории",
+        "audience": "преимущественно женщины 25-45 лет, интересующиеся саморазвитием и отношениями",
+        "tone": "поддерживающий, спокойный, эмпатичный",
+        "partners": (
+            "Платформы онлайн-терапии и психологические сервисы",
+            "Коучинговые школы и курсы личностного развития",
+            "Издательства книг по психологии и саморазвитию",
+            "Сервисы знакомств и приложения для пар",
+        ),
+    },
+    "fitness": {
+        "label": "фитнес и здоровый образ жизни",
+        "keywords": ("фитнес", "тренер", "трениров", "спорт", "зож", "марафон", "питани", "нутрициолог", "йог"),
+        "style": "мотивационный и практический: тренировки, до/после, рационы",
+        "audience": "мужчины и женщины 20-40 лет, следящие за формой и здоровьем",
+        "tone": "энергичный, мотивирующий",
+        "partners": (
+            "Спортивное питание и витамины",
+            "Спортивная одежда и инвентарь",
+            "Фитнес-клубы и приложения для тренировок",
+            "Сервисы доставки здорового питания",
+        ),
+    },
+    "travel": {
+        "label": "путешествия",
+        "keywords": ("путешеств", "travel", "туризм", "тур ", "✈", "отпуск", "страны"),
+        "style": "визуальный: фото и видео локаций, гиды, подборки мест",
+        "audience": "молодые взрослые 22-40 лет с доходом выше среднего",
+        "tone": "вдохновляющий, легкий",
+        "partners": (
+            "Авиакомпании и сервисы бронирования",
+            "Отели и курорты",
+            "Банковские карты для путешествий и страхование",
+            "Производители багажа и фототехники",
+        ),
+    },
+    "family": {
+        "label": "материнство и семья",
+        "keywords": ("мама", "дети", "детей", "материнств", "семья", "семьи", "беремен", "малыш"),
+        "style": "личный и бытовой: будни семьи, советы, уют",
+        "audience": "женщины 25-40 лет, мамы и будущие мамы",
+        "tone": "теплый, искренний",
+        "partners": (
+            "Детские товары, одежда и игрушки",
+            "Детское питание и товары для мам",
+            "Товары для дома и уюта",
+            "Образовательные сервисы для детей",
+        ),
+    },
+    "food": {
+        "label": "кулинария",
+        "keywords": ("рецепт", "кулинар", "еда", "готов", "food", "шеф", "выпечк", "кухн"),
+        "style": "практический: рецепты, пошаговые видео, подборки блюд",
+        "audience": "женщины и мужчины 25-50 лет, готовящие дома",
+        "tone": "уютный, дружелюбный",
+        "partners": (
+            "Продуктовые бренды и сервисы доставки продуктов",
+            "Кухонная техника и посуда",
+            "Рестораны и сервисы доставки еды",
+            "Кулинарные школы",
+        ),
+    },
+    "beauty": {
+        "label": "красота и уход",
+        "keywords": ("красот", "макияж", "beauty", "косметик", "визаж", "бров", "ногт", "маникюр", "кожа", "уход"),
+        "style": "визуальный и обзорный: обзоры средств, туториалы, до/после",
+        "audience": "женщины 18-40 лет",
+        "tone": "дружелюбный, экспертный",
+        "partners": (
+            "Косметические и уходовые бренды",
+            "Салоны красоты и клиники косметологии",
+            "Магазины косметики и маркетплейсы",
+            "Бренды профессионального инструмента",
+        ),
+    },
+    "fashion": {
+        "label": "мода и стиль",
+        "keywords": ("мода", "стиль", "fashion", "стилист", "образ", "одежд", "outfit"),
+        "style": "визуальный: образы, подборки, тренды",
+        "audience": "женщины 18-35 лет, следящие за трендами",
+        "tone": "уверенный, вдохновляющий",
+        "partners": (
+            "Бренды одежды и обуви",
+            "Аксессуары и ювелирные бренды",
+            "Маркетплейсы и онлайн-магазины одежды",
+            "Сервисы аренды и ресейла одежды",
+        ),
+    },
+    "business": {
+        "label": "бизнес и финансы",
+        "keywords": ("бизнес", "предприним", "маркетинг", "продаж", "инвест", "финанс", "smm", "стартап"),
+        "style": "экспертный: кейсы, разборы, инструменты",
+        "audience": "мужчины и женщины 25-45 лет, предприниматели и специалисты",
+        "tone": "деловой, уверенный",
+        "partners": (
+            "Банки и финансовые сервисы",
+            "SaaS сервисы для бизнеса",
+            "Образовательные платформы и бизнес-школы",
+            "Конференции и деловые мероприятия",
+        ),
+    },
+    "education": {
+        "label": "образование",
+        "keywords": ("обучени", "курс", "школа", "учител", "английск", "язык", "репетитор", "преподава"),
+        "style": "обучающий: полезные карточки, уроки, разборы ошибок",
+        "audience": "студенты и взрослые 18-40 лет, которые учатся",
+        "tone": "понятный, поддерживающий",
+        "partners": (
+            "Онлайн-школы и платформы курсов",
+            "Приложения для изучения языков",
+            "Издательства учебной литературы",
+            "Сервисы для продуктивности",
+        ),
+    },
+}
+
+DEFAULT_NICHE = {
+    "label": "лайфстайл",
+    "style": "личный лайфстайл: повседневная жизнь, интересы автора",
+    "audience": "широкая аудитория 18-40 лет",
+    "tone": "дружелюбный, открытый",
+    "partners": (
+        "Лайфстайл бренды и товары для дома",
+        "Маркетплейсы и онлайн-магазины",
+        "Сервисы доставки и развлечений",
+        "Бренды одежды и аксессуаров",
+    ),
+}
+
+
+def follower_tier(followers: int) -> tuple:
+    """Категория аккаунта по подписчикам: (название, ER ниже нормы, ER высокий)"""
+    for limit, name, low, high in FOLLOWER_TIERS:
+        if limit is None or followers < limit:
+            return name, low, high
+
+
+def engagement_band(engagement_rate: Optional[float], followers: int) -> Optional[str]:
+    """Оценка ER относительно нормы для категории аккаунта (None - ER неизвестен)"""
+    if not engagement_rate:
+        return None
+    _, low, high = follower_tier(followers)
+    if engagement_rate < low / 2:
+        return "очень низкая"
+    if engagement_rate < low:
+        return "ниже нормы"
+    if engagement_rate < high:
+        return "в норме"
+    return "высокая"
+
+
+def growth_phase(new_followers: int, followers: int) -> Optional[str]:
+    """Фаза роста по новым подписчикам за период статистики (None - нет данных)"""
+    if not new_followers or not followers:
+        return None
+    share = new_followers / followers
+    for threshold, phase in GROWTH_PHASES:
+        if share >= threshold:
+            return phase
+
+
+def detect_niches(bio: str) -> list:
+    """Ниши по ключевым словам биографии, от наиболее вероятной"""
+    text = (bio or "").lower()
+    scores = {
+        key: sum(1 for keyword in niche["keywords"] if keyword in text)
+        for key, niche in NICHES.items()
+    }
+    return [key for key, score in sorted(scores.items(), key=lambda item: -item[1]) if score > 0]
+
+
+def _number(value: int) -> str:
+    return f"{value:,}".replace(",", " ")
+
+
+def render_draft_report(profile_data: Dict[str, Any], screenshot_data: Dict[str, Any]) -> str:
+    """
+    Строит черновой отчет по правилам
+
+    Args:
+        profile_data: Основные данные профиля (как для GPT отчета)
+        screenshot_data: Дополнительные данные из скриншота
+
+    Returns:
+        str: Отчет на русском языке с разделами GPT отчета
+    """
+    username = profile_data.get("username") or "unknown"
+    followers = profile_data.get("followers") or 0
+    following = profile_data.get("following") or 0
+    posts_count = profile_data.get("posts_count") or 0
+    bio = (profile_data.get("bio") or "").strip()
+    engagement_rate = profile_data.get("engagement_rate") or 0
+    views = screenshot_data.get("views") or 0
+    interactions = screenshot_data.get("interactions") or 0
+    new_followers = screenshot_data.get("new_followers") or 0
+    messages = screenshot_data.get("messages") or 0
+    shares = screenshot_data.get("shares") or 0
+
+    tier, _, _ = follower_tier(followers)
+    band = engagement_band(engagement_rate, followers)
+    phase = growth_phase(new_followers, followers)
+    niche_keys = detect_niches(bio)
+    niche = NICHES[niche_keys[0]] if niche_keys else DEFAULT_NICHE
+    secondary = NICHES[niche_keys[1]]["label"] if len(niche_keys) > 1 else None
+
+    sections = {}
+
+    metrics = [
+        f"- Подписчики: {_number(followers)} ({tier}), подписки: {_number(following)}, публикации: {_number(posts_count)}",
+    ]
+    if band:
+        metrics.append(f"- Вовлеченность (ER): {engagement_rate * 100:.2f}% - {band} для категории «{tier}»")
+    else:
+        metrics.append("- Вовлеченность (ER): нет данных")
+    if views:
+        metrics.append(f"- Просмотры: {_number(views)} (охват {views / followers * 100:.0f}% от числа подписчиков)" if followers else f"- Просмотры: {_number(views)}")
+    if interactions:
+        metrics.append(f"- Взаимодействия: {_number(interactions)}")
+    if phase:
+        metrics.append(f"- Новые подписчики: {_number(new_followers)} ({new_followers / followers * 100:.1f}% аудитории) - фаза: {phase}")
+    else:
+        metrics.append("- Динамика роста: нет данных о новых подписчиках")
+    if messages or shares:
+        metrics.append(f"- Сообщения: {_number(messages)}, репосты: {_number(shares)}")
+    sections["metrics"] = metrics
+
+    if band in ("высокая", "в норме") and (messages or shares):
+        trust = "высокий: аудитория активно реагирует, пишет и делится контентом"
+    elif band in ("высокая", "в норме"):
+        trust = "средний или высокий: реакция аудитории соответствует норме"
+    elif band:
+        trust = "требует проверки: вовлеченность ниже нормы для категории"
+    else:
+        trust = "не определен: недостаточно данных о реакции аудитории"
+    sections["audience"] = [
+        f"- Ниша: {niche['label']}" + (f" (также {secondary})" if secondary else "") + ("" if niche_keys else " - определена по умолчанию, биография не содержит явных признаков"),
+        f"- Стиль контента: {niche['style']}",
+        f"- Демография аудитории: {niche['audience']}",
+        f"- Уровень доверия аудитории: {trust}",
+        f"- Эмоциональный тон: {niche['tone']}",
+    ]
+
+    sections["partners"] = [f"{number}. {partner}" for number, partner in enumerate(niche["partners"], start=1)]
+
+    compliments = []
+    if band == "высокая":
+        compliments.append("Вовлеченность выше нормы для своей категории - аудитория живая и заинтересованная 🌟")
+    if phase in ("взрывной рост", "активный рост"):
+        compliments.append(f"Аккаунт в фазе «{phase}» - хорошее время для партнерств ✨")
+    if followers and views > followers:
+        compliments.append("Охват превышает число подписчиков - контент выходит за пределы текущей аудитории 🚀")
+    if shares:
+        compliments.append("Контентом делятся - у него есть ценность для аудитории 💬")
+    if bio:
+        compliments.append("Заполненная биография помогает быстро понять тематику аккаунта 👍")
+    if posts_count >= 100:
+        compliments.append(f"Большой архив контента ({_number(posts_count)} публикаций) - стабильное присутствие в ленте 📸")
+    if not compliments:
+        compliments.append("Аккаунт готов к росту: есть база для системной работы с контентом 🌱")
+    sections["compliments"] = [f"- {item}" for item in compliments]
+
+    recommendations = []
+    if band in ("очень низкая", "ниже нормы"):
+        recommendations.append("Повысить вовлеченность: вопросы и опросы в сторис, призывы к действию в постах, ответы на комментарии")
+    if phase == "плато":
+        recommendations.append("Выйти из плато: Reels с трендовыми форматами, коллаборации с аккаунтами той же ниши")
+    if not bio:
+        recommendations.append("Заполнить биографию: ниша, польза для подписчика и контакт для сотрудничества")
+    if posts_count < 30:
+        recommendations.append("Нарастить объем контента: регулярный график публикаций 3-5 раз в неделю")
+    if followers and following > followers:
+        recommendations.append("Сократить число подписок: соотношение подписок и подписчиков снижает доверие брендов")
+    if followers and views and views < followers * 0.3:
+        recommendations.append("Увеличить охват: больше Reels и сохраняемого контента (гайды, подборки)")
+    recommendations.append("Оформить Highlights с отзывами, кейсами и прайсом на рекламу")
+    recommendations.append("Подготовить медиакит со статистикой аудитории для рекламодателей")
+    sections["recommendations"] = [f"- {item}" for item in recommendations]
+
+    sections["insights"] = [
+        f"- Категория аккаунта: {tier}" + (f", вовлеченность {band}" if band else ""),
+        "- Оптимальный формат сотрудничества: " + (
+            "серия интеграций или амбассадорство" if band in ("высокая", "в норме") else "разовые интеграции с проверкой результата"
+        ),
+        "- Это предварительный отчет по метрикам профиля; подробный отчет формируется",
+    ]
+
+    lines = [f"Анализ аккаунта @{username}", ""]
+    for number, (key, title) in enumerate(SECTION_TITLES.items(), start=1):
+        lines.append(f"{number}. {title}")
+        lines.append("")
+        lines.extend(sections[key])
+        lines.append("")
+    return "\n".join(lines).strip()
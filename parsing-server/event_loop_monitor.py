@@ -0,0 +1,72 @@
+"""
+Измерение задержки event loop (насколько позже запланированного просыпается корутина)
+"""
+import asyncio
+import os
+import logging
+import time
+from collections import deque
+from typing import Optional
+from latency_tracker import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopLagMonitor:
+    """
+    Фоновая задача засыпает на фиксированный интервал и измеряет, насколько позже
+    она проснулась. Рост задержки означает блокирующий код в event loop
+    или нехватку воркеров под нагрузкой
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LOOP_LAG_MONITOR_ENABLED", "true").lower() == "true"
+        self.interval = float(os.getenv("LOOP_LAG_INTERVAL_MS", 100)) / 1000
+        self.warn_ms = float(os.getenv("LOOP_LAG_WARN_MS", 500))
+        self._samples = deque(maxlen=int(os.getenv("LOOP_LAG_WINDOW", 600)))
+        self._max_ms = 0.0
+        self._stalls = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Мониторинг задержки event loop запущен (интервал {self.interval * 1000:.0f} мс)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = max((time.perf_counter() - started - self.interval) * 1000, 0.0)
+            self._samples.append(lag_ms)
+            self._max_ms = max(self._max_ms, lag_ms)
+            if lag_ms >= self.warn_ms:
+                self._stalls += 1
+                logger.warning(f"Event loop был заблокирован на {lag_ms:.0f} мс")
+
+    def stats(self) -> dict:
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {"enabled": self.enabled, "samples": 0}
+        return {
+            "enabled": self.enabled,
+            "samples": len(ordered),
+            "interval_ms": self.interval * 1000,
+            "p50_ms": round(percentile(ordered, 50), 2),
+            "p99_ms": round(percentile(ordered, 99), 2),
+            "max_window_ms": round(ordered[-1], 2),
+            "max_ms": round(self._max_ms, 2),
+            "stalls": self._stalls,
+            "stall_threshold_ms": self.warn_ms,
+        }
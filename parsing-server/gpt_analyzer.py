@@ -2,86 +2,1125 @@
 Модуль для анализа Instagram профилей с помощью GPT
 """
 import os
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from openai import OpenAI
+import time
+from typing import Dict, Any, Optional, AsyncIterator, Awaitable, Callable
+import httpx
+from openai import AsyncOpenAI
+import hashlib
 import json
+import math
+import re
+from token_budget import (
+    REPORT_DEPTHS, DEPTH_SHORT, DEPTH_STANDARD, DEPTH_FULL,
+    count_tokens, count_message_tokens, data_level, effective_depth, completion_budget
+)
+from llm_metrics import STATUS_OK, STATUS_ERROR, ERROR_EMPTY_RESPONSE, classify_error, estimate_cost
+from llm_resilience import (
+    LLMRateLimiter, CircuitBreaker, RetryPolicy, LLMUnavailableError,
+    is_transient, retry_after_seconds
+)
 
 logger = logging.getLogger(__name__)
 
+# Версия шаблона промпта: увеличивайте при любом изменении _build_prompt или системного сообщения,
+# чтобы закэшированные отчеты по старому шаблону перестали совпадать
+PROMPT_VERSION = "2"
+
+SYSTEM_PROMPT_RU = "Ты эксперт по анализу Instagram аккаунтов, специализирующийся на маркетинге влияния и партнерствах с брендами. Генерируй детальные, профессиональные отчеты для рекламодателей и брендов. Всегда отвечай ТОЛЬКО на русском языке."
+
+# Разделы отчета в порядке вывода
+SECTION_TITLES = {
+    "metrics": "OVERALL ACCOUNT METRICS & PERFORMANCE",
+    "audience": "AUDIENCE & CONTENT ANALYSIS",
+    "partners": "POTENTIAL PARTNERS & ADVERTISERS",
+    "compliments": "COMPLIMENTS — STRONG POINTS OF THE ACCOUNT",
+    "recommendations": "SPECIFIC RECOMMENDATIONS FOR IMPROVEMENT",
+    "insights": "ADDITIONAL INSIGHTS",
+}
+REPORT_SECTIONS = tuple(SECTION_TITLES)
+
+# Какие разделы запрашиваются для каждой глубины отчета
+DEPTH_SECTIONS = {
+    DEPTH_SHORT: ("metrics", "audience", "recommendations"),
+    DEPTH_STANDARD: REPORT_SECTIONS,
+    DEPTH_FULL: REPORT_SECTIONS,
+}
+
+# Инструкции разделов, не зависящие от данных профиля: (подробная, сжатая)
+SECTION_INSTRUCTIONS = {
+    "audience": (
+        """Определи на основе биографии и количества подписчиков:
+- Нишу (Niche) - определи тематику аккаунта по биографии
+- Стиль контента (Content Style) - предположи стиль на основе ниши
+- Демографию аудитории (Audience Demographics) - оцени целевую аудиторию
+- Уровень доверия аудитории (Audience Trust Level) - оцени на основе метрик
+- Эмоциональный тон контента (Emotional Tone) - предположи на основе ниши""",
+        "Ниша, стиль контента, демография аудитории, уровень доверия и эмоциональный тон - по биографии и метрикам.",
+    ),
+    "partners": (
+        """Разбей по категориям на основе ниши аккаунта:
+1. Психологические и коучинг сервисы
+2. Лайфстайл и личностное развитие бренды
+3. Отношения и сегмент знакомств
+4. Продукты для саморазвития
+5. Контент-креаторы и кросс-промо""",
+        "3-5 категорий рекламодателей, подходящих нише аккаунта, с примерами.",
+    ),
+    "compliments": (
+        """Выдели 5 сильных сторон аккаунта с эмодзи 🌟 на основе:
+- Количества подписчиков
+- Количества публикаций
+- Биографии
+- Engagement Rate
+- Общего впечатления""",
+        "5 сильных сторон аккаунта с эмодзи 🌟 (подписчики, публикации, биография, ER, общее впечатление).",
+    ),
+    "recommendations": (
+        """Дай 5-6 конкретных рекомендаций по улучшению:
+1. Добавить больше структурированных Highlights
+2. Ввести формат "серийного контента"
+3. Усилить CTAs в Reels
+4. Конвертировать вирусный трафик в глубокую аудиторию
+5. Начать длинный контент (опционально)
+6. Дополнительные рекомендации на основе ниши""",
+        "Конкретные рекомендации по контенту, росту и вовлеченности с учетом ниши.",
+    ),
+    "insights": (
+        """Включи:
+- 🔥 Лучшие возможности для контента (на основе ниши)
+- 📈 Ускорители роста (конкретные действия)
+- 💰 Возможности монетизации (способы заработка)""",
+        "🔥 Возможности для контента, 📈 ускорители роста, 💰 возможности монетизации.",
+    ),
+}
+
+CLOSING_INSTRUCTIONS = """ВАЖНО: 
+- Отвечай ТОЛЬКО на русском языке
+- Используй профессиональный тон, но понятный язык
+- Сохраняй структуру с заголовками и подзаголовками
+- Если данных из скриншота нет, делай анализ на основе доступных публичных данных
+- Будь конкретным и давай практические рекомендации"""
+
+CLOSING_INSTRUCTIONS_COMPACT = "ВАЖНО: отвечай ТОЛЬКО на русском языке, профессионально и конкретно, сохраняй структуру с заголовками."
+
+# Биография длиннее этого обрезается, если сжатых инструкций не хватило для бюджета
+BIO_COMPACT_CHARS = 300
+
+# Режимы генерации: один запрос на весь отчет или параллельные запросы по разделам
+GENERATION_SINGLE = "single"
+GENERATION_SECTIONED = "sectioned"
+GENERATION_MODES = (GENERATION_SINGLE, GENERATION_SECTIONED)
+# Регенерация только разделов с изменившимися входными данными (остальные берутся из прошлого отчета)
+GENERATION_INCREMENTAL = "incremental"
+
+# Системное сообщение режима sectioned: статичный общий префикс всех запросов разделов
+# (кэшируется на стороне провайдера), динамические данные профиля идут после него
+SECTIONED_SYSTEM_PROMPT_RU = "\n\n".join([
+    SYSTEM_PROMPT_RU,
+    "Отчет для рекламодателей состоит из разделов:\n"
+    + "\n".join(f"{number}. {title}" for number, title in enumerate(SECTION_TITLES.values(), start=1)),
+    "Разделы пишутся независимо: в каждом запросе напиши ровно один указанный раздел - только его содержимое, "
+    "без заголовка раздела, вступления и выводов по отчету в целом.",
+    *(
+        f"Инструкции раздела {SECTION_TITLES[section]}:\n{detailed}"
+        for section, (detailed, _) in SECTION_INSTRUCTIONS.items()
+    ),
+    CLOSING_INSTRUCTIONS,
+])
+
+# max_tokens раздела: равная доля бюджета отчета с запасом, но не меньше минимума
+SECTION_TOKEN_HEADROOM = 1.5
+SECTION_MIN_TOKENS = 300
+
+# Входные данные, от которых зависит текст раздела. Ниша и партнеры определяются
+# биографией и масштабом аккаунта (порядок числа подписчиков), поэтому при обновлении
+# одних цифр эти разделы берутся из прошлого отчета
+METRIC_INPUTS = (
+    "followers", "following", "posts_count", "engagement_rate",
+    "views", "interactions", "new_followers", "messages", "shares",
+)
+NICHE_INPUTS = ("bio", "audience_scale")
+SECTION_INPUTS = {
+    "metrics": METRIC_INPUTS,
+    "audience": NICHE_INPUTS,
+    "partners": NICHE_INPUTS,
+    "compliments": NICHE_INPUTS + METRIC_INPUTS,
+    "recommendations": NICHE_INPUTS + METRIC_INPUTS,
+    "insights": NICHE_INPUTS + METRIC_INPUTS,
+}
+
+# Двуязычный отчет одним запросом: ответ - JSON по схеме, русский текст идет первым
+# и передается потоком, английский - перевод того же отчета в том же ответе
+BILINGUAL_SYSTEM_PROMPT = SYSTEM_PROMPT_RU + (
+    " Верни JSON с двумя полями: ru - полный отчет на русском языке по инструкциям пользователя, "
+    "en - тот же отчет, переведенный на английский язык с той же структурой, заголовками и эмодзи. "
+    "Требование отвечать только на русском относится к полю ru."
+)
+BILINGUAL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "bilingual_report",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "ru": {"type": "string"},
+                "en": {"type": "string"},
+            },
+            "required": ["ru", "en"],
+            "additionalProperties": False,
+        },
+    },
+}
+# Английский текст короче русского в токенах: на оба языка хватает ~1.7 бюджета русского отчета
+BILINGUAL_TOKEN_FACTOR = 1.7
+
+# Перевод готового отчета дешевле повторного анализа: промпт - только текст отчета
+TRANSLATION_SYSTEM_PROMPT = (
+    "Переведи отчет об Instagram аккаунте с русского языка на английский. "
+    "Сохрани структуру, нумерацию, заголовки, списки, эмодзи, числа и username без изменений. "
+    "Верни только перевод."
+)
+TRANSLATION_TOKEN_FACTOR = 1.0
+
+MODE_BILINGUAL = "bilingual"
+MODE_TRANSLATION = "translation"
+
+
+def build_prompt_data(profile) -> tuple:
+    """
+    Формирует входные данные для GPT отчета из профиля (InstagramProfile)
+    
+    Returns:
+        tuple: (данные профиля, данные из скриншота)
+    """
+    profile_dict = {
+        "username": profile.username,
+        "followers": profile.followers,
+        "following": profile.following,
+        "posts_count": profile.posts_count,
+        "bio": profile.bio,
+        "engagement_rate": profile.engagement_rate
+    }
+    
+    screenshot_data = {
+        "views": profile.views,
+        "interactions": profile.interactions,
+        "new_followers": profile.new_followers,
+        "messages": profile.messages,
+        "shares": profile.shares
+    }
+    return profile_dict, screenshot_data
+
+
+def prompt_inputs(profile_data: Dict[str, Any], screenshot_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Входные данные промпта в каноническом виде (для отпечатка отчета и хэшей разделов)"""
+    engagement_rate = profile_data.get('engagement_rate') or 0
+    return {
+        "username": profile_data.get('username') or 'unknown',
+        "followers": profile_data.get('followers') or 0,
+        "following": profile_data.get('following') or 0,
+        "posts_count": profile_data.get('posts_count') or 0,
+        "bio": (profile_data.get('bio') or '').strip(),
+        # В промпт попадает ER в процентах с двумя знаками
+        "engagement_rate": round(engagement_rate * 100, 2) if engagement_rate > 0 else 0,
+        "views": screenshot_data.get('views') or 0,
+        "interactions": screenshot_data.get('interactions') or 0,
+        "new_followers": screenshot_data.get('new_followers') or 0,
+        "messages": screenshot_data.get('messages') or 0,
+        "shares": screenshot_data.get('shares') or 0,
+    }
+
+
+def audience_scale(followers: int) -> int:
+    """Масштаб аккаунта - порядок числа подписчиков (3 - тысячи, 4 - десятки тысяч, ...)"""
+    return int(math.log10(followers)) if followers and followers > 0 else 0
+
+
+def _heading_key(text: str) -> str:
+    return " ".join(re.findall(r"[a-zа-яё]+", text.lower()))
+
+
+def split_report_sections(text: str, sections) -> Optional[Dict[str, str]]:
+    """
+    Делит текст отчета на разделы по заголовкам SECTION_TITLES
+    
+    Args:
+        text: Текст отчета
+        sections: Ожидаемые разделы в порядке вывода
+    
+    Returns:
+        dict: {раздел: текст без заголовка} или None, если какой-то заголовок не найден
+    """
+    lines = text.splitlines()
+    starts = []
+    position = 0
+    for section in sections:
+        title = _heading_key(SECTION_TITLES[section])
+        for index in range(position, len(lines)):
+            if title in _heading_key(lines[index]):
+                starts.append(index)
+                position = index + 1
+                break
+        else:
+            return None
+    
+    ends = starts[1:] + [len(lines)]
+    return {
+        section: "\n".join(lines[start + 1:end]).strip()
+        for section, start, end in zip(sections, starts, ends)
+    }
+
+
+def strip_section_heading(text: str, title: str) -> str:
+    """Убирает заголовок раздела, если модель начала раздел с него"""
+    text = text.lstrip()
+    first_line, _, rest = text.partition("\n")
+    if title.lower() in first_line.strip().strip("#*").lower():
+        return rest.lstrip("\n")
+    return text
+
+
+class JSONStringFieldStream:
+    """
+    Извлекает значение строкового поля из JSON, который приходит по частям:
+    текст поля отдается по мере поступления, не дожидаясь конца ответа
+    """
+    
+    def __init__(self, field: str):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._raw = ""
+        self._pos = None  # Начало еще не декодированной части значения
+        self.done = False
+    
+    def feed(self, delta: str) -> str:
+        """Добавляет фрагмент ответа и возвращает новый декодированный текст поля"""
+        self._raw += delta
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._key.search(self._raw)
+            if not match:
+                return ""
+            self._pos = match.end()
+        
+        raw = self._raw
+        i = self._pos
+        while i < len(raw):
+            char = raw[i]
+            if char == '"':
+                self.done = True
+                break
+            if char == "\\":
+                if i + 1 >= len(raw):
+                    break
+                if raw[i + 1] == "u":
+                    # Суррогатная пара (эмодзи) декодируется только целиком
+                    size = 12 if raw[i + 2:i + 4].lower() in ("d8", "d9", "da", "db") else 6
+                    if i + size > len(raw):
+                        break
+                    i += size
+                else:
+                    i += 2
+                continue
+            i += 1
+        
+        text = json.loads(f'"{raw[self._pos:i]}"') if i > self._pos else ""
+        self._pos = i
+        return text
+
+
+def parse_bilingual_output(raw: str, streamed_ru: str = "") -> Dict[str, str]:
+    """
+    Разбирает JSON ответ двуязычного режима
+    
+    Args:
+        raw: Полный текст ответа модели
+        streamed_ru: Русский текст, уже извлеченный из потока (если JSON оборван по max_tokens)
+    
+    Returns:
+        dict: {"ru": ..., "en": ...}
+    """
+    try:
+        data = json.loads(raw)
+        return {"ru": (data.get("ru") or "").strip(), "en": (data.get("en") or "").strip()}
+    except (ValueError, AttributeError):
+        logger.warning(f"Двуязычный ответ не является корректным JSON ({len(raw)} символов), английский текст потерян")
+        return {"ru": streamed_ru.strip(), "en": ""}
+
+
+def merge_section_metas(meta: Dict[str, Any], section_metas: list, duration_ms: int):
+    """
+    Сводит данные вызовов разделов в данные одного отчета
+    
+    Args:
+        meta: Итоговый словарь (заполняется)
+        section_metas: Данные вызовов разделов в порядке разделов
+        duration_ms: Время генерации всего отчета
+    """
+    calls = [m for m in section_metas if m]
+    if not calls:
+        return
+    failed = [m for m in calls if m["status"] != STATUS_OK]
+    costs = [m["cost_usd"] for m in calls if m.get("cost_usd") is not None]
+    meta.update({
+        "username": calls[0]["username"],
+        "model": calls[0]["model"],
+        "prompt_version": calls[0]["prompt_version"],
+        "depth": calls[0]["depth"],
+        "streaming": calls[0]["streaming"],
+        "mode": calls[0]["mode"],
+        "status": STATUS_ERROR if failed else STATUS_OK,
+        "error_class": failed[0]["error_class"] if failed else None,
+        "error_message": failed[0]["error_message"] if failed else None,
+        "prompt_tokens": sum(m["prompt_tokens"] or 0 for m in calls),
+        "completion_tokens": sum(m["completion_tokens"] or 0 for m in calls),
+        "usage_estimated": any(m["usage_estimated"] for m in calls),
+        # Клиент видит первый токен первого раздела
+        "ttft_ms": calls[0]["ttft_ms"],
+        "duration_ms": duration_ms,
+        "cost_usd": round(sum(costs), 6) if costs else None,
+        "call_id": calls[0].get("call_id"),
+        "sections": [
+            {key: m.get(key) for key in ("section", "status", "error_class", "prompt_tokens", "completion_tokens", "ttft_ms", "duration_ms", "call_id")}
+            for m in calls
+        ],
+    })
+
 
 class GPTAnalyzer:
     """Класс для анализа Instagram профилей с помощью GPT"""
     
-    def __init__(self):
+    def __init__(self, call_recorder: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        """
+        Args:
+            call_recorder: Корутина, получающая данные каждого вызова LLM (например, LLMMetrics.record)
+        """
         api_key = os.getenv("OPENAI_API_KEY")
+        self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # Можно использовать gpt-4o-mini или gpt-4
+        self.timeout = float(os.getenv("OPENAI_TIMEOUT_SECONDS", 120))
+        self.call_recorder = call_recorder
+        
+        # Бюджет токенов: глубина отчета по умолчанию, предел промпта и ответа
+        self.default_depth = os.getenv("REPORT_DEPTH", DEPTH_FULL)
+        if self.default_depth not in REPORT_DEPTHS:
+            logger.warning(f"Неизвестная глубина отчета REPORT_DEPTH={self.default_depth}, используется {DEPTH_FULL}")
+            self.default_depth = DEPTH_FULL
+        self.prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", 1500))
+        self.max_tokens_limit = int(os.getenv("OPENAI_MAX_TOKENS", 4000))
+        
+        self.generation_mode = os.getenv("REPORT_GENERATION_MODE", GENERATION_SINGLE)
+        if self.generation_mode not in GENERATION_MODES:
+            logger.warning(f"Неизвестный режим генерации REPORT_GENERATION_MODE={self.generation_mode}, используется {GENERATION_SINGLE}")
+            self.generation_mode = GENERATION_SINGLE
+        
+        # Русский и английский отчет одним запросом (JSON по схеме); без него английский
+        # получается по запросу переводом готового отчета (translate_report)
+        self.bilingual = os.getenv("REPORT_BILINGUAL_OUTPUT", "false").lower() == "true"
+        if self.bilingual and self.generation_mode != GENERATION_SINGLE:
+            logger.warning(f"REPORT_BILINGUAL_OUTPUT поддерживается только в режиме {GENERATION_SINGLE}, отчеты будут на русском")
+            self.bilingual = False
+        self.translation_model = os.getenv("OPENAI_TRANSLATION_MODEL", self.model)
+        
         if not api_key:
             logger.warning("OPENAI_API_KEY не установлен. GPT анализ будет недоступен.")
             self.client = None
+            self.http_client = None
         else:
-            self.client = OpenAI(api_key=api_key)
+            # Общий пул HTTP соединений для всех одновременных запросов к OpenAI
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", 50)),
+                    max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=10.0)
+            )
+            # Повторы выполняет _open_stream (с учетом квоты и размыкателя цепи), а не клиент
+            self.client = AsyncOpenAI(api_key=api_key, http_client=self.http_client, timeout=self.timeout, max_retries=0)
         
-        self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # Можно использовать gpt-4o-mini или gpt-4
+        self.rate_limiter = LLMRateLimiter()
+        self.circuit_breaker = CircuitBreaker()
+        self.retry_policy = RetryPolicy()
     
-    def generate_report(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any]) -> Dict[str, str]:
+    async def close(self):
+        """Закрывает пул HTTP соединений"""
+        if self.client:
+            await self.client.close()
+    
+    async def generate_report(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], timeout: Optional[float] = None, depth: Optional[str] = None, previous_sections: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Any]:
         """
-        Генерирует отчет на русском языке с помощью GPT
+        Генерирует отчет на русском языке (и английском при REPORT_BILINGUAL_OUTPUT) с помощью GPT
         
         Args:
             profile_data: Основные данные профиля
             screenshot_data: Дополнительные данные из скриншота
-            
+            timeout: Общий таймаут генерации в секундах (по умолчанию OPENAI_TIMEOUT_SECONDS)
+            depth: Глубина отчета: short, standard или full (по умолчанию REPORT_DEPTH)
+            previous_sections: Разделы прошлого отчета с хэшами входных данных; разделы
+                               с неизменными данными не генерируются заново
+        
         Returns:
-            dict: {"ru": "отчет на русском", "en": ""}
+            dict: {"ru": "отчет на русском", "en": "отчет на английском или пусто", "meta": данные вызова LLM,
+                   "sections": разделы отчета с хэшами входных данных или None};
+                  при временной недоступности провайдера отчет пустой, а retry_after -
+                  через сколько секунд имеет смысл повторить
         """
         if not self.client:
             logger.error("GPT клиент не инициализирован. Проверьте OPENAI_API_KEY.")
-            return {"ru": "", "en": ""}
-        
-        # Формируем промпт с данными
-        prompt = self._build_prompt(profile_data, screenshot_data)
+            return {"ru": "", "en": "", "meta": None}
         
+        meta = {}
+        reports = {}
         try:
-            # Генерируем отчет на русском языке
-            response_ru = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Ты эксперт по анализу Instagram аккаунтов, специализирующийся на маркетинге влияния и партнерствах с брендами. Генерируй детальные, профессиональные отчеты для рекламодателей и брендов. Всегда отвечай ТОЛЬКО на русском языке."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=4000
-            )
+            # Генерируем отчет на русском языке. Ответ читается потоком, чтобы
+            # измерить время до первого токена; таймаут - на всю генерацию
+            chunks = [
+                delta async for delta in
+                self._report_stream(profile_data, screenshot_data, depth, timeout, meta, streaming=False, total_timeout=timeout or self.timeout, reports=reports, previous_sections=previous_sections)
+            ]
+            report_ru = reports.get("ru") or "".join(chunks).strip()
             
-            report_ru = response_ru.choices[0].message.content.strip()
-            
-            logger.info("GPT отчет успешно сгенерирован")
+            if meta.get("reused_sections"):
+                logger.info(f"GPT отчет успешно сгенерирован, из прошлого отчета взяты разделы: {', '.join(meta['reused_sections'])}")
+            else:
+                logger.info("GPT отчет успешно сгенерирован")
             return {
                 "ru": report_ru,
-                "en": ""
+                "en": reports.get("en", ""),
+                "meta": meta,
+                "sections": self.report_sections(report_ru, profile_data, screenshot_data, depth)
             }
-            
+        
+        except Exception as e:
+            logger.error(f"Ошибка при генерации GPT отчета ({meta.get('error_class') or classify_error(e)}): {e}")
+            return {"ru": "", "en": "", "meta": meta or None, "retry_after": self.retry_after_hint(e)}
+    
+    async def stream_report(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], timeout: Optional[float] = None, depth: Optional[str] = None, meta: Optional[Dict[str, Any]] = None, reports: Optional[Dict[str, Any]] = None, previous_sections: Optional[Dict[str, Dict[str, str]]] = None) -> AsyncIterator[str]:
+        """
+        Генерирует отчет на русском языке, отдавая текст по мере поступления токенов
+        
+        Args:
+            profile_data: Основные данные профиля
+            screenshot_data: Дополнительные данные из скриншота
+            timeout: Таймаут запроса в секундах (по умолчанию OPENAI_TIMEOUT_SECONDS)
+            depth: Глубина отчета: short, standard или full (по умолчанию REPORT_DEPTH)
+            meta: Словарь, который будет заполнен данными вызова LLM
+            reports: Словарь, в который после генерации записываются итоговые ru, en и sections
+            previous_sections: Разделы прошлого отчета с хэшами входных данных
+        
+        Yields:
+            str: Очередной фрагмент текста отчета на русском
+        """
+        if not self.client:
+            raise RuntimeError("GPT клиент не инициализирован. Проверьте OPENAI_API_KEY.")
+        
+        chunks = []
+        reports = reports if reports is not None else {}
+        async for delta in self._report_stream(profile_data, screenshot_data, depth, timeout, meta if meta is not None else {}, streaming=True, reports=reports, previous_sections=previous_sections):
+            chunks.append(delta)
+            yield delta
+        reports.setdefault("ru", "".join(chunks).strip())
+        reports.setdefault("en", "")
+        reports["sections"] = self.report_sections(reports["ru"], profile_data, screenshot_data, depth)
+    
+    def _report_stream(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str], timeout: Optional[float], meta: Dict[str, Any], streaming: bool, total_timeout: Optional[float] = None, reports: Optional[Dict[str, str]] = None, previous_sections: Optional[Dict[str, Dict[str, str]]] = None) -> AsyncIterator[str]:
+        """Поток русского текста отчета в текущем режиме генерации"""
+        # Если часть разделов не изменилась, заново генерируются только остальные (запросами по разделам)
+        reused = self.reusable_sections(profile_data, screenshot_data, depth, previous_sections)
+        if self.generation_mode == GENERATION_SECTIONED or reused:
+            return self._sectioned_stream(profile_data, screenshot_data, depth, timeout, meta, streaming, total_timeout, reused)
+        plan = self.plan_prompt(profile_data, screenshot_data, depth)
+        if plan.get("bilingual"):
+            return self._bilingual_stream(profile_data, plan, timeout, meta, streaming, total_timeout, reports if reports is not None else {})
+        return self._instrumented_stream(profile_data, plan, timeout, meta, streaming, total_timeout)
+    
+    async def _bilingual_stream(self, profile_data: Dict[str, Any], plan: Dict[str, Any], timeout: Optional[float], meta: Dict[str, Any], streaming: bool, total_timeout: Optional[float], reports: Dict[str, str]) -> AsyncIterator[str]:
+        """
+        Двуязычный отчет одним запросом: русский текст отдается потоком из поля ru
+        JSON ответа, оба текста записываются в reports после окончания ответа
+        """
+        field = JSONStringFieldStream("ru")
+        raw = []
+        streamed = []
+        async for delta in self._instrumented_stream(profile_data, plan, timeout, meta, streaming, total_timeout):
+            raw.append(delta)
+            text = field.feed(delta)
+            if text:
+                streamed.append(text)
+                yield text
+        reports.update(parse_bilingual_output("".join(raw), "".join(streamed)))
+    
+    async def _sectioned_stream(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str], timeout: Optional[float], meta: Dict[str, Any], streaming: bool, total_timeout: Optional[float] = None, reused: Optional[Dict[str, str]] = None) -> AsyncIterator[str]:
+        """
+        Генерирует разделы отчета параллельными запросами и отдает их по порядку
+        
+        Первый раздел передается по мере генерации, остальные накапливаются, пока
+        не подойдет их очередь. Время генерации - примерно время самого длинного раздела.
+        Ошибка любого раздела прерывает отчет и отменяет остальные запросы.
+        Разделы из reused ({раздел: текст}) отдаются без запроса к LLM.
+        """
+        reused = reused or {}
+        plans = self.plan_sections(profile_data, screenshot_data, depth)
+        section_metas = [{} for _ in plans]
+        queues = [asyncio.Queue() for _ in plans]
+        started = time.perf_counter()
+        for plan, queue in zip(plans, queues):
+            if plan["section"] in reused:
+                queue.put_nowait(reused[plan["section"]])
+                queue.put_nowait(None)
+            elif reused:
+                plan["mode"] = GENERATION_INCREMENTAL
+        
+        async def run_section(plan, section_meta, queue):
+            try:
+                async for delta in self._instrumented_stream(profile_data, plan, timeout, section_meta, streaming, total_timeout):
+                    queue.put_nowait(delta)
+                queue.put_nowait(None)
+            except Exception as e:
+                queue.put_nowait(e)
+        
+        tasks = [
+            asyncio.create_task(run_section(plan, section_meta, queue))
+            for plan, section_meta, queue in zip(plans, section_metas, queues)
+            if plan["section"] not in reused
+        ]
+        try:
+            for number, (plan, queue) in enumerate(zip(plans, queues), start=1):
+                title = SECTION_TITLES[plan["section"]]
+                separator = "" if number == 1 else "\n\n"
+                yield f"{separator}{number}. {title}\n\n"
+                
+                # Начало раздела придерживается до конца первой строки: модель может повторить заголовок
+                pending = ""
+                heading_checked = False
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    if heading_checked:
+                        yield item
+                        continue
+                    pending += item
+                    if "\n" in pending.lstrip():
+                        heading_checked = True
+                        text = strip_section_heading(pending, title)
+                        if text:
+                            yield text
+                if not heading_checked and pending:
+                    yield strip_section_heading(pending, title)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            merge_section_metas(meta, section_metas, round((time.perf_counter() - started) * 1000))
+            if reused:
+                meta["reused_sections"] = [plan["section"] for plan in plans if plan["section"] in reused]
+    
+    async def _instrumented_stream(self, profile_data: Dict[str, Any], plan: Dict[str, Any], timeout: Optional[float], meta: Dict[str, Any], streaming: bool, total_timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Потоковый запрос chat completions с учетом вызова: токены, время до первого токена,
+        длительность, стоимость и класс ошибки записываются в meta и передаются в call_recorder
+        
+        Args:
+            timeout: Таймаут HTTP запроса (ожидание каждого фрагмента)
+            total_timeout: Предельная длительность всей генерации (None - без ограничения)
+        """
+        meta.update({
+            "username": profile_data.get('username'),
+            "model": plan.get("model", self.model),
+            "prompt_version": PROMPT_VERSION,
+            "depth": plan["depth"],
+            "section": plan.get("section"),
+            "mode": plan.get("mode", GENERATION_SINGLE),
+            "streaming": streaming,
+            "status": STATUS_OK,
+            "error_class": None,
+            "error_message": None,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+            "usage_estimated": False,
+            "ttft_ms": None,
+            "duration_ms": None,
+            "cost_usd": None,
+            "attempts": 0,
+            "limiter_wait_ms": 0,
+        })
+        started = time.perf_counter()
+        chunks = []
+        reserved = 0
+        try:
+            stream, reserved = await self._open_stream(plan, timeout, meta, started, total_timeout)
+            try:
+                async for chunk in stream:
+                    if total_timeout and time.perf_counter() - started > total_timeout:
+                        raise asyncio.TimeoutError(f"Генерация дольше {total_timeout:g} с")
+                    if chunk.usage:
+                        meta["prompt_tokens"] = chunk.usage.prompt_tokens
+                        meta["completion_tokens"] = chunk.usage.completion_tokens
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if meta["ttft_ms"] is None:
+                            meta["ttft_ms"] = round((time.perf_counter() - started) * 1000)
+                        chunks.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+            if not "".join(chunks).strip():
+                meta.update({"status": STATUS_ERROR, "error_class": ERROR_EMPTY_RESPONSE})
+        except BaseException as e:
+            # BaseException: отмена запроса (клиент закрыл соединение) тоже учитывается
+            meta.update({"status": STATUS_ERROR, "error_class": classify_error(e), "error_message": str(e)[:500] or None})
+            raise
+        finally:
+            meta["duration_ms"] = round((time.perf_counter() - started) * 1000)
+            if meta["prompt_tokens"] is None and chunks:
+                # Провайдер не вернул usage: оценка промпта и подсчет токенов полученного текста
+                meta["prompt_tokens"] = plan["prompt_tokens"]
+                meta["completion_tokens"] = count_tokens("".join(chunks), meta["model"])
+                meta["usage_estimated"] = True
+            if meta["prompt_tokens"] is not None:
+                meta["cost_usd"] = estimate_cost(meta["model"], meta["prompt_tokens"], meta["completion_tokens"])
+                self.rate_limiter.settle(reserved, meta["prompt_tokens"] + (meta["completion_tokens"] or 0))
+            self._log_call(plan, meta)
+            if self.call_recorder:
+                await self.call_recorder(meta)
+    
+    async def translate_report(self, report_ru: str, username: Optional[str] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Переводит готовый русский отчет на английский отдельным дешевым запросом
+        (OPENAI_TRANSLATION_MODEL): в промпте только текст отчета, без повторного анализа
+        
+        Args:
+            report_ru: Отчет на русском языке
+            username: Username профиля (для журнала вызовов)
+            timeout: Общий таймаут перевода в секундах
+        
+        Returns:
+            dict: {"en": "перевод", "meta": данные вызова LLM}; при ошибке en пустой,
+                  retry_after - как в generate_report
+        """
+        if not self.client:
+            logger.error("GPT клиент не инициализирован. Проверьте OPENAI_API_KEY.")
+            return {"en": "", "meta": None}
+        
+        messages = [
+            {"role": "system", "content": TRANSLATION_SYSTEM_PROMPT},
+            {"role": "user", "content": report_ru}
+        ]
+        report_tokens = count_tokens(report_ru, self.translation_model)
+        plan = {
+            "messages": messages,
+            "max_tokens": min(int(report_tokens * TRANSLATION_TOKEN_FACTOR) + 100, self.max_tokens_limit),
+            "prompt_tokens": count_message_tokens(messages, self.translation_model),
+            "depth": None,
+            "compact": False,
+            "mode": MODE_TRANSLATION,
+            "model": self.translation_model,
+            "temperature": 0.2,
+        }
+        meta = {}
+        try:
+            chunks = [
+                delta async for delta in
+                self._instrumented_stream({"username": username}, plan, timeout, meta, streaming=False, total_timeout=timeout or self.timeout)
+            ]
+            return {"en": "".join(chunks).strip(), "meta": meta}
         except Exception as e:
-            logger.error(f"Ошибка при генерации GPT отчета: {e}")
-            return {"ru": "", "en": ""}
+            logger.error(f"Ошибка при переводе отчета ({meta.get('error_class') or classify_error(e)}): {e}")
+            return {"en": "", "meta": meta or None, "retry_after": self.retry_after_hint(e)}
+    
+    async def _open_stream(self, plan: Dict[str, Any], timeout: Optional[float], meta: Dict[str, Any], started: float, total_timeout: Optional[float]) -> tuple:
+        """
+        Открывает поток ответа: ожидание квоты, проверка размыкателя цепи и повторы
+        временных ошибок (429, 5xx, сеть) с экспоненциальной задержкой
+        
+        Ошибки после начала потока не повторяются: часть текста уже могла уйти клиенту.
+        
+        Returns:
+            tuple: (поток ответа, зарезервированные токены TPM)
+        
+        Raises:
+            LLMUnavailableError: Цепь разомкнута или квота не освободится вовремя
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            meta["attempts"] = attempt
+            remaining = total_timeout - (time.perf_counter() - started) if total_timeout else None
+            try:
+                self.circuit_breaker.before_call()
+            except LLMUnavailableError:
+                self.retry_policy.record_outcome(attempt, success=False)
+                raise
+            
+            wait_started = time.perf_counter()
+            max_wait = min(self.rate_limiter.max_wait, remaining) if remaining is not None else None
+            try:
+                reserved = await self.rate_limiter.acquire(plan["prompt_tokens"] + plan["max_tokens"], max_wait)
+            except BaseException:
+                self.circuit_breaker.record_neutral()
+                raise
+            meta["limiter_wait_ms"] += round((time.perf_counter() - wait_started) * 1000)
+            
+            try:
+                stream = await self.client.chat.completions.create(
+                    **self._request_params(plan),
+                    stream=True,
+                    # Расход токенов приходит в последнем фрагменте потока
+                    stream_options={"include_usage": True},
+                    timeout=timeout or self.timeout
+                )
+            except BaseException as e:
+                self.rate_limiter.release(reserved)
+                if not isinstance(e, Exception) or not is_transient(e):
+                    self.circuit_breaker.record_neutral()
+                    self.retry_policy.record_outcome(attempt, success=False)
+                    raise
+                self.circuit_breaker.record_failure()
+                retry_after = retry_after_seconds(e)
+                if retry_after:
+                    self.rate_limiter.pause(retry_after)
+                
+                delay = self.retry_policy.delay(attempt, e)
+                remaining = total_timeout - (time.perf_counter() - started) if total_timeout else None
+                if attempt >= self.retry_policy.max_attempts or (remaining is not None and delay >= remaining):
+                    self.retry_policy.record_outcome(attempt, success=False)
+                    raise
+                logger.warning(f"Вызов LLM не удался ({classify_error(e)}), попытка {attempt}, повтор через {delay:.1f} с")
+                self.retry_policy.record_retry(attempt)
+                await asyncio.sleep(delay)
+                continue
+            
+            self.circuit_breaker.record_success()
+            self.retry_policy.record_outcome(attempt, success=True)
+            return stream, reserved
+    
+    def resilience_stats(self) -> dict:
+        """Состояние ограничителя квоты, повторов и размыкателя цепи (для /api/metrics)"""
+        return {
+            "rate_limiter": self.rate_limiter.stats(),
+            "retries": self.retry_policy.stats(),
+            "circuit_breaker": self.circuit_breaker.stats(),
+        }
+    
+    def unavailable_for(self) -> float:
+        """Секунд, в течение которых вызовы LLM будут отклоняться без обращения к провайдеру"""
+        return self.circuit_breaker.retry_after()
+    
+    def retry_after_hint(self, error: BaseException) -> Optional[float]:
+        """
+        Через сколько секунд повторять запрос после ошибки генерации
+        
+        Returns:
+            Optional[float]: None - ошибка не временная (повтор не поможет)
+        """
+        if isinstance(error, LLMUnavailableError):
+            return error.retry_after
+        if isinstance(error, Exception) and is_transient(error):
+            return max(retry_after_seconds(error) or 0.0, self.unavailable_for(), self.retry_policy.base_delay)
+        return None
+    
+    def completion_params(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Параметры запроса chat completions для отчета (используются и в пакетной регенерации)
+        """
+        return self._request_params(self.plan_prompt(profile_data, screenshot_data, depth))
+    
+    def _request_params(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        params = {
+            "model": plan.get("model", self.model),
+            "messages": plan["messages"],
+            "temperature": plan.get("temperature", 0.7),
+            "max_tokens": plan["max_tokens"]
+        }
+        if plan.get("bilingual"):
+            params["response_format"] = BILINGUAL_RESPONSE_FORMAT
+        return params
+    
+    def parse_report_output(self, text: str) -> Dict[str, str]:
+        """
+        Текст ответа модели (например, из Batch API) в отчеты {"ru": ..., "en": ...}
+        """
+        if self.bilingual:
+            return parse_bilingual_output(text)
+        return {"ru": text.strip(), "en": ""}
+    
+    def resolve_depth(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str] = None) -> str:
+        """Глубина отчета с учетом полноты данных (по одной биографии - только короткий отчет)"""
+        return effective_depth(depth or self.default_depth, data_level(profile_data, screenshot_data))
+    
+    def plan_prompt(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Строит сообщения в пределах бюджета токенов и выбирает max_tokens
+        
+        Промпт сжимается по шагам, пока не уложится в PROMPT_TOKEN_BUDGET:
+        сначала сжатые инструкции разделов, затем обрезанная биография.
+        
+        Args:
+            profile_data: Данные профиля
+            screenshot_data: Данные из скриншота
+            depth: Запрошенная глубина отчета (None - REPORT_DEPTH)
+        
+        Returns:
+            dict: messages, max_tokens, prompt_tokens (оценка), depth, compact, bilingual
+        """
+        level = data_level(profile_data, screenshot_data)
+        depth = effective_depth(depth or self.default_depth, level)
+        
+        # Подробные инструкции - только в полном отчете
+        steps = [(False, None), (True, None), (True, BIO_COMPACT_CHARS)]
+        if depth != DEPTH_FULL:
+            steps = steps[1:]
+        
+        for compact, bio_max_chars in steps:
+            messages = self._build_messages(profile_data, screenshot_data, depth, compact, bio_max_chars, self.bilingual)
+            prompt_tokens = count_message_tokens(messages, self.model)
+            if prompt_tokens <= self.prompt_token_budget:
+                break
+        else:
+            logger.warning(
+                f"Промпт для @{profile_data.get('username')} превышает бюджет: "
+                f"{prompt_tokens} > {self.prompt_token_budget} токенов"
+            )
+        
+        max_tokens = completion_budget(depth, level, self.max_tokens_limit)
+        if self.bilingual:
+            max_tokens = int(max_tokens * BILINGUAL_TOKEN_FACTOR)
+        
+        return {
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "prompt_tokens": prompt_tokens,
+            "depth": depth,
+            "compact": compact,
+            "mode": MODE_BILINGUAL if self.bilingual else GENERATION_SINGLE,
+            "bilingual": self.bilingual,
+        }
+    
+    def plan_sections(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str] = None) -> list:
+        """
+        Планы запросов режима sectioned: по одному на раздел отчета
+        
+        Returns:
+            list: Планы (как plan_prompt) с ключом section, в порядке разделов
+        """
+        level = data_level(profile_data, screenshot_data)
+        depth = effective_depth(depth or self.default_depth, level)
+        sections = DEPTH_SECTIONS[depth]
+        compact = depth != DEPTH_FULL
+        
+        report_tokens = completion_budget(depth, level, self.max_tokens_limit)
+        section_tokens = max(int(report_tokens / len(sections) * SECTION_TOKEN_HEADROOM), SECTION_MIN_TOKENS)
+        section_tokens = min(section_tokens, self.max_tokens_limit)
+        
+        plans = []
+        for section in sections:
+            messages = [
+                {"role": "system", "content": SECTIONED_SYSTEM_PROMPT_RU},
+                {"role": "user", "content": self._build_section_prompt(profile_data, screenshot_data, depth, section, compact)}
+            ]
+            plans.append({
+                "messages": messages,
+                "max_tokens": section_tokens,
+                "prompt_tokens": count_message_tokens(messages, self.model),
+                "depth": depth,
+                "compact": compact,
+                "mode": GENERATION_SECTIONED,
+                "section": section,
+            })
+        return plans
+    
+    def _log_call(self, plan: Dict[str, Any], meta: Dict[str, Any]):
+        """Логирует вызов LLM: токены рядом с оценкой промпта и лимитом ответа, задержки и стоимость"""
+        cost = f", ${meta['cost_usd']:.5f}" if meta["cost_usd"] is not None else ""
+        outcome = "" if meta["status"] == STATUS_OK else f", ошибка {meta['error_class']}"
+        logger.info(
+            f"Вызов LLM @{meta['username']} ({plan['depth'] or plan['mode']}"
+            f"{', раздел ' + plan['section'] if plan.get('section') else ''}"
+            f"{', сжатый промпт' if plan['compact'] else ''}): "
+            f"промпт {meta['prompt_tokens']} (оценка {plan['prompt_tokens']}), "
+            f"ответ {meta['completion_tokens']} из {plan['max_tokens']}"
+            f"{' (оценка)' if meta['usage_estimated'] else ''}, "
+            f"первый токен {meta['ttft_ms'] if meta['ttft_ms'] is not None else '-'} мс, "
+            f"всего {meta['duration_ms']} мс{cost}{outcome}"
+        )
+    
+    def _build_messages(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: str = DEPTH_FULL, compact: bool = False, bio_max_chars: Optional[int] = None, bilingual: bool = False) -> list:
+        """Формирует сообщения для chat completions"""
+        return [
+            {
+                "role": "system",
+                "content": BILINGUAL_SYSTEM_PROMPT if bilingual else SYSTEM_PROMPT_RU
+            },
+            {
+                "role": "user",
+                "content": self._build_prompt(profile_data, screenshot_data, depth, compact, bio_max_chars)
+            }
+        ]
     
-    def _build_prompt(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any]) -> str:
+    def report_fingerprint(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str] = None) -> str:
+        """
+        Канонический хэш входных данных промпта вместе с моделью и версией шаблона
+        
+        Args:
+            profile_data: Данные профиля
+            screenshot_data: Данные из скриншота
+            depth: Запрошенная глубина отчета (None - REPORT_DEPTH)
+        
+        Returns:
+            str: sha256 в hex
+        """
+        inputs = {
+            **prompt_inputs(profile_data, screenshot_data),
+            "depth": self.resolve_depth(profile_data, screenshot_data, depth),
+            "model": self.model,
+            "prompt_version": PROMPT_VERSION,
+        }
+        if self.generation_mode != GENERATION_SINGLE:
+            inputs["generation_mode"] = self.generation_mode
+        if self.bilingual:
+            inputs["bilingual"] = True
+        canonical = json.dumps(inputs, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+    
+    def section_input_hashes(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str] = None) -> Dict[str, str]:
+        """
+        Хэши входных данных каждого раздела отчета (SECTION_INPUTS) вместе с глубиной,
+        моделью и версией шаблона: раздел с неизменным хэшем не нужно генерировать заново
+        
+        Returns:
+            dict: {раздел: sha256 в hex} для разделов выбранной глубины
+        """
+        inputs = prompt_inputs(profile_data, screenshot_data)
+        inputs["audience_scale"] = audience_scale(inputs["followers"])
+        depth = self.resolve_depth(profile_data, screenshot_data, depth)
+        
+        hashes = {}
+        for section in DEPTH_SECTIONS[depth]:
+            section_inputs = {name: inputs[name] for name in SECTION_INPUTS[section]}
+            section_inputs.update({
+                "section": section,
+                "depth": depth,
+                "model": self.model,
+                "prompt_version": PROMPT_VERSION,
+            })
+            canonical = json.dumps(section_inputs, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+            hashes[section] = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+        return hashes
+    
+    def report_sections(self, report_ru: str, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str] = None) -> Optional[Dict[str, Dict[str, str]]]:
+        """
+        Разделы готового отчета с хэшами их входных данных (для сохранения в report_sections)
+        
+        Returns:
+            dict: {раздел: {"content": ..., "input_hash": ...}} или None, если отчет не делится на разделы
+        """
+        hashes = self.section_input_hashes(profile_data, screenshot_data, depth)
+        texts = split_report_sections(report_ru, tuple(hashes))
+        if texts is None:
+            logger.info(f"Отчет @{profile_data.get('username')} не разбит на разделы: не найдены заголовки")
+            return None
+        return {section: {"content": texts[section], "input_hash": input_hash} for section, input_hash in hashes.items()}
+    
+    def reusable_sections(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: Optional[str], previous_sections: Optional[Dict[str, Dict[str, str]]]) -> Dict[str, str]:
+        """
+        Разделы прошлого отчета, входные данные которых не изменились
+        
+        Args:
+            previous_sections: Сохраненные разделы {раздел: {"content": ..., "input_hash": ...}}
+        
+        Returns:
+            dict: {раздел: текст} для переиспользования без вызова LLM
+        """
+        if not previous_sections or self.bilingual:
+            # Английский текст двуязычного ответа нельзя собрать из старых русских разделов
+            return {}
+        return {
+            section: previous_sections[section]["content"]
+            for section, input_hash in self.section_input_hashes(profile_data, screenshot_data, depth).items()
+            if section in previous_sections
+            and previous_sections[section].get("input_hash") == input_hash
+            and previous_sections[section].get("content")
+        }
+    
+    def _build_prompt(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: str = DEPTH_FULL, compact: bool = False, bio_max_chars: Optional[int] = None) -> str:
         """
         Строит промпт для GPT на основе данных профиля
         
         Args:
             profile_data: Данные профиля
             screenshot_data: Данные из скриншота (могут быть пустыми)
-            
+            depth: Глубина отчета - определяет набор разделов
+            compact: Сжатые инструкции разделов вместо подробных
+            bio_max_chars: Обрезать биографию до этой длины (None - без обрезки)
+        
         Returns:
             str: Промпт для GPT
         """
+        username, data_section, metrics_section = self._prompt_parts(profile_data, screenshot_data, compact, bio_max_chars)
+        
+        prompt = f"""Проанализируй Instagram аккаунт @{username} на основе предоставленных данных.
+
+{data_section}
+
+Сгенерируй структурированный отчет на русском языке в следующем формате:"""
+        
+        for number, section in enumerate(DEPTH_SECTIONS[depth], start=1):
+            if section == "metrics":
+                instructions = metrics_section
+            else:
+                detailed, short = SECTION_INSTRUCTIONS[section]
+                instructions = short if compact else detailed
+            prompt += f"\n\n{number}. {SECTION_TITLES[section]}\n\n{instructions}"
+        
+        prompt += "\n\n" + (CLOSING_INSTRUCTIONS_COMPACT if compact else CLOSING_INSTRUCTIONS)
+        if depth == DEPTH_SHORT:
+            prompt += " Будь кратким: 2-4 пункта в каждом разделе."
+        
+        return prompt
+    
+    def _build_section_prompt(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], depth: str, section: str, compact: bool = False) -> str:
+        """
+        Строит промпт одного раздела для режима sectioned
+        
+        Начало промпта (данные профиля) одинаково для всех разделов отчета,
+        инструкции разделов лежат в общем системном сообщении
+        
+        Args:
+            profile_data: Данные профиля
+            screenshot_data: Данные из скриншота (могут быть пустыми)
+            depth: Глубина отчета
+            section: Ключ раздела из SECTION_TITLES
+            compact: Сжатое примечание о недоступных данных в разделе метрик
+        
+        Returns:
+            str: Промпт раздела
+        """
+        username, data_section, metrics_section = self._prompt_parts(profile_data, screenshot_data, compact)
+        
+        prompt = f"""Проанализируй Instagram аккаунт @{username} на основе предоставленных данных.
+
+{data_section}
+
+Напиши раздел {SECTION_TITLES[section]}."""
+        
+        if section == "metrics":
+            prompt += f"\n\n{metrics_section}"
+        if depth == DEPTH_SHORT:
+            prompt += " Будь кратким: 2-4 пункта."
+        
+        return prompt
+    
+    def _prompt_parts(self, profile_data: Dict[str, Any], screenshot_data: Dict[str, Any], compact: bool = False, bio_max_chars: Optional[int] = None) -> tuple:
+        """
+        Части промпта, зависящие от данных профиля
+        
+        Returns:
+            tuple: (username, секция данных профиля, инструкции раздела метрик)
+        """
         followers = profile_data.get('followers', 0)
         following = profile_data.get('following', 0)
         posts_count = profile_data.get('posts_count', 0)
@@ -97,6 +1136,9 @@ class GPTAnalyzer:
         # Проверяем, есть ли данные из скриншота
         has_screenshot_data = any([views > 0, interactions > 0, new_followers > 0, messages > 0, shares > 0])
         
+        if bio and bio_max_chars and len(bio) > bio_max_chars:
+            bio = bio[:bio_max_chars].rstrip() + "…"
+        
         # Форматируем данные профиля
         username = profile_data.get('username', 'unknown')
         followers_text = f"{followers:,}" if followers > 0 else "не указано"
@@ -123,15 +1165,7 @@ class GPTAnalyzer:
         else:
             data_section += "\n\nПримечание: Статистика за последние 30 дней недоступна (скриншот профессиональной панели не загружен). Анализ выполнен на основе публичных данных профиля."
         
-        prompt = f"""Проанализируй Instagram аккаунт @{username} на основе предоставленных данных.
-
-{data_section}
-
-Сгенерируй структурированный отчет на русском языке в следующем формате:
-
-1. OVERALL ACCOUNT METRICS & PERFORMANCE
-
-Начни с заголовка "Followers:" и укажи {followers_text}
+        metrics_section = f"""Начни с заголовка "Followers:" и укажи {followers_text}
 
 Затем опиши:
 - Posts: {posts_text}
@@ -139,7 +1173,7 @@ class GPTAnalyzer:
 - Engagement Rate: {er_text}"""
         
         if has_screenshot_data:
-            prompt += f"""
+            metrics_section += f"""
 - Views (last 30 days): {views:,} - дай оценку вирусности
 - Interactions (last 30 days): {interactions:,} - проанализируй уровень вовлеченности
 - New followers (last 30 days): {new_followers:,} - оцени рост
@@ -149,8 +1183,10 @@ class GPTAnalyzer:
 ER ≈ {interactions:,} / {followers:,} × 100 = {(interactions / followers * 100) if followers > 0 else 0:.2f}%
 
 Дай вывод о фазе роста аккаунта."""
+        elif compact:
+            metrics_section += "\n\nЕсли подписчики или публикации не указаны, анализируй по биографии и username, отметь нехватку данных и оцени потенциал."
         else:
-            prompt += f"""
+            metrics_section += f"""
 
 Примечание: Данные о просмотрах, взаимодействиях и росте за последние 30 дней недоступны. 
 
@@ -166,58 +1202,4 @@ ER ≈ {interactions:,} / {followers:,} × 100 = {(interactions / followers * 10
 
 Дай общую оценку аккаунта на основе доступной информации и предположи его потенциал. Если данных недостаточно, укажи это в отчете, но все равно проведи анализ на основе того, что доступно."""
         
-        prompt += """
-
-2. AUDIENCE & CONTENT ANALYSIS
-
-Определи на основе биографии и количества подписчиков:
-- Нишу (Niche) - определи тематику аккаунта по биографии
-- Стиль контента (Content Style) - предположи стиль на основе ниши
-- Демографию аудитории (Audience Demographics) - оцени целевую аудиторию
-- Уровень доверия аудитории (Audience Trust Level) - оцени на основе метрик
-- Эмоциональный тон контента (Emotional Tone) - предположи на основе ниши
-
-3. POTENTIAL PARTNERS & ADVERTISERS
-
-Разбей по категориям на основе ниши аккаунта:
-1. Психологические и коучинг сервисы
-2. Лайфстайл и личностное развитие бренды
-3. Отношения и сегмент знакомств
-4. Продукты для саморазвития
-5. Контент-креаторы и кросс-промо
-
-4. COMPLIMENTS — STRONG POINTS OF THE ACCOUNT
-
-Выдели 5 сильных сторон аккаунта с эмодзи 🌟 на основе:
-- Количества подписчиков
-- Количества публикаций
-- Биографии
-- Engagement Rate
-- Общего впечатления
-
-5. SPECIFIC RECOMMENDATIONS FOR IMPROVEMENT
-
-Дай 5-6 конкретных рекомендаций по улучшению:
-1. Добавить больше структурированных Highlights
-2. Ввести формат "серийного контента"
-3. Усилить CTAs в Reels
-4. Конвертировать вирусный трафик в глубокую аудиторию
-5. Начать длинный контент (опционально)
-6. Дополнительные рекомендации на основе ниши
-
-6. ADDITIONAL INSIGHTS
-
-Включи:
-- 🔥 Лучшие возможности для контента (на основе ниши)
-- 📈 Ускорители роста (конкретные действия)
-- 💰 Возможности монетизации (способы заработка)
-
-ВАЖНО: 
-- Отвечай ТОЛЬКО на русском языке
-- Используй профессиональный тон, но понятный язык
-- Сохраняй структуру с заголовками и подзаголовками
-- Если данных из скриншота нет, делай анализ на основе доступных публичных данных
-- Будь конкретным и давай практические рекомендации"""
-        
-        return prompt
-
+        return username, data_section, metrics_section
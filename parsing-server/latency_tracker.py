@@ -0,0 +1,134 @@
+"""
+Скользящие гистограммы задержек и адаптивные таймауты для браузерных операций
+"""
+import os
+import math
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+OP_GOTO = "goto"
+OP_EXTRACTION = "extraction"
+OP_SCREENSHOT = "screenshot"
+
+# Таймауты по умолчанию (мс) - используются, пока не накоплено достаточно замеров,
+# и служат верхней границей для адаптивных значений
+DEFAULT_TIMEOUTS_MS = {
+    OP_GOTO: 30000,
+    OP_EXTRACTION: 10000,
+    OP_SCREENSHOT: 10000,
+}
+
+
+def percentile(ordered: Sequence[float], pct: float) -> float:
+    """Перцентиль по отсортированным значениям (nearest-rank); 0 для пустого списка"""
+    if not ordered:
+        return 0.0
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def latency_summary(values: Iterable[float], pcts: Sequence[int] = (50, 95, 99), ndigits: Optional[int] = None) -> dict:
+    """
+    Сводка задержек для метрик: count, p<N>_ms для каждого перцентиля из pcts и max_ms
+
+    Args:
+        ndigits: Округление значений (None - до целого)
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        **{f"p{pct}_ms": round(percentile(ordered, pct), ndigits) for pct in pcts},
+        "max_ms": round(ordered[-1], ndigits),
+    }
+
+
+class LatencyTracker:
+    """
+    Хранит последние замеры длительности по операциям и выводит таймаут как p99 плюс запас
+    """
+
+    def __init__(self):
+        self.window = int(os.getenv("CAPTURE_LATENCY_WINDOW", 200))
+        self.min_samples = int(os.getenv("CAPTURE_LATENCY_MIN_SAMPLES", 20))
+        self.margin = float(os.getenv("CAPTURE_TIMEOUT_MARGIN", 0.5))  # доля от p99
+        self.floor_ms = float(os.getenv("CAPTURE_TIMEOUT_FLOOR_MS", 3000))
+        # После стольких таймаутов подряд замеры сбрасываются и действует таймаут по умолчанию
+        self.reset_after = int(os.getenv("CAPTURE_TIMEOUT_RESET_AFTER", 3))
+
+        self._samples: Dict[str, deque] = {op: deque(maxlen=self.window) for op in DEFAULT_TIMEOUTS_MS}
+        self._timeouts: Dict[str, int] = {op: 0 for op in DEFAULT_TIMEOUTS_MS}
+        self._consecutive_timeouts: Dict[str, int] = {op: 0 for op in DEFAULT_TIMEOUTS_MS}
+        self._resets: Dict[str, int] = {op: 0 for op in DEFAULT_TIMEOUTS_MS}
+
+    def record(self, op: str, duration_ms: float):
+        self._samples.setdefault(op, deque(maxlen=self.window)).append(duration_ms)
+
+    def record_timeout(self, op: str, elapsed_ms: float):
+        """
+        Учитывает таймаут операции
+
+        Прошедшее время записывается как замер (настоящая длительность не меньше него), чтобы p99
+        рос при заниженном таймауте. Если таймауты идут подряд, замеры сбрасываются: иначе при
+        резко выросшей задержке все вызовы падали бы по таймауту, пока p99 медленно догоняет ее
+        """
+        self._timeouts[op] = self._timeouts.get(op, 0) + 1
+        self._consecutive_timeouts[op] = self._consecutive_timeouts.get(op, 0) + 1
+        if self.reset_after > 0 and self._consecutive_timeouts[op] >= self.reset_after:
+            self._samples.setdefault(op, deque(maxlen=self.window)).clear()
+            self._consecutive_timeouts[op] = 0
+            self._resets[op] = self._resets.get(op, 0) + 1
+            logger.warning(f"Операция {op}: {self.reset_after} таймаута подряд, возврат к таймауту по умолчанию")
+            return
+        self.record(op, elapsed_ms)
+
+    def percentile(self, op: str, pct: float) -> float:
+        return percentile(sorted(self._samples.get(op, ())), pct)
+
+    def timeout_ms(self, op: str) -> int:
+        """
+        Текущий таймаут операции
+
+        Returns:
+            int: p99 * (1 + CAPTURE_TIMEOUT_MARGIN), ограниченный снизу CAPTURE_TIMEOUT_FLOOR_MS
+            и сверху значением по умолчанию
+        """
+        default = DEFAULT_TIMEOUTS_MS.get(op, 30000)
+        if len(self._samples.get(op, ())) < self.min_samples:
+            return default
+        adaptive = self.percentile(op, 99) * (1 + self.margin)
+        return int(min(max(adaptive, self.floor_ms), default))
+
+    @contextmanager
+    def measure(self, op: str):
+        """Замеряет длительность операции; таймаут учитывается через record_timeout"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            if "timeout" in type(e).__name__.lower():
+                logger.warning(f"Операция {op} превысила адаптивный таймаут {self.timeout_ms(op)} мс")
+                self.record_timeout(op, (time.perf_counter() - started) * 1000)
+            raise
+        self._consecutive_timeouts[op] = 0
+        self.record(op, (time.perf_counter() - started) * 1000)
+
+    def stats(self) -> dict:
+        return {
+            op: {
+                "samples": len(self._samples[op]),
+                "p50_ms": round(self.percentile(op, 50)),
+                "p90_ms": round(self.percentile(op, 90)),
+                "p99_ms": round(self.percentile(op, 99)),
+                "timeout_ms": self.timeout_ms(op),
+                "default_timeout_ms": DEFAULT_TIMEOUTS_MS.get(op),
+                "timeouts": self._timeouts.get(op, 0),
+                "timeout_resets": self._resets.get(op, 0),
+            }
+            for op in self._samples
+        }
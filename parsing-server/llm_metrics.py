@@ -0,0 +1,223 @@
+"""
+Учет вызовов LLM: токены, время до первого токена, длительность, стоимость и причины ошибок
+"""
+import asyncio
+import os
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import openai
+from llm_resilience import CircuitOpenError, QuotaExceededError
+from latency_tracker import latency_summary
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+# Классы ошибок вызова LLM
+ERROR_TIMEOUT = "timeout"
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_CONNECTION = "connection"
+ERROR_AUTH = "auth"
+ERROR_BAD_REQUEST = "bad_request"
+ERROR_SERVER = "server_error"
+ERROR_CANCELLED = "cancelled"
+ERROR_EMPTY_RESPONSE = "empty_response"
+ERROR_CIRCUIT_OPEN = "circuit_open"
+ERROR_QUOTA_WAIT = "quota_wait"
+
+# Цены за 1M токенов в USD: (промпт, ответ). Модель ищется по самому длинному префиксу,
+# поэтому датированные версии (gpt-4o-mini-2024-07-18) получают цену базовой модели
+MODEL_PRICING_PER_1M = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+
+def model_pricing(model: str) -> Optional[tuple]:
+    """Цена модели за 1M токенов; OPENAI_PRICE_INPUT_PER_1M / OPENAI_PRICE_OUTPUT_PER_1M имеют приоритет"""
+    input_price = os.getenv("OPENAI_PRICE_INPUT_PER_1M")
+    output_price = os.getenv("OPENAI_PRICE_OUTPUT_PER_1M")
+    if input_price and output_price:
+        return float(input_price), float(output_price)
+    matches = [prefix for prefix in MODEL_PRICING_PER_1M if model.startswith(prefix)]
+    if not matches:
+        return None
+    return MODEL_PRICING_PER_1M[max(matches, key=len)]
+
+
+def estimate_cost(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Optional[float]:
+    """Оценка стоимости вызова в USD (None - цена модели неизвестна)"""
+    pricing = model_pricing(model)
+    if pricing is None:
+        return None
+    input_price, output_price = pricing
+    return round(((prompt_tokens or 0) * input_price + (completion_tokens or 0) * output_price) / 1_000_000, 6)
+
+
+def classify_error(error: BaseException) -> str:
+    """Сводит исключение вызова LLM к короткому классу для метрик"""
+    if isinstance(error, CircuitOpenError):
+        return ERROR_CIRCUIT_OPEN
+    if isinstance(error, QuotaExceededError):
+        return ERROR_QUOTA_WAIT
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return ERROR_TIMEOUT
+    if isinstance(error, openai.RateLimitError):
+        return ERROR_RATE_LIMIT
+    if isinstance(error, openai.APIConnectionError):
+        return ERROR_CONNECTION
+    if isinstance(error, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return ERROR_AUTH
+    if isinstance(error, (openai.BadRequestError, openai.NotFoundError, openai.UnprocessableEntityError)):
+        return ERROR_BAD_REQUEST
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return ERROR_SERVER
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return ERROR_CANCELLED
+    return type(error).__name__
+
+
+class LLMMetrics:
+    """
+    Агрегирует вызовы LLM в памяти (для /api/metrics) и сохраняет каждый вызов
+    в таблицу llm_calls (для планирования мощностей)
+    """
+
+    def __init__(self, persist: Optional[bool] = None):
+        if persist is None:
+            persist = os.getenv("LLM_CALL_LOG_ENABLED", "true").lower() == "true"
+        self.persist = persist
+        window = int(os.getenv("LLM_METRICS_WINDOW", 500))
+        self._durations = deque(maxlen=window)
+        self._ttft = deque(maxlen=window)
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._errors: Dict[str, int] = {}
+
+    async def record(self, call: Dict[str, Any]):
+        """
+        Учитывает завершенный вызов и сохраняет его в базу
+
+        Args:
+            call: Данные вызова от GPTAnalyzer; после сохранения получает call_id
+        """
+        model_stats = self._models.setdefault(call["model"], {
+            "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+        })
+        model_stats["calls"] += 1
+        model_stats["prompt_tokens"] += call.get("prompt_tokens") or 0
+        model_stats["completion_tokens"] += call.get("completion_tokens") or 0
+        model_stats["cost_usd"] += call.get("cost_usd") or 0.0
+        if call["status"] == STATUS_OK:
+            self._durations.append(call["duration_ms"])
+            if call.get("ttft_ms") is not None:
+                self._ttft.append(call["ttft_ms"])
+        else:
+            model_stats["errors"] += 1
+            self._errors[call["error_class"]] = self._errors.get(call["error_class"], 0) + 1
+
+        if not self.persist:
+            return
+        try:
+            call["call_id"] = await self._save(call)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить вызов LLM в базу: {e}")
+
+    async def _save(self, call: Dict[str, Any]) -> int:
+        from database import SessionLocal, LLMCall
+
+        async with SessionLocal() as db:
+            entry = LLMCall(
+                username=call.get("username"),
+                model=call["model"],
+                prompt_version=call.get("prompt_version"),
+                depth=call.get("depth"),
+                section=call.get("section"),
+                mode=call.get("mode"),
+                streaming=call.get("streaming", False),
+                status=call["status"],
+                error_class=call.get("error_class"),
+                error_message=call.get("error_message"),
+                prompt_tokens=call.get("prompt_tokens"),
+                completion_tokens=call.get("completion_tokens"),
+                usage_estimated=call.get("usage_estimated", False),
+                ttft_ms=call.get("ttft_ms"),
+                duration_ms=call.get("duration_ms"),
+                cost_usd=call.get("cost_usd"),
+                created_at=datetime.utcnow(),
+            )
+            db.add(entry)
+            await db.commit()
+            return entry.id
+
+    def stats(self) -> dict:
+        calls = sum(m["calls"] for m in self._models.values())
+        errors = sum(m["errors"] for m in self._models.values())
+        return {
+            "calls": calls,
+            "errors": errors,
+            "error_rate": round(errors / calls, 3) if calls else 0.0,
+            "errors_by_class": dict(self._errors),
+            "duration": latency_summary(self._durations),
+            "time_to_first_token": latency_summary(self._ttft),
+            "models": {
+                model: {**m, "cost_usd": round(m["cost_usd"], 4)}
+                for model, m in self._models.items()
+            },
+            "cost_usd": round(sum(m["cost_usd"] for m in self._models.values()), 4),
+        }
+
+    @staticmethod
+    async def summary(db: AsyncSession, hours: float) -> dict:
+        """
+        Сводка вызовов LLM из базы за последние hours часов (по моделям и классам ошибок)
+        """
+        from database import LLMCall
+
+        since = datetime.utcnow() - timedelta(hours=hours)
+        models = (await db.execute(
+            select(
+                LLMCall.model,
+                func.count(LLMCall.id),
+                func.sum(LLMCall.prompt_tokens),
+                func.sum(LLMCall.completion_tokens),
+                func.sum(LLMCall.cost_usd),
+                func.avg(LLMCall.duration_ms),
+                func.avg(LLMCall.ttft_ms),
+            ).where(LLMCall.created_at >= since).group_by(LLMCall.model)
+        )).all()
+        errors = (await db.execute(
+            select(
+                LLMCall.error_class,
+                func.count(LLMCall.id),
+            ).where(
+                LLMCall.created_at >= since,
+                LLMCall.status == STATUS_ERROR
+            ).group_by(LLMCall.error_class)
+        )).all()
+
+        return {
+            "hours": hours,
+            "models": {
+                model: {
+                    "calls": count,
+                    "prompt_tokens": int(prompt_tokens or 0),
+                    "completion_tokens": int(completion_tokens or 0),
+                    "cost_usd": round(cost or 0.0, 4),
+                    "avg_duration_ms": round(avg_duration) if avg_duration is not None else None,
+                    "avg_ttft_ms": round(avg_ttft) if avg_ttft is not None else None,
+                }
+                for model, count, prompt_tokens, completion_tokens, cost, avg_duration, avg_ttft in models
+            },
+            "errors_by_class": {error_class: count for error_class, count in errors},
+        }
@@ -0,0 +1,326 @@
+"""
+Защита вызовов LLM: ограничение по квоте RPM/TPM, повторы с экспоненциальной задержкой
+и размыкатель цепи (circuit breaker) на время сбоев провайдера
+"""
+import asyncio
+import os
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import openai
+
+logger = logging.getLogger(__name__)
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+class LLMUnavailableError(Exception):
+    """Вызов LLM отклонен локально, не дойдя до провайдера"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Провайдер недавно отвечал ошибками, вызовы временно не выполняются"""
+
+
+class QuotaExceededError(LLMUnavailableError):
+    """Ожидание свободной квоты RPM/TPM дольше допустимого"""
+
+
+def is_transient(error: BaseException) -> bool:
+    """Временная ошибка провайдера, после которой имеет смысл повторить запрос"""
+    if isinstance(error, openai.RateLimitError):
+        # insufficient_quota - закончился баланс, повтор не поможет
+        return getattr(error, "code", None) != "insufficient_quota"
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in (408, 409)
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Значение Retry-After из ответа провайдера (retry-after-ms, секунды или HTTP дата)"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Ведро токенов: capacity - запас на всплеск, rate - пополнение в секунду.
+    Баланс может уйти в минус: вызов резервирует квоту сразу и ждет, пока долг
+    не будет покрыт пополнением, поэтому ожидающие обслуживаются по очереди
+    """
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._balance = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Сколько секунд придется ждать, если зарезервировать amount сейчас"""
+        self._refill()
+        return max(amount - self._balance, 0.0) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self._balance -= amount
+
+    def give_back(self, amount: float):
+        self._refill()
+        self._balance = min(self.capacity, self._balance + amount)
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._balance
+
+
+class LLMRateLimiter:
+    """
+    Ограничение вызовов по квоте провайдера: запросы в минуту (LLM_RPM_LIMIT)
+    и токены в минуту (LLM_TPM_LIMIT, промпт + max_tokens ответа). 0 - без ограничения.
+    После 429 с Retry-After все новые вызовы ждут указанное время
+    """
+
+    def __init__(self):
+        rpm = float(os.getenv("LLM_RPM_LIMIT", 0))
+        tpm = float(os.getenv("LLM_TPM_LIMIT", 0))
+        self.requests = TokenBucket(rpm, rpm / 60) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, tpm / 60) if tpm > 0 else None
+        # Дольше ждать квоту нет смысла: запрос лучше отклонить сразу
+        self.max_wait = float(os.getenv("LLM_LIMITER_MAX_WAIT_SECONDS", 30))
+        self._paused_until = 0.0
+        self._acquired = 0
+        self._rejected = 0
+        self._waited = 0
+        self._wait_seconds = 0.0
+
+    def pause(self, seconds: float):
+        """Приостанавливает новые вызовы (провайдер вернул 429 с Retry-After)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: int, max_wait: Optional[float] = None) -> int:
+        """
+        Резервирует квоту на один запрос, при необходимости дожидаясь ее
+
+        Args:
+            tokens: Оценка токенов запроса (промпт + лимит ответа)
+            max_wait: Предельное ожидание в секундах (по умолчанию LLM_LIMITER_MAX_WAIT_SECONDS)
+
+        Returns:
+            int: Зарезервированные токены TPM (передаются в settle после ответа)
+
+        Raises:
+            QuotaExceededError: Квота освободится позже max_wait
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        if self.tokens:
+            # Запрос больше всей минутной квоты все равно должен когда-то пройти
+            tokens = min(tokens, int(self.tokens.capacity))
+        else:
+            tokens = 0
+
+        wait = max(self._paused_until - time.monotonic(), 0.0)
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        if wait > max_wait:
+            self._rejected += 1
+            raise QuotaExceededError(f"Квота LLM освободится через {wait:.1f} с", retry_after=wait)
+
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        if wait > 0:
+            self._waited += 1
+            self._wait_seconds += wait
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._release(tokens, request=True)
+                raise
+        self._acquired += 1
+        return tokens
+
+    def settle(self, reserved: int, used: Optional[int]):
+        """Возвращает неизрасходованную часть резерва TPM (ответ обычно короче max_tokens)"""
+        if self.tokens and used is not None and used < reserved:
+            self.tokens.give_back(reserved - used)
+
+    def release(self, reserved: int):
+        """Возвращает резерв TPM запроса, который не дошел до провайдера"""
+        self._release(reserved, request=False)
+
+    def _release(self, reserved: int, request: bool):
+        if self.tokens:
+            self.tokens.give_back(reserved)
+        if request and self.requests:
+            self.requests.give_back(1)
+
+    def stats(self) -> dict:
+        return {
+            "rpm_limit": self.requests.capacity if self.requests else None,
+            "tpm_limit": self.tokens.capacity if self.tokens else None,
+            "requests_available": round(self.requests.available, 1) if self.requests else None,
+            "tokens_available": round(self.tokens.available) if self.tokens else None,
+            "paused_seconds": round(max(self._paused_until - time.monotonic(), 0.0), 1),
+            "acquired": self._acquired,
+            "waited": self._waited,
+            "wait_seconds_total": round(self._wait_seconds, 1),
+            "rejected": self._rejected,
+        }
+
+
+class CircuitBreaker:
+    """
+    Размыкатель цепи: после LLM_BREAKER_FAILURE_THRESHOLD временных ошибок подряд
+    вызовы отклоняются сразу на LLM_BREAKER_COOLDOWN_SECONDS, затем пропускается
+    один пробный вызов. Успех замыкает цепь, ошибка снова размыкает ее
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_BREAKER_ENABLED", "true").lower() == "true"
+        self.failure_threshold = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", 5))
+        self.cooldown = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", 30))
+        self.state = BREAKER_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._opened_total = 0
+        self._rejected_total = 0
+
+    def retry_after(self) -> float:
+        """Секунд до пробного вызова (0 - вызовы разрешены)"""
+        if self.state != BREAKER_OPEN:
+            return 0.0
+        return max(self._opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    def before_call(self):
+        """
+        Raises:
+            CircuitOpenError: Цепь разомкнута или пробный вызов уже выполняется
+        """
+        if not self.enabled:
+            return
+        if self.state == BREAKER_OPEN and self.retry_after() == 0:
+            self.state = BREAKER_HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == BREAKER_HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        if self.state != BREAKER_CLOSED:
+            self._rejected_total += 1
+            retry_after = self.retry_after() or self.cooldown
+            raise CircuitOpenError(f"LLM провайдер недоступен, повторите через {retry_after:.0f} с", retry_after=retry_after)
+
+    def record_success(self):
+        if self.state != BREAKER_CLOSED:
+            logger.info("Провайдер LLM снова отвечает, цепь замкнута")
+        self.state = BREAKER_CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        """Учитывает временную ошибку провайдера (429, 5xx, сеть, таймаут)"""
+        if not self.enabled:
+            return
+        self._failures += 1
+        if self.state == BREAKER_HALF_OPEN or (self.state == BREAKER_CLOSED and self._failures >= self.failure_threshold):
+            self.state = BREAKER_OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+            self._opened_total += 1
+            logger.warning(f"Цепь LLM разомкнута после {self._failures} ошибок подряд на {self.cooldown:g} с")
+
+    def record_neutral(self):
+        """Вызов завершился ошибкой, не связанной со здоровьем провайдера (например, отменен)"""
+        if self.state == BREAKER_HALF_OPEN:
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "retry_after_seconds": round(self.retry_after(), 1),
+            "opened_total": self._opened_total,
+            "rejected_total": self._rejected_total,
+        }
+
+
+class RetryPolicy:
+    """
+    Повторы временных ошибок с экспоненциальной задержкой и полным джиттером
+    (случайная задержка от 0 до base * 2^n), не короче Retry-After провайдера
+    """
+
+    def __init__(self):
+        self.max_attempts = max(int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", 4)), 1)
+        self.base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", 0.5))
+        self.max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", 20))
+        self._retries = 0
+        self._retried_calls = 0
+        self._recovered = 0
+        self._exhausted = 0
+
+    def delay(self, attempt: int, error: BaseException) -> float:
+        """
+        Args:
+            attempt: Номер неудачной попытки, начиная с 1
+            error: Ошибка этой попытки
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+    def record_retry(self, attempt: int):
+        self._retries += 1
+        if attempt == 1:
+            self._retried_calls += 1
+
+    def record_outcome(self, attempts: int, success: bool):
+        if attempts > 1 and success:
+            self._recovered += 1
+        elif attempts > 1:
+            self._exhausted += 1
+
+    def stats(self) -> dict:
+        return {
+            "max_attempts": self.max_attempts,
+            "retries_total": self._retries,
+            "retried_calls": self._retried_calls,
+            "recovered_calls": self._recovered,
+            "exhausted_calls": self._exhausted,
+        }
@@ -0,0 +1,281 @@
+"""
+Нагрузочный тест эндпоинтов генерации отчетов с заданным RPS
+
+Обычно запускается против parsing server, направленного на mock_llm_server.py:
+    python mock_llm_server.py --port 8090 --ttft lognormal:800,0.6 --rate-limit-rate 0.02
+    OPENAI_API_KEY=test OPENAI_BASE_URL=http://localhost:8090/v1 python app.py
+    python load_test.py --seed-profiles 200 --endpoint regenerate --rps 20 --duration 60
+
+Запросы отправляются по расписанию (открытая модель нагрузки): медленные ответы
+не снижают RPS, а копятся в in-flight - так видно, где сервер перестает успевать.
+Для эндпоинта stream дополнительно измеряется время до первого токена.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import statistics
+import time
+from collections import Counter
+from typing import Optional
+import httpx
+from event_loop_monitor import EventLoopLagMonitor
+from latency_tracker import latency_summary
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = {
+    "regenerate": "/api/data/{username}/regenerate-report",
+    "link": "/api/analyze-link-only/{username}",
+    "stream": "/api/analyze-link-only/{username}/stream",
+    "screenshot": "/api/screenshot/{username}",
+}
+
+SEED_PREFIX = "loadtest_"
+
+
+def percentiles(values: list) -> dict:
+    summary = latency_summary(values, (50, 90, 99))
+    if values:
+        summary["mean_ms"] = round(statistics.fmean(values))
+    return summary
+
+
+async def seed_profiles(count: int) -> list:
+    """Создает в базе синтетические профили loadtest_N со случайными метриками"""
+    from sqlalchemy import select
+    from database import SessionLocal, InstagramProfile
+    from migrations import upgrade
+
+    await upgrade()
+    usernames = [f"{SEED_PREFIX}{i}" for i in range(count)]
+    async with SessionLocal() as db:
+        existing = set(await db.scalars(
+            select(InstagramProfile.username).where(InstagramProfile.username.in_(usernames))
+        ))
+        for username in usernames:
+            if username in existing:
+                continue
+            followers = random.randint(500, 2_000_000)
+            db.add(InstagramProfile(
+                username=username,
+                followers=followers,
+                following=random.randint(50, 3000),
+                posts_count=random.randint(10, 2000),
+                bio=random.choice((
+                    "Психолог, коуч по отношениям. Консультации онлайн",
+                    "Фитнес тренер | Питание | Марафоны",
+                    "Путешествия и лайфстайл ✈️",
+                    "Мама двоих детей, рецепты и уют",
+                )),
+                engagement_rate=random.uniform(0.005, 0.08),
+                views=random.choice((0, random.randint(10_000, 5_000_000))),
+                interactions=random.randint(0, followers // 10),
+            ))
+        await db.commit()
+    logger.info(f"Подготовлено {len(usernames)} профилей ({len(usernames) - len(existing)} новых)")
+    return usernames
+
+
+async def cleanup_profiles():
+    """
+    Удаляет синтетические профили и все, что удаляет для них DELETE /api/data/{username}:
+    кэш отчетов, разделы отчетов, историю метрик; а также их вызовы LLM, чтобы нагрузочный
+    тест не искажал сводку стоимости
+    """
+    from sqlalchemy import delete, select
+    from database import SessionLocal, InstagramProfile, LLMCall
+    from report_cache import ReportCache
+    from report_sections import ReportSectionStore
+    from profile_history import ProfileHistory
+
+    report_cache = ReportCache()
+    report_sections = ReportSectionStore()
+    profile_history = ProfileHistory(SessionLocal)
+    # "_" в префиксе - тоже шаблон LIKE, поэтому экранируем
+    seeded = InstagramProfile.username.startswith(SEED_PREFIX, autoescape=True)
+
+    async with SessionLocal() as db:
+        usernames = (await db.scalars(select(InstagramProfile.username).where(seeded))).all()
+        result = await db.execute(delete(InstagramProfile).where(seeded))
+        await db.execute(delete(LLMCall).where(LLMCall.username.startswith(SEED_PREFIX, autoescape=True)))
+        await db.commit()
+        for username in usernames:
+            await report_cache.invalidate(db, username)
+            await report_sections.invalidate(db, username)
+            await profile_history.delete(db, username)
+        logger.info(f"Удалено {result.rowcount} синтетических профилей")
+
+
+class LoadTest:
+    """Отправляет запросы по расписанию и собирает задержки"""
+
+    def __init__(self, args, usernames: list):
+        self.args = args
+        self.usernames = usernames
+        self.latencies = []
+        self.ttft = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def params(self) -> dict:
+        params = {}
+        if self.args.force_refresh:
+            params["force_refresh"] = "true"
+        if self.args.depth:
+            params["depth"] = self.args.depth
+        return params
+
+    async def request(self, client: httpx.AsyncClient, username: str):
+        url = ENDPOINTS[self.args.endpoint].format(username=username)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            if self.args.endpoint == "stream":
+                status = await self._stream(client, url, started)
+            else:
+                response = await client.post(url, params=self.params())
+                status = response.status_code
+            self.statuses[status] += 1
+            if status == 200:
+                self.latencies.append((time.perf_counter() - started) * 1000)
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, client: httpx.AsyncClient, url: str, started: float) -> int:
+        first_token_at: Optional[float] = None
+        event = None
+        async with client.stream("POST", url, params=self.params()) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response.status_code
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event == "token" and first_token_at is None:
+                    first_token_at = time.perf_counter()
+                elif line.startswith("data: ") and event == "error":
+                    self.errors[f"sse: {json.loads(line[len('data: '):]).get('detail', '')[:60]}"] += 1
+                    return 0
+        if first_token_at is not None:
+            self.ttft.append((first_token_at - started) * 1000)
+        return response.status_code
+
+    def pick_username(self, index: int) -> str:
+        if self.args.same_user:
+            return self.usernames[0]
+        return self.usernames[index % len(self.usernames)]
+
+    async def run(self) -> dict:
+        args = self.args
+        total = int(args.rps * args.duration)
+        limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+        harness_lag = EventLoopLagMonitor()
+        harness_lag.start()
+
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+            metrics_before = await self.fetch_metrics(client)
+            tasks = []
+            started = time.perf_counter()
+            next_at = 0.0
+            for index in range(total):
+                # Равномерные интервалы или пуассоновский поток с тем же средним RPS
+                next_at += random.expovariate(args.rps) if args.arrival == "poisson" else 1 / args.rps
+                delay = started + next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self.request(client, self.pick_username(index))))
+            sent_elapsed = time.perf_counter() - started
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+            metrics_after = await self.fetch_metrics(client)
+
+        await harness_lag.stop()
+        ok = self.statuses.get(200, 0)
+        return {
+            "endpoint": args.endpoint,
+            "target_rps": args.rps,
+            "sent": total,
+            "offered_rps": round(total / sent_elapsed, 2) if sent_elapsed else None,
+            "completed_rps": round(ok / elapsed, 2) if elapsed else None,
+            "elapsed_seconds": round(elapsed, 1),
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "errors": dict(self.errors),
+            "latency": percentiles(self.latencies),
+            "time_to_first_token": percentiles(self.ttft) if args.endpoint == "stream" else None,
+            "max_in_flight": self.max_in_flight,
+            # Если лаг самого генератора нагрузки велик, результатам верить нельзя
+            "harness_event_loop": harness_lag.stats(),
+            "server": self.server_summary(metrics_before, metrics_after),
+        }
+
+    async def fetch_metrics(self, client: httpx.AsyncClient) -> Optional[dict]:
+        try:
+            response = await client.get("/api/metrics")
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            logger.warning(f"Метрики сервера недоступны: {e}")
+            return None
+
+    @staticmethod
+    def server_summary(before: Optional[dict], after: Optional[dict]) -> Optional[dict]:
+        if not after:
+            return None
+        summary = {
+            "event_loop": after.get("event_loop"),
+            "report_cache": after.get("report_cache"),
+            "single_flight": after.get("single_flight"),
+        }
+        if before and before.get("single_flight") and after.get("single_flight"):
+            summary["coalesced_during_test"] = (
+                after["single_flight"]["coalesced_total"] - before["single_flight"]["coalesced_total"]
+            )
+        return summary
+
+
+async def run(args) -> dict:
+    if args.seed_profiles:
+        usernames = await seed_profiles(args.seed_profiles)
+    else:
+        usernames = args.usernames
+    if not usernames:
+        raise SystemExit("Укажите --usernames или --seed-profiles N")
+
+    try:
+        return await LoadTest(args, usernames).run()
+    finally:
+        if args.cleanup:
+            await cleanup_profiles()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Нагрузочный тест эндпоинтов генерации отчетов")
+    arg_parser.add_argument("--url", default="http://localhost:8001", help="Адрес parsing server")
+    arg_parser.add_argument("--endpoint", choices=tuple(ENDPOINTS), default="regenerate")
+    arg_parser.add_argument("--rps", type=float, default=5)
+    arg_parser.add_argument("--duration", type=float, default=30, help="Длительность подачи нагрузки, с")
+    arg_parser.add_argument("--arrival", choices=("uniform", "poisson"), default="poisson")
+    arg_parser.add_argument("--usernames", nargs="*", default=[])
+    arg_parser.add_argument("--seed-profiles", type=int, default=0, help="Создать N синтетических профилей в базе (нужен DATABASE_URL)")
+    arg_parser.add_argument("--cleanup", action="store_true", help="Удалить синтетические профили после теста")
+    arg_parser.add_argument("--same-user", action="store_true", help="Все запросы к одному профилю (проверка объединения запросов)")
+    arg_parser.add_argument("--no-force-refresh", dest="force_refresh", action="store_false", help="Разрешить ответы из кэша отчетов")
+    arg_parser.add_argument("--depth", default=None, help="Глубина отчета: short, standard или full")
+    arg_parser.add_argument("--timeout", type=float, default=300)
+    arg_parser.add_argument("--max-connections", type=int, default=500)
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
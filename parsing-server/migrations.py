@@ -0,0 +1,243 @@
+"""
+Версионные миграции схемы базы данных
+
+Примеры:
+    # Применить недостающие миграции (выполняется перед запуском сервера, см. Dockerfile.parsing)
+    python migrations.py upgrade
+
+    # Текущая версия схемы и список миграций
+    python migrations.py current
+    python migrations.py history
+
+При запуске сервер только сверяет версию схемы (один запрос); миграции применяет
+отдельная команда. Несколько реплик, запущенных одновременно, не мешают друг другу:
+upgrade выполняется под advisory lock PostgreSQL в одной транзакции.
+
+Новая миграция - функция (conn) -> None в MIGRATIONS со следующим номером. Базовая миграция
+на пустой базе создает таблицы по текущим моделям, поэтому последующие миграции должны
+проверять, что изменение еще не применено (см. add_column_if_missing).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Callable, List, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from database import engine, Base, InstagramProfile, CohortPercentile, PROFILE_SORT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock миграций (любое число, одинаковое для всех реплик)
+MIGRATION_LOCK_ID = 804_411_952
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def add_column_if_missing(conn, table: str, column: str, ddl_type: str):
+    """ALTER TABLE ... ADD COLUMN, если колонки еще нет"""
+    columns = [col["name"] for col in inspect(conn).get_columns(table)]
+    if column not in columns:
+        logger.info(f"Добавление колонки {column} в таблицу {table}")
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+def _baseline(conn):
+    """Таблицы моделей и колонки instagram_profiles, которые раньше добавлял init_db при каждом запуске"""
+    Base.metadata.create_all(bind=conn)
+
+    new_columns = {
+        "views": "INTEGER DEFAULT 0",
+        "interactions": "INTEGER DEFAULT 0",
+        "new_followers": "INTEGER DEFAULT 0",
+        "messages": "INTEGER DEFAULT 0",
+        "shares": "INTEGER DEFAULT 0",
+        "report_ru": "TEXT",
+        "report_en": "TEXT",
+        "report_generated_at": "TIMESTAMP",
+        "report_model": "VARCHAR",
+        "report_prompt_version": "VARCHAR",
+        # Без DEFAULT: NULL означает отчет из кэша, а 0 указывал бы на несуществующий вызов
+        "report_llm_call_id": "INTEGER",
+        "report_status": "VARCHAR",
+    }
+    for column, ddl_type in new_columns.items():
+        add_column_if_missing(conn, "instagram_profiles", column, ddl_type)
+
+    # create_all не добавляет индексы в уже существующую таблицу
+    for index in InstagramProfile.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+def _cohort_percentiles(conn):
+    """Таблица распределений метрик по когортам и индексы лидербордов"""
+    CohortPercentile.__table__.create(bind=conn, checkfirst=True)
+    for index in InstagramProfile.__table__.indexes:
+        if index.name in ("ix_instagram_profiles_engagement_rate_id", "ix_instagram_profiles_views_id"):
+            index.create(bind=conn, checkfirst=True)
+
+
+def _profile_list_desc_indexes(conn):
+    """
+    Индексы (колонка DESC NULLS LAST, id DESC) для списка профилей по убыванию в PostgreSQL
+
+    Обычный индекс (колонка, id) в PostgreSQL хранит NULL в конце по возрастанию, поэтому
+    подходит только для порядка по возрастанию с NULL в конце. SQLite хранит NULL первыми,
+    и обычный индекс уже подходит для убывания с NULL в конце
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    for column in PROFILE_SORT_COLUMNS:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_instagram_profiles_{column}_id_desc "
+            f"ON instagram_profiles ({column} DESC NULLS LAST, id DESC)"
+        ))
+
+
+def _report_llm_call_id_null(conn):
+    """
+    Убирает DEFAULT 0 у report_llm_call_id, добавленный ранней базовой миграцией: 0 указывает
+    на несуществующий вызов в llm_calls, а отчет из кэша обозначается NULL
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE instagram_profiles ALTER COLUMN report_llm_call_id DROP DEFAULT"))
+    conn.execute(text("UPDATE instagram_profiles SET report_llm_call_id = NULL WHERE report_llm_call_id = 0"))
+
+
+# (версия, название, функция миграции) по возрастанию версии
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "baseline", _baseline),
+    (2, "cohort_percentiles", _cohort_percentiles),
+    (3, "profile_list_desc_indexes", _profile_list_desc_indexes),
+    (4, "report_llm_call_id_null", _report_llm_call_id_null),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(conn) -> int:
+    """Версия схемы (0 - миграции еще не применялись)"""
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def _upgrade(conn) -> List[int]:
+    """Применяет недостающие миграции (синхронная часть upgrade, одна транзакция)"""
+    if conn.dialect.name == "postgresql":
+        # Вторая реплика ждет здесь и затем видит уже обновленную схему
+        conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MIGRATION_LOCK_ID})
+    schema_version.create(bind=conn, checkfirst=True)
+
+    current = _current_version(conn)
+    applied = []
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Применение миграции {version}: {name}")
+        migration(conn)
+        conn.execute(schema_version.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        applied.append(version)
+    return applied
+
+
+async def upgrade() -> List[int]:
+    """
+    Применяет недостающие миграции
+
+    Returns:
+        list: Версии примененных миграций
+    """
+    async with engine.begin() as conn:
+        applied = await conn.run_sync(_upgrade)
+    if applied:
+        logger.info(f"Схема базы данных обновлена до версии {applied[-1]}")
+    else:
+        logger.info(f"Схема базы данных актуальна (версия {LATEST_VERSION})")
+    return applied
+
+
+async def current_version() -> int:
+    """
+    Версия схемы (0 - таблицы schema_version еще нет)
+
+    Ошибки подключения не перехватываются: недоступная база не должна выглядеть как пустая
+    """
+    async with engine.connect() as conn:
+        return await conn.run_sync(_current_version)
+
+
+async def check_schema():
+    """
+    Проверка версии схемы при запуске сервера
+
+    Если схема отстает, миграции применяются только при DB_AUTO_MIGRATE=true,
+    иначе запуск прерывается: миграции выполняет python migrations.py upgrade
+
+    Raises:
+        RuntimeError: Схема базы данных старее кода
+    """
+    version = await current_version()
+    if version == LATEST_VERSION:
+        return
+    if version > LATEST_VERSION:
+        logger.warning(f"Схема базы данных версии {version} новее кода (версия {LATEST_VERSION})")
+        return
+    if os.getenv("DB_AUTO_MIGRATE", "false").lower() == "true":
+        await upgrade()
+        return
+    raise RuntimeError(
+        f"Схема базы данных версии {version}, требуется {LATEST_VERSION}. "
+        f"Выполните python migrations.py upgrade (или установите DB_AUTO_MIGRATE=true)"
+    )
+
+
+async def history() -> list:
+    """Миграции и время их применения"""
+    async with engine.connect() as conn:
+        has_table = await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(schema_version.name))
+        applied = {}
+        if has_table:
+            applied = {row.version: row.applied_at for row in await conn.execute(select(schema_version))}
+    return [
+        {
+            "version": version,
+            "name": name,
+            "applied_at": applied[version].isoformat() if version in applied else None,
+        }
+        for version, name, _ in MIGRATIONS
+    ]
+
+
+async def run(command: str):
+    try:
+        if command == "upgrade":
+            applied = await upgrade()
+            return {"applied": applied, "version": await current_version()}
+        if command == "current":
+            return {"version": await current_version(), "latest": LATEST_VERSION}
+        return await history()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    load_dotenv()
+    arg_parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    arg_parser.add_argument("command", choices=("upgrade", "current", "history"))
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    print(json.dumps(asyncio.run(run(args.command)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+OpenAI-совместимый stub сервер для нагрузочного тестирования без расхода API кредитов
+
+Запуск:
+    python mock_llm_server.py --port 8090 --ttft lognormal:600,0.5 --token-delay fixed:15 \\
+        --error-rate 0.02 --rate-limit-rate 0.05
+
+Parsing server направляется на него через переменные окружения:
+    OPENAI_API_KEY=test OPENAI_BASE_URL=http://localhost:8090/v1 python app.py
+
+Распределения задержек (миллисекунды):
+    fixed:800            - всегда 800
+    uniform:200,1500     - равномерно от 200 до 1500
+    lognormal:800,0.6    - логнормальное с медианой 800 и sigma 0.6 (длинный хвост)
+    exp:500              - экспоненциальное со средним 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import time
+import uuid
+from typing import Callable, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from token_budget import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+FILLER_WORDS = (
+    "Аккаунт", "демонстрирует", "стабильный", "рост", "аудитории", "и", "высокий", "уровень",
+    "вовлеченности.", "Рекомендуется", "усилить", "серийный", "контент", "в", "Reels", "и",
+    "добавить", "структурированные", "Highlights.", "Партнеры:", "лайфстайл", "бренды,",
+    "образовательные", "сервисы,", "коучинг.", "🌟", "Сильная", "сторона:", "доверие", "подписчиков.",
+)
+
+
+class LatencyDistribution:
+    """Распределение задержки, заданное строкой вида 'lognormal:800,0.6'"""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v.strip()]
+        if kind == "fixed" and len(values) == 1:
+            self._sample = lambda: values[0]
+        elif kind == "uniform" and len(values) == 2:
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == "lognormal" and len(values) == 2:
+            self._sample = lambda: random.lognormvariate(math.log(values[0]), values[1])
+        elif kind == "exp" and len(values) == 1:
+            self._sample = lambda: random.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+        else:
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+    def sample_seconds(self) -> float:
+        return max(self._sample(), 0.0) / 1000
+
+
+class MockConfig:
+    """Поведение stub сервера (переменные окружения MOCK_LLM_* или аргументы командной строки)"""
+
+    def __init__(self):
+        self.ttft = LatencyDistribution(os.getenv("MOCK_LLM_TTFT", "lognormal:600,0.5"))
+        self.token_delay = LatencyDistribution(os.getenv("MOCK_LLM_TOKEN_DELAY", "fixed:15"))
+        self.completion_tokens = int(os.getenv("MOCK_LLM_COMPLETION_TOKENS", 800))
+        self.error_rate = float(os.getenv("MOCK_LLM_ERROR_RATE", 0))
+        self.rate_limit_rate = float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", 0))
+        self.retry_after = float(os.getenv("MOCK_LLM_RETRY_AFTER_SECONDS", 2))
+        # Больше одновременных запросов - 429, как при исчерпании лимита провайдера (0 - без ограничения)
+        self.max_concurrency = int(os.getenv("MOCK_LLM_MAX_CONCURRENCY", 0))
+        self.stream_chunk_tokens = int(os.getenv("MOCK_LLM_STREAM_CHUNK_TOKENS", 1))
+
+    def describe(self) -> dict:
+        return {
+            "ttft": self.ttft.spec,
+            "token_delay": self.token_delay.spec,
+            "completion_tokens": self.completion_tokens,
+            "error_rate": self.error_rate,
+            "rate_limit_rate": self.rate_limit_rate,
+            "retry_after_seconds": self.retry_after,
+            "max_concurrency": self.max_concurrency,
+            "stream_chunk_tokens": self.stream_chunk_tokens,
+        }
+
+
+config = MockConfig()
+stats = {"requests": 0, "completed": 0, "streamed": 0, "errors": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0}
+
+app = FastAPI(title="Mock LLM Server")
+
+
+def acquire_slot() -> Callable[[], None]:
+    """Учитывает запрос в in_flight; возвращает функцию освобождения (повторный вызов ничего не делает)"""
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            stats["in_flight"] -= 1
+
+    return release
+
+
+def error_response(status_code: int, message: str, error_type: str, code: Optional[str] = None, headers: Optional[dict] = None) -> JSONResponse:
+    """Ошибка в формате OpenAI API"""
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "param": None, "code": code}},
+        headers=headers,
+    )
+
+
+def completion_words(max_tokens: Optional[int]) -> list:
+    count = config.completion_tokens
+    if max_tokens:
+        count = min(count, max_tokens)
+    return [FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(count)]
+
+
+def completion_pieces(body: dict) -> list:
+    """
+    Фрагменты ответа (по одному на токен). Для response_format json_schema -
+    JSON с каждым строковым полем схемы, разбитый на куски, как это делает модель
+    """
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") != "json_schema":
+        words = completion_words(body.get("max_tokens"))
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    fields = list(response_format["json_schema"]["schema"].get("properties", {}))
+    words = completion_words((body.get("max_tokens") or 0) // max(len(fields), 1) or None)
+    content = json.dumps({field: " ".join(words) for field in fields}, ensure_ascii=False)
+    return [content[i:i + 4] for i in range(0, len(content), 4)]
+
+
+def usage(prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+
+@app.get("/stats")
+async def get_stats():
+    return {"config": config.describe(), **stats}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+
+    over_limit = config.max_concurrency and stats["in_flight"] >= config.max_concurrency
+    if over_limit or random.random() < config.rate_limit_rate:
+        stats["rate_limited"] += 1
+        return error_response(
+            429,
+            "Rate limit reached for requests",
+            "requests",
+            code="rate_limit_exceeded",
+            headers={"retry-after": f"{config.retry_after:g}", "x-ratelimit-remaining-requests": "0"},
+        )
+
+    if random.random() < config.error_rate:
+        stats["errors"] += 1
+        await asyncio.sleep(config.ttft.sample_seconds())
+        return error_response(500, "The server had an error while processing your request", "server_error")
+
+    model = body.get("model", "mock")
+    pieces = completion_pieces(body)
+    prompt_tokens = count_message_tokens(body.get("messages") or [], model)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+
+    if body.get("stream"):
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        # Поток занимает слот сразу, а не когда сервер начнет читать генератор: иначе всплеск
+        # потоковых запросов проходит мимо MOCK_LLM_MAX_CONCURRENCY и занижает max_in_flight
+        release = acquire_slot()
+        return StreamingResponse(
+            stream_completion(completion_id, created, model, pieces, prompt_tokens, include_usage, release),
+            media_type="text/event-stream",
+            # Если генератор так и не был запущен (клиент отключился раньше), слот освободит фоновая задача
+            background=BackgroundTask(release),
+        )
+
+    release = acquire_slot()
+    try:
+        delay = config.ttft.sample_seconds() + sum(config.token_delay.sample_seconds() for _ in pieces)
+        await asyncio.sleep(delay)
+    finally:
+        release()
+    stats["completed"] += 1
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": "".join(pieces)},
+            "finish_reason": "stop",
+        }],
+        "usage": usage(prompt_tokens, len(pieces)),
+    }
+
+
+async def stream_completion(completion_id: str, created: int, model: str, pieces: list, prompt_tokens: int, include_usage: bool, release: Callable[[], None]):
+    """
+    Чанки chat.completion.chunk с задержкой до первого токена и между токенами
+
+    Args:
+        release: Освобождает слот конкурентности, занятый при приеме запроса
+    """
+
+    def chunk(delta: dict, finish_reason: Optional[str] = None, usage_data: Optional[dict] = None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [] if usage_data else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage_data:
+            payload["usage"] = usage_data
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    try:
+        await asyncio.sleep(config.ttft.sample_seconds())
+        yield chunk({"role": "assistant", "content": ""})
+        step = max(config.stream_chunk_tokens, 1)
+        for start in range(0, len(pieces), step):
+            if start:
+                await asyncio.sleep(sum(config.token_delay.sample_seconds() for _ in range(step)))
+            yield chunk({"content": "".join(pieces[start:start + step])})
+        yield chunk({}, finish_reason="stop")
+        if include_usage:
+            yield chunk({}, usage_data=usage(prompt_tokens, len(pieces)))
+        yield "data: [DONE]\n\n"
+        stats["streamed"] += 1
+    finally:
+        release()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="OpenAI-совместимый stub сервер")
+    arg_parser.add_argument("--host", default="0.0.0.0")
+    arg_parser.add_argument("--port", type=int, default=int(os.getenv("MOCK_LLM_PORT", 8090)))
+    arg_parser.add_argument("--ttft", help="Задержка до первого токена, например lognormal:600,0.5")
+    arg_parser.add_argument("--token-delay", help="Задержка между токенами, например fixed:15")
+    arg_parser.add_argument("--completion-tokens", type=int, help="Токенов в ответе (не больше max_tokens запроса)")
+    arg_parser.add_argument("--error-rate", type=float, help="Доля ответов 500")
+    arg_parser.add_argument("--rate-limit-rate", type=float, help="Доля ответов 429")
+    arg_parser.add_argument("--retry-after", type=float, help="Значение заголовка Retry-After, с")
+    arg_parser.add_argument("--max-concurrency", type=int, help="Одновременных запросов до 429 (0 - без ограничения)")
+    arg_parser.add_argument("--stream-chunk-tokens", type=int, help="Токенов в одном чанке потока")
+    arg_parser.add_argument("--seed", type=int, default=None, help="Seed генератора случайных чисел")
+    args = arg_parser.parse_args()
+
+    if args.ttft:
+        config.ttft = LatencyDistribution(args.ttft)
+    if args.token_delay:
+        config.token_delay = LatencyDistribution(args.token_delay)
+    for name in ("completion_tokens", "error_rate", "rate_limit_rate", "retry_after", "max_concurrency", "stream_chunk_tokens"):
+        value = getattr(args, name)
+        if value is not None:
+            setattr(config, name, value)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    logger.info(f"Mock LLM сервер: {config.describe()}")
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
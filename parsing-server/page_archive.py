@@ -0,0 +1,79 @@
+"""
+Запись и воспроизведение страниц профилей из локального архива (HAR) через маршрутизацию Playwright
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODE_LIVE = "live"  # обычная работа с сетью
+MODE_RECORD = "record"  # страницы загружаются из сети и сохраняются в архив
+MODE_REPLAY = "replay"  # страницы отдаются только из архива, сеть не используется
+
+MODES = (MODE_LIVE, MODE_RECORD, MODE_REPLAY)
+
+IMAGE_RESOURCE_TYPES = ("image", "media", "font")
+
+
+class PageArchive:
+    """
+    Архив записанных страниц: <CAPTURE_ARCHIVE_DIR>/<username>/<kind>.har.zip
+
+    В режиме replay все запросы (HTML, JSON, XHR и, при желании, изображения)
+    обслуживаются из HAR, а отсутствующие в архиве - обрываются, поэтому
+    скрапинг и скриншоты работают без сети и с детерминированными ответами.
+    """
+
+    def __init__(self, mode: str = None, archive_dir: str = None, include_images: bool = None):
+        self.mode = (mode or os.getenv("CAPTURE_MODE", MODE_LIVE)).lower()
+        if self.mode not in MODES:
+            logger.warning(f"Неизвестный CAPTURE_MODE={self.mode}, используется {MODE_LIVE}")
+            self.mode = MODE_LIVE
+        self.archive_dir = archive_dir or os.getenv("CAPTURE_ARCHIVE_DIR", "capture_archive")
+        if include_images is None:
+            include_images = os.getenv("CAPTURE_ARCHIVE_IMAGES", "false").lower() == "true"
+        self.include_images = include_images
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != MODE_LIVE
+
+    def har_path(self, archive_key: str) -> str:
+        return os.path.join(self.archive_dir, f"{archive_key}.har.zip")
+
+    def has_recording(self, archive_key: str) -> bool:
+        return os.path.exists(self.har_path(archive_key))
+
+    async def attach(self, context, archive_key: str):
+        """
+        Подключает архив к контексту браузера
+
+        Args:
+            context: BrowserContext Playwright
+            archive_key: Ключ записи, например "<username>/scraper"
+        """
+        if not self.enabled or not archive_key:
+            return
+
+        har_path = self.har_path(archive_key)
+        if self.mode == MODE_RECORD:
+            os.makedirs(os.path.dirname(har_path), exist_ok=True)
+            # HAR записывается на диск при закрытии контекста
+            await context.route_from_har(har_path, update=True, update_content="embed", update_mode="minimal")
+        else:
+            if not os.path.exists(har_path):
+                raise FileNotFoundError(f"Нет записи страницы для воспроизведения: {har_path}")
+            await context.route_from_har(har_path, not_found="abort")
+
+        if not self.include_images:
+            # Маршрут, добавленный последним, проверяется первым
+            await context.route("**/*", self._skip_images)
+
+        logger.debug(f"Архив страниц подключен ({self.mode}): {har_path}")
+
+    @staticmethod
+    async def _skip_images(route):
+        if route.request.resource_type in IMAGE_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.fallback()
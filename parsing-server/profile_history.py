@@ -0,0 +1,237 @@
+"""
+История метрик профиля: снимок на каждый анализ, выборка за период, свертка старых снимков
+по дням и неделям и удаление точек старше срока хранения
+"""
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import ProfileSnapshot, SNAPSHOT_RAW, SNAPSHOT_DAY, SNAPSHOT_WEEK
+
+logger = logging.getLogger(__name__)
+
+# Метрики профиля, которые попадают в снимок
+SNAPSHOT_METRICS = (
+    "followers", "following", "posts_count", "engagement_rate",
+    "views", "interactions", "new_followers", "messages", "shares",
+)
+
+
+def day_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, moment.day)
+
+
+def week_start(moment: datetime) -> datetime:
+    """Понедельник недели, в которую попадает moment"""
+    return day_start(moment) - timedelta(days=moment.weekday())
+
+
+def snapshot_point(snapshot: ProfileSnapshot) -> dict:
+    return {
+        "captured_at": snapshot.captured_at.isoformat(),
+        "resolution": snapshot.resolution,
+        "samples": snapshot.samples,
+        "source": snapshot.source,
+        **{metric: getattr(snapshot, metric) for metric in SNAPSHOT_METRICS},
+    }
+
+
+class ProfileHistory:
+    """
+    Пишет снимки метрик в profile_snapshots и периодически сворачивает их:
+    снимки старше PROFILE_HISTORY_RAW_DAYS - в одну точку за день, дневные точки старше
+    PROFILE_HISTORY_DAILY_DAYS - в одну точку за неделю, точки старше
+    PROFILE_HISTORY_RETENTION_DAYS удаляются. Так размер истории растет с числом
+    профилей, а не с числом анализов
+    """
+
+    def __init__(self, session_factory: Callable):
+        self.session_factory = session_factory
+        self.enabled = os.getenv("PROFILE_HISTORY_ENABLED", "true").lower() == "true"
+        self.raw_days = int(os.getenv("PROFILE_HISTORY_RAW_DAYS", 30))
+        self.daily_days = int(os.getenv("PROFILE_HISTORY_DAILY_DAYS", 365))
+        self.retention_days = int(os.getenv("PROFILE_HISTORY_RETENTION_DAYS", 1825))  # 0 - хранить бессрочно
+        self.interval = float(os.getenv("PROFILE_HISTORY_COMPACT_INTERVAL_HOURS", 24)) * 3600
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"snapshots_written": 0, "compactions": 0, "rows_compacted": 0, "rollups_written": 0, "rows_expired": 0}
+        self._last_compaction: Optional[dict] = None
+
+    async def record(self, profile, source: str):
+        """
+        Добавляет снимок текущих метрик профиля
+
+        Пишет в своей сессии: ошибка записи истории не должна откатывать
+        (и делать устаревшими) объекты сессии запроса
+        """
+        if not self.enabled:
+            return
+        try:
+            async with self.session_factory() as db:
+                db.add(ProfileSnapshot(
+                    username=profile.username,
+                    captured_at=datetime.utcnow(),
+                    resolution=SNAPSHOT_RAW,
+                    samples=1,
+                    source=source,
+                    **{metric: getattr(profile, metric) for metric in SNAPSHOT_METRICS},
+                ))
+                await db.commit()
+            self._stats["snapshots_written"] += 1
+        except Exception as e:
+            logger.error(f"Не удалось сохранить снимок метрик {profile.username}: {e}")
+
+    async def range(
+        self,
+        db: AsyncSession,
+        username: str,
+        since: datetime,
+        until: datetime,
+        resolution: Optional[str] = None,
+        limit: int = 1000
+    ) -> List[ProfileSnapshot]:
+        """
+        Точки истории профиля за период [since, until) по возрастанию времени
+
+        Args:
+            resolution: Только точки этого разрешения (raw, day, week); None - все
+        """
+        statement = select(ProfileSnapshot).where(
+            ProfileSnapshot.username == username,
+            ProfileSnapshot.captured_at >= since,
+            ProfileSnapshot.captured_at < until
+        )
+        if resolution:
+            statement = statement.where(ProfileSnapshot.resolution == resolution)
+        statement = statement.order_by(ProfileSnapshot.captured_at, ProfileSnapshot.id).limit(limit)
+        return list((await db.scalars(statement)).all())
+
+    async def delete(self, db: AsyncSession, username: Optional[str] = None) -> int:
+        """
+        Удаляет историю профиля (None - всех профилей)
+
+        Returns:
+            int: Число удаленных точек
+        """
+        statement = delete(ProfileSnapshot)
+        if username is not None:
+            statement = statement.where(ProfileSnapshot.username == username)
+        count = (await db.execute(statement)).rowcount
+        await db.commit()
+        return count
+
+    async def compact(self, now: Optional[datetime] = None) -> dict:
+        """
+        Сворачивает старые снимки по дням и неделям и удаляет точки старше срока хранения
+
+        Границы выровнены по началу дня и недели, поэтому сворачиваются только
+        завершенные периоды и повторный запуск ничего не меняет
+
+        Returns:
+            dict: Сколько строк свернуто, сколько точек записано и удалено
+        """
+        now = now or datetime.utcnow()
+        result = {"rows_compacted": 0, "rollups_written": 0, "rows_expired": 0}
+        async with self.session_factory() as db:
+            if self.raw_days > 0:
+                compacted, written = await self._rollup(
+                    db, SNAPSHOT_RAW, SNAPSHOT_DAY, day_start(now - timedelta(days=self.raw_days)), day_start
+                )
+                result["rows_compacted"] += compacted
+                result["rollups_written"] += written
+            if self.daily_days > 0:
+                compacted, written = await self._rollup(
+                    db, SNAPSHOT_DAY, SNAPSHOT_WEEK, week_start(now - timedelta(days=self.daily_days)), week_start
+                )
+                result["rows_compacted"] += compacted
+                result["rollups_written"] += written
+            if self.retention_days > 0:
+                expired = await db.execute(
+                    delete(ProfileSnapshot).where(ProfileSnapshot.captured_at < now - timedelta(days=self.retention_days))
+                )
+                result["rows_expired"] = expired.rowcount
+                await db.commit()
+
+        self._stats["compactions"] += 1
+        for key, value in result.items():
+            self._stats[key] += value
+        self._last_compaction = {**result, "at": now.isoformat()}
+        logger.info(
+            f"История метрик свернута: {result['rows_compacted']} точек -> {result['rollups_written']}, "
+            f"удалено устаревших: {result['rows_expired']}"
+        )
+        return result
+
+    async def _rollup(self, db: AsyncSession, source: str, target: str, cutoff: datetime, bucket: Callable) -> tuple:
+        """
+        Заменяет точки разрешения source до cutoff одной точкой target на период bucket
+        (значения последней точки периода); одна транзакция на профиль
+
+        Returns:
+            tuple: (число свернутых точек, число записанных точек)
+        """
+        old = (ProfileSnapshot.resolution == source, ProfileSnapshot.captured_at < cutoff)
+        usernames = (await db.scalars(select(ProfileSnapshot.username).where(*old).distinct())).all()
+
+        compacted = written = 0
+        for username in usernames:
+            rows = (await db.scalars(
+                select(ProfileSnapshot)
+                .where(ProfileSnapshot.username == username, *old)
+                .order_by(ProfileSnapshot.captured_at, ProfileSnapshot.id)
+            )).all()
+
+            periods = {}
+            for row in rows:
+                periods.setdefault(bucket(row.captured_at), []).append(row)
+            for period_start, period_rows in periods.items():
+                last = period_rows[-1]
+                db.add(ProfileSnapshot(
+                    username=username,
+                    captured_at=period_start,
+                    resolution=target,
+                    samples=sum(row.samples or 1 for row in period_rows),
+                    source=last.source,
+                    **{metric: getattr(last, metric) for metric in SNAPSHOT_METRICS},
+                ))
+            await db.execute(delete(ProfileSnapshot).where(ProfileSnapshot.id.in_([row.id for row in rows])))
+            await db.commit()
+            compacted += len(rows)
+            written += len(periods)
+        return compacted, written
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Свертка истории метрик запущена (интервал {self.interval / 3600:.0f} ч)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error(f"Ошибка свертки истории метрик: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "raw_days": self.raw_days,
+            "daily_days": self.daily_days,
+            "retention_days": self.retention_days,
+            **self._stats,
+            "last_compaction": self._last_compaction,
+        }
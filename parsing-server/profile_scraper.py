@@ -5,8 +5,9 @@ import os
 import logging
 import json
 import re
-from playwright.async_api import async_playwright
 import asyncio
+from browser_pool import BrowserPool, PRIORITY_INTERACTIVE
+from latency_tracker import LatencyTracker, OP_GOTO, OP_EXTRACTION
 
 logger = logging.getLogger(__name__)
 
@@ -14,15 +15,17 @@ logger = logging.getLogger(__name__)
 class InstagramProfileScraper:
     """Сервис для извлечения данных Instagram профиля из HTML"""
     
-    def __init__(self):
-        pass
+    def __init__(self, browser_pool: BrowserPool, latency_tracker: LatencyTracker):
+        self.browser_pool = browser_pool
+        self.latency_tracker = latency_tracker
     
-    async def scrape_profile_data(self, username: str) -> dict:
+    async def scrape_profile_data(self, username: str, priority: int = PRIORITY_INTERACTIVE) -> dict:
         """
         Извлекает данные профиля Instagram напрямую из HTML страницы
         
         Args:
             username: Username Instagram профиля (без @)
+            priority: Приоритет в пуле браузера (фоновые задачи уступают интерактивным)
             
         Returns:
             dict: Словарь с данными профиля
@@ -36,44 +39,44 @@ class InstagramProfileScraper:
             
             logger.info(f"Извлечение данных профиля: {username}")
             
-            async with async_playwright() as p:
-                # Запускаем браузер
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context(
-                    viewport={'width': 1920, 'height': 1080},
-                    user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                )
-                page = await context.new_page()
+            async with self.browser_pool.page(
+                priority=priority,
+                archive_key=f"{username}/scraper",
+                viewport={'width': 1920, 'height': 1080},
+                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+            ) as page:
+                # Переходим на страницу профиля (таймаут по наблюдаемым задержкам)
+                with self.latency_tracker.measure(OP_GOTO):
+                    await page.goto(profile_url, wait_until='networkidle', timeout=self.latency_tracker.timeout_ms(OP_GOTO))
                 
-                try:
-                    # Переходим на страницу профиля
-                    await page.goto(profile_url, wait_until='networkidle', timeout=30000)
-                    
-                    # Ждем загрузки контента
-                    await asyncio.sleep(3)
-                    
-                    # Пытаемся извлечь данные из JSON в HTML
-                    data = await self._extract_from_page_data(page, username)
-                    
-                    # Если не получилось через JSON, пытаемся через DOM
-                    if data.get('followers', 0) == 0:
-                        logger.info("Попытка извлечения данных через DOM")
-                        data = await self._extract_from_dom(page, username)
-                    
-                    await browser.close()
-                    
-                    logger.info(f"Данные извлечены для {username}: followers={data.get('followers')}, posts={data.get('posts_count')}")
-                    return data
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при извлечении данных: {e}")
-                    await browser.close()
-                    raise
+                # Ждем загрузки контента
+                await asyncio.sleep(3)
+                
+                with self.latency_tracker.measure(OP_EXTRACTION):
+                    data = await asyncio.wait_for(
+                        self._extract(page, username),
+                        timeout=self.latency_tracker.timeout_ms(OP_EXTRACTION) / 1000
+                    )
+            
+            logger.info(f"Данные извлечены для {username}: followers={data.get('followers')}, posts={data.get('posts_count')}")
+            return data
                     
         except Exception as e:
             logger.error(f"Ошибка в scrape_profile_data: {e}")
             raise
     
+    async def _extract(self, page, username: str) -> dict:
+        """
+        Извлекает данные из JSON в HTML, а если не получилось - через DOM
+        """
+        data = await self._extract_from_page_data(page, username)
+        
+        if data.get('followers', 0) == 0:
+            logger.info("Попытка извлечения данных через DOM")
+            data = await self._extract_from_dom(page, username)
+        
+        return data
+    
     async def _extract_from_page_data(self, page, username: str) -> dict:
         """
         Извлекает данные из JSON данных, встроенных в страницу Instagram
@@ -0,0 +1,193 @@
+"""
+Фоновое обновление устаревших профилей через общий пул браузера
+"""
+import os
+import asyncio
+import heapq
+import logging
+import math
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict
+from browser_pool import BrowserPool
+from sqlalchemy import select
+from database import InstagramProfile
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileRefreshScheduler:
+    """
+    Планировщик фонового обновления профилей.
+
+    Кандидаты упорядочиваются по приоритету: давность обновления (updated_at),
+    популярность (подписчики и просмотры) и время последнего просмотра.
+    Обновления запускаются только когда пул браузера простаивает и укладываются
+    в почасовой бюджет.
+    """
+
+    def __init__(
+        self,
+        browser_pool: BrowserPool,
+        refresh_fn: Callable[[str], Awaitable[bool]],
+        session_factory,
+    ):
+        self.browser_pool = browser_pool
+        self.refresh_fn = refresh_fn
+        self.session_factory = session_factory
+
+        self.enabled = os.getenv("REFRESH_SCHEDULER_ENABLED", "true").lower() == "true"
+        self.budget_per_hour = int(os.getenv("REFRESH_BUDGET_PER_HOUR", 20))
+        self.stale_after = timedelta(hours=float(os.getenv("REFRESH_STALE_AFTER_HOURS", 24)))
+        self.poll_interval = float(os.getenv("REFRESH_POLL_INTERVAL_SECONDS", 60))
+        self.candidate_limit = int(os.getenv("REFRESH_CANDIDATE_LIMIT", 200))
+        self.failure_backoff = float(os.getenv("REFRESH_FAILURE_BACKOFF_SECONDS", 3600))
+        # Просмотры старше этого срока забываются (их вклад в приоритет уже мал)
+        self.view_ttl = float(os.getenv("REFRESH_VIEW_TTL_HOURS", 168)) * 3600
+
+        # Веса компонентов приоритета
+        self.staleness_weight = float(os.getenv("REFRESH_WEIGHT_STALENESS", 1.0))
+        self.popularity_weight = float(os.getenv("REFRESH_WEIGHT_POPULARITY", 2.0))
+        self.recent_view_weight = float(os.getenv("REFRESH_WEIGHT_RECENT_VIEW", 24.0))
+
+        self._views: Dict[str, list] = {}  # username -> [count, last_viewed_monotonic]
+        self._failed_until: Dict[str, float] = {}
+        self._refresh_times = deque()
+        self._task = None
+        self._stats = {
+            "refreshed": 0,
+            "failed": 0,
+            "preempted": 0,
+            "budget_exhausted": 0,
+            "last_run_at": None,
+        }
+
+    def record_view(self, username: str):
+        """Отмечает просмотр профиля пользователем (повышает приоритет обновления)"""
+        entry = self._views.setdefault(username, [0, 0.0])
+        entry[0] += 1
+        entry[1] = time.monotonic()
+
+    def _priority(self, username: str, updated_at, followers: int, now: datetime) -> float:
+        staleness_hours = (now - updated_at).total_seconds() / 3600 if updated_at else self.stale_after.total_seconds() / 3600
+        views, last_viewed = self._views.get(username, (0, None))
+
+        score = self.staleness_weight * staleness_hours
+        score += self.popularity_weight * (math.log10((followers or 0) + 1) + math.log1p(views))
+        if last_viewed is not None:
+            hours_since_view = (time.monotonic() - last_viewed) / 3600
+            score += self.recent_view_weight / (1 + hours_since_view)
+        return score
+
+    def _remaining_budget(self) -> int:
+        cutoff = time.monotonic() - 3600
+        while self._refresh_times and self._refresh_times[0] < cutoff:
+            self._refresh_times.popleft()
+        return self.budget_per_hour - len(self._refresh_times)
+
+    def _prune(self):
+        """Удаляет давние просмотры и истекшие паузы после ошибок, чтобы словари не росли без ограничений"""
+        monotonic_now = time.monotonic()
+        for username in [name for name, (_, last_viewed) in self._views.items() if monotonic_now - last_viewed > self.view_ttl]:
+            del self._views[username]
+        for username in [name for name, until in self._failed_until.items() if until <= monotonic_now]:
+            del self._failed_until[username]
+
+    async def _build_queue(self) -> list:
+        """Собирает очередь кандидатов (max-heap по приоритету)"""
+        self._prune()
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(
+                    InstagramProfile.username,
+                    InstagramProfile.updated_at,
+                    InstagramProfile.followers,
+                ).where(
+                    InstagramProfile.updated_at < now - self.stale_after
+                ).order_by(
+                    InstagramProfile.updated_at.asc()
+                ).limit(self.candidate_limit)
+            )).all()
+
+        monotonic_now = time.monotonic()
+        queue = []
+        for username, updated_at, followers in rows:
+            if self._failed_until.get(username, 0) > monotonic_now:
+                continue
+            heapq.heappush(queue, (-self._priority(username, updated_at, followers, now), username))
+        return queue
+
+    async def run_once(self) -> int:
+        """Выполняет один проход планировщика, возвращает число обновленных профилей"""
+        self._stats["last_run_at"] = datetime.utcnow().isoformat()
+        if self._remaining_budget() <= 0:
+            self._stats["budget_exhausted"] += 1
+            return 0
+        if not self.browser_pool.is_idle():
+            return 0
+
+        queue = await self._build_queue()
+        refreshed = 0
+        while queue and self._remaining_budget() > 0 and self.browser_pool.is_idle():
+            _, username = heapq.heappop(queue)
+            self._refresh_times.append(time.monotonic())
+
+            task = asyncio.create_task(self.refresh_fn(username))
+            await asyncio.wait({task})
+
+            if task.cancelled():
+                # Интерактивный запрос занял браузер - прекращаем проход
+                self._stats["preempted"] += 1
+                self._refresh_times.pop()
+                logger.info(f"Фоновое обновление {username} вытеснено интерактивным запросом")
+                break
+
+            error = task.exception()
+            if error is not None or not task.result():
+                self._stats["failed"] += 1
+                self._failed_until[username] = time.monotonic() + self.failure_backoff
+                logger.warning(f"Фоновое обновление {username} не удалось: {error or 'нет данных'}")
+                continue
+
+            self._stats["refreshed"] += 1
+            refreshed += 1
+            logger.info(f"Профиль {username} обновлен в фоне")
+        return refreshed
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка планировщика фонового обновления: {e}")
+
+    def start(self):
+        if not self.enabled:
+            logger.info("Фоновое обновление профилей отключено (REFRESH_SCHEDULER_ENABLED=false)")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+            logger.info(f"Фоновое обновление профилей запущено: бюджет {self.budget_per_hour}/час")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "budget_per_hour": self.budget_per_hour,
+            "remaining_budget": max(self._remaining_budget(), 0),
+            "stale_after_hours": self.stale_after.total_seconds() / 3600,
+            "tracked_views": len(self._views),
+            **self._stats,
+        }
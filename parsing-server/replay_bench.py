@@ -0,0 +1,107 @@
+"""
+Офлайн-бенчмарк скрапинга и скриншотов на записанных страницах профилей
+
+Запись архива (нужна сеть):
+    python replay_bench.py --record username1 username2
+
+Воспроизведение без сети и замер времени:
+    python replay_bench.py username1 username2 --pipeline capture --strategy hedged --iterations 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from browser_pool import BrowserPool
+from capture_strategy import ProfileCapture, STRATEGIES
+from image_parser import InstagramScreenshotParser
+from latency_tracker import LatencyTracker, percentile
+from page_archive import PageArchive, MODE_RECORD, MODE_REPLAY
+from profile_scraper import InstagramProfileScraper
+from screenshot_service import InstagramScreenshotService
+
+logger = logging.getLogger(__name__)
+
+PIPELINES = ("scrape", "screenshot", "capture")
+
+
+def _summary(durations: list) -> dict:
+    ordered = sorted(durations)
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0]),
+        "p50_ms": round(percentile(ordered, 50)),
+        "p95_ms": round(percentile(ordered, 95)),
+        "max_ms": round(ordered[-1]),
+        "mean_ms": round(statistics.fmean(ordered)),
+    }
+
+
+async def run(args) -> dict:
+    archive = PageArchive(
+        mode=MODE_RECORD if args.record else MODE_REPLAY,
+        archive_dir=args.archive_dir,
+        include_images=args.images,
+    )
+    browser_pool = BrowserPool(max_concurrency=args.concurrency, page_archive=archive)
+    latency_tracker = LatencyTracker()
+    screenshot_service = InstagramScreenshotService(browser_pool, latency_tracker)
+    profile_scraper = InstagramProfileScraper(browser_pool, latency_tracker)
+
+    pipelines = {
+        "scrape": profile_scraper.scrape_profile_data,
+        "screenshot": screenshot_service.take_profile_screenshot,
+    }
+    if args.pipeline == "capture":
+        capture = ProfileCapture(profile_scraper, screenshot_service, InstagramScreenshotParser())
+        pipelines["capture"] = lambda username: capture.capture(username, strategy=args.strategy)
+
+    selected = ("scrape", "screenshot") if args.record else (args.pipeline,)
+    iterations = 1 if args.record else args.iterations
+    results = {}
+    try:
+        for name in selected:
+            durations = []
+            failures = 0
+            for _ in range(iterations):
+                for username in args.usernames:
+                    started = time.perf_counter()
+                    try:
+                        await pipelines[name](username)
+                    except Exception as e:
+                        failures += 1
+                        logger.error(f"{name} {username}: {e}")
+                        continue
+                    durations.append((time.perf_counter() - started) * 1000)
+            results[name] = {**(_summary(durations) if durations else {"runs": 0}), "failures": failures}
+    finally:
+        await browser_pool.close()
+
+    return {
+        "mode": archive.mode,
+        "archive_dir": archive.archive_dir,
+        "include_images": archive.include_images,
+        "pipelines": results,
+        "latency": latency_tracker.stats(),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Бенчмарк скрапинга на записанных страницах")
+    arg_parser.add_argument("usernames", nargs="+")
+    arg_parser.add_argument("--record", action="store_true", help="Записать страницы из сети в архив")
+    arg_parser.add_argument("--pipeline", choices=PIPELINES, default="capture")
+    arg_parser.add_argument("--strategy", choices=STRATEGIES, default=None)
+    arg_parser.add_argument("--iterations", type=int, default=3)
+    arg_parser.add_argument("--concurrency", type=int, default=1)
+    arg_parser.add_argument("--archive-dir", default=None)
+    arg_parser.add_argument("--images", action="store_true", help="Записывать и отдавать изображения")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
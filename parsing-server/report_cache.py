@@ -0,0 +1,114 @@
+"""
+Хранилище GPT отчетов по отпечатку входных данных промпта
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import ReportCacheEntry, upsert
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCache:
+    """
+    Возвращает ранее сгенерированный отчет, если данные профиля, модель и версия
+    шаблона промпта не изменились
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("REPORT_CACHE_ENABLED", "true").lower() == "true"
+        ttl_hours = float(os.getenv("REPORT_CACHE_TTL_HOURS", 0))  # 0 - без ограничения
+        self.ttl = timedelta(hours=ttl_hours) if ttl_hours > 0 else None
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "invalidated": 0}
+
+    async def get(self, db: AsyncSession, fingerprint: str) -> Optional[Dict[str, str]]:
+        if not self.enabled:
+            return None
+
+        entry = await db.get(ReportCacheEntry, fingerprint)
+        if not entry or (self.ttl and entry.created_at < datetime.utcnow() - self.ttl):
+            self._stats["misses"] += 1
+            return None
+
+        entry.hits = (entry.hits or 0) + 1
+        entry.last_hit_at = datetime.utcnow()
+        await db.commit()
+        self._stats["hits"] += 1
+        return {"ru": entry.report_ru or "", "en": entry.report_en or ""}
+
+    async def put(self, db: AsyncSession, fingerprint: str, username: str, model: str, prompt_version: str, reports: Dict[str, str]):
+        if not self.enabled:
+            return
+
+        # Одна инструкция INSERT ... ON CONFLICT: параллельный запрос с тем же
+        # отпечатком не приводит к ошибке, запись просто перезаписывается
+        values = {
+            "fingerprint": fingerprint,
+            "username": username,
+            "model": model,
+            "prompt_version": prompt_version,
+            "report_ru": reports.get("ru"),
+            "report_en": reports.get("en"),
+            "hits": 0,
+            "created_at": datetime.utcnow(),
+        }
+        statement = upsert(ReportCacheEntry).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ReportCacheEntry.fingerprint],
+            set_={name: statement.excluded[name] for name in values if name != "fingerprint"},
+        )
+        await db.execute(statement)
+        await db.commit()
+        self._stats["stored"] += 1
+
+    async def attach_translation(self, db: AsyncSession, username: str, report_ru: str, report_en: str) -> int:
+        """
+        Добавляет английский перевод к закэшированным отчетам профиля с тем же русским текстом
+
+        Returns:
+            int: Число обновленных записей
+        """
+        if not self.enabled:
+            return 0
+
+        result = await db.execute(
+            update(ReportCacheEntry)
+            .where(ReportCacheEntry.username == username, ReportCacheEntry.report_ru == report_ru)
+            .values(report_en=report_en)
+        )
+        await db.commit()
+        return result.rowcount
+
+    def record_bypass(self):
+        self._stats["bypassed"] += 1
+
+    async def invalidate(self, db: AsyncSession, username: Optional[str] = None) -> int:
+        """
+        Удаляет закэшированные отчеты
+
+        Args:
+            username: Только для этого профиля; None - весь кэш
+
+        Returns:
+            int: Число удаленных записей
+        """
+        statement = delete(ReportCacheEntry)
+        if username is not None:
+            statement = statement.where(ReportCacheEntry.username == username)
+        count = (await db.execute(statement)).rowcount
+        await db.commit()
+        self._stats["invalidated"] += count
+        logger.info(f"Удалено {count} закэшированных отчетов" + (f" для {username}" if username else ""))
+        return count
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "ttl_hours": self.ttl.total_seconds() / 3600 if self.ttl else None,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            **self._stats,
+        }
@@ -0,0 +1,112 @@
+"""
+Разделы последнего отчета профиля для инкрементальной регенерации: при обновлении
+метрик заново генерируются только разделы, входные данные которых изменились
+"""
+import os
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+from sqlalchemy import select, delete, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import ReportSection, upsert
+
+logger = logging.getLogger(__name__)
+
+
+class ReportSectionStore:
+    """Хранит разделы отчета с хэшами входных данных (таблица report_sections)"""
+
+    def __init__(self):
+        self.enabled = os.getenv("REPORT_INCREMENTAL_ENABLED", "true").lower() == "true"
+        self._stats = {"incremental_reports": 0, "sections_reused": 0, "sections_generated": 0, "full_reports": 0}
+
+    async def load(self, db: AsyncSession, username: str) -> Optional[Dict[str, Dict[str, str]]]:
+        """
+        Returns:
+            dict: {раздел: {"content": ..., "input_hash": ...}} или None, если разделов нет
+        """
+        if not self.enabled:
+            return None
+
+        rows = (await db.scalars(select(ReportSection).where(ReportSection.username == username))).all()
+        if not rows:
+            return None
+        return {row.section: {"content": row.content, "input_hash": row.input_hash} for row in rows}
+
+    async def save(self, db: AsyncSession, username: str, sections: Optional[Dict[str, Dict[str, str]]], model: str, prompt_version: str):
+        """
+        Заменяет разделы профиля разделами нового отчета; неизменные строки не трогает,
+        чтобы generated_at показывал, когда раздел на самом деле был сгенерирован
+        """
+        if not self.enabled or not sections:
+            return
+
+        await db.execute(
+            delete(ReportSection).where(
+                ReportSection.username == username,
+                ReportSection.section.not_in(list(sections))
+            )
+        )
+        statement = upsert(ReportSection).values([
+            {
+                "username": username,
+                "section": section,
+                "content": data["content"],
+                "input_hash": data["input_hash"],
+                "model": model,
+                "prompt_version": prompt_version,
+                "generated_at": datetime.utcnow(),
+            }
+            for section, data in sections.items()
+        ])
+        excluded = statement.excluded
+        statement = statement.on_conflict_do_update(
+            index_elements=[ReportSection.username, ReportSection.section],
+            set_={
+                "content": excluded.content,
+                "input_hash": excluded.input_hash,
+                "model": excluded.model,
+                "prompt_version": excluded.prompt_version,
+                "generated_at": excluded.generated_at,
+            },
+            where=or_(ReportSection.input_hash != excluded.input_hash, ReportSection.content != excluded.content),
+        )
+        await db.execute(statement)
+        await db.commit()
+
+    async def invalidate(self, db: AsyncSession, username: Optional[str] = None) -> int:
+        """
+        Удаляет сохраненные разделы: следующий отчет будет сгенерирован целиком
+
+        Args:
+            username: Только для этого профиля; None - для всех профилей
+
+        Returns:
+            int: Число удаленных разделов
+        """
+        statement = delete(ReportSection)
+        if username is not None:
+            statement = statement.where(ReportSection.username == username)
+        count = (await db.execute(statement)).rowcount
+        await db.commit()
+        return count
+
+    def record(self, meta: Optional[dict], sections: Optional[Dict[str, Dict[str, str]]]):
+        """Учитывает, сколько разделов отчета взято из прошлого отчета, а сколько сгенерировано"""
+        if not sections:
+            return
+        reused = len((meta or {}).get("reused_sections") or ())
+        if reused:
+            self._stats["incremental_reports"] += 1
+        else:
+            self._stats["full_reports"] += 1
+        self._stats["sections_reused"] += reused
+        self._stats["sections_generated"] += len(sections) - reused
+
+    def stats(self) -> dict:
+        total = self._stats["sections_reused"] + self._stats["sections_generated"]
+        return {
+            "enabled": self.enabled,
+            **self._stats,
+            "reuse_rate": round(self._stats["sections_reused"] / total, 3) if total else 0.0,
+        }
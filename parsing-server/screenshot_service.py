@@ -3,9 +3,10 @@
 """
 import os
 import logging
-from playwright.async_api import async_playwright
 import asyncio
 from datetime import datetime
+from browser_pool import BrowserPool, PRIORITY_INTERACTIVE
+from latency_tracker import LatencyTracker, OP_GOTO, OP_SCREENSHOT
 
 logger = logging.getLogger(__name__)
 
@@ -13,16 +14,19 @@ logger = logging.getLogger(__name__)
 class InstagramScreenshotService:
     """Сервис для создания скриншотов Instagram профилей"""
     
-    def __init__(self):
+    def __init__(self, browser_pool: BrowserPool, latency_tracker: LatencyTracker):
+        self.browser_pool = browser_pool
+        self.latency_tracker = latency_tracker
         self.screenshots_dir = "screenshots"
         os.makedirs(self.screenshots_dir, exist_ok=True)
     
-    async def take_profile_screenshot(self, username: str) -> str:
+    async def take_profile_screenshot(self, username: str, priority: int = PRIORITY_INTERACTIVE) -> str:
         """
         Создает скриншот главной страницы профиля Instagram
         
         Args:
             username: Username Instagram профиля (без @)
+            priority: Приоритет в пуле браузера (фоновые задачи уступают интерактивным)
             
         Returns:
             str: Путь к сохраненному скриншоту
@@ -36,53 +40,43 @@ class InstagramScreenshotService:
             
             logger.info(f"Создание скриншота для профиля: {username}")
             
-            async with async_playwright() as p:
-                # Запускаем браузер
-                browser = await p.chromium.launch(headless=True)
-                context = await browser.new_context(
-                    viewport={'width': 390, 'height': 844},  # Размер мобильного экрана
-                    user_agent='Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1'
+            async with self.browser_pool.page(
+                priority=priority,
+                archive_key=f"{username}/screenshot",
+                viewport={'width': 390, 'height': 844},  # Размер мобильного экрана
+                user_agent='Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0 Mobile/15E148 Safari/604.1'
+            ) as page:
+                # Переходим на страницу профиля
+                with self.latency_tracker.measure(OP_GOTO):
+                    await page.goto(profile_url, wait_until='networkidle', timeout=self.latency_tracker.timeout_ms(OP_GOTO))
+                
+                # Ждем загрузки контента
+                await asyncio.sleep(3)
+                
+                # Прокручиваем страницу, чтобы загрузить весь контент
+                await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+                await asyncio.sleep(2)
+                
+                # Возвращаемся наверх
+                await page.evaluate("window.scrollTo(0, 0)")
+                await asyncio.sleep(1)
+                
+                # Создаем скриншот
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                screenshot_path = os.path.join(
+                    self.screenshots_dir,
+                    f"{username}_profile_{timestamp}.png"
                 )
-                page = await context.new_page()
                 
-                try:
-                    # Переходим на страницу профиля
-                    await page.goto(profile_url, wait_until='networkidle', timeout=30000)
-                    
-                    # Ждем загрузки контента
-                    await asyncio.sleep(3)
-                    
-                    # Прокручиваем страницу, чтобы загрузить весь контент
-                    await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    await asyncio.sleep(2)
-                    
-                    # Возвращаемся наверх
-                    await page.evaluate("window.scrollTo(0, 0)")
-                    await asyncio.sleep(1)
-                    
-                    # Создаем скриншот
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    screenshot_path = os.path.join(
-                        self.screenshots_dir,
-                        f"{username}_profile_{timestamp}.png"
-                    )
-                    
+                with self.latency_tracker.measure(OP_SCREENSHOT):
                     await page.screenshot(
                         path=screenshot_path,
                         full_page=True,
-                        timeout=10000
+                        timeout=self.latency_tracker.timeout_ms(OP_SCREENSHOT)
                     )
-                    
-                    logger.info(f"Скриншот сохранен: {screenshot_path}")
-                    
-                    await browser.close()
-                    
-                    return screenshot_path
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка при создании скриншота: {e}")
-                    await browser.close()
-                    raise
+            
+            logger.info(f"Скриншот сохранен: {screenshot_path}")
+            return screenshot_path
                     
         except Exception as e:
             logger.error(f"Ошибка в take_profile_screenshot: {e}")
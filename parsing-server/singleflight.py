@@ -0,0 +1,59 @@
+"""
+Объединение одновременных одинаковых запросов в одно выполнение (single-flight)
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Пока задача с ключом выполняется, повторные вызовы с тем же ключом
+    не запускают ее заново, а ждут и получают тот же результат (или исключение)
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Args:
+            key: Ключ (операция, ...); первый элемент используется в статистике
+            fn: Фабрика корутины, вызывается только если задачи с ключом нет
+
+        Returns:
+            Результат общей задачи
+        """
+        operation = str(key[0])
+        stats = self._stats.setdefault(operation, {"executed": 0, "coalesced": 0})
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            stats["executed"] += 1
+        else:
+            stats["coalesced"] += 1
+            logger.info(f"Запрос {key} присоединен к уже выполняющемуся")
+
+        # shield: отмена одного из ожидающих (например, клиент закрыл соединение)
+        # не должна отменять общую задачу для остальных
+        return await asyncio.shield(task)
+
+    def _forget(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Помечаем исключение как полученное, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "operations": {operation: dict(counts) for operation, counts in self._stats.items()},
+            "coalesced_total": sum(counts["coalesced"] for counts in self._stats.values()),
+        }
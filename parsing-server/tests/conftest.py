@@ -0,0 +1,54 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Модули сервера лежат плоско в parsing-server/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# database создает движок при импорте; тесты работают со своими базами (фикстура run_db)
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+
+
+class FakeClock:
+    """Управляемая замена time.monotonic"""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """
+    Выполняет scenario(session_factory) на отдельной SQLite базе со схемой моделей
+
+    Движок создается внутри asyncio.run: соединения aiosqlite привязаны к своему event loop
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+    from database import Base
+
+    def run(scenario):
+        async def main():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+                session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+                return await scenario(session_factory)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
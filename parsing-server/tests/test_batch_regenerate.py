@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from batch_regenerate import BatchProgress, ReportWriter, Throughput, run_fanout
+
+
+def saved_progress(path, **overrides) -> BatchProgress:
+    progress = BatchProgress(str(path), "gpt-4o-mini", "3", "full")
+    progress.mark_completed(["coach", "chef"])
+    progress.state.update(overrides)
+    progress.save()
+    return progress
+
+
+def test_progress_resumes_for_same_model_prompt_and_depth(tmp_path):
+    path = tmp_path / "progress.json"
+    saved_progress(path)
+
+    progress = BatchProgress(str(path), "gpt-4o-mini", "3", "full")
+    assert progress.completed == {"coach", "chef"}
+
+
+def test_progress_resets_after_model_prompt_or_depth_change(tmp_path):
+    path = tmp_path / "progress.json"
+    saved_progress(path, batch_id="batch_1")
+
+    for model, prompt_version, depth in (("gpt-4o", "3", "full"), ("gpt-4o-mini", "4", "full"), ("gpt-4o-mini", "3", "short")):
+        progress = BatchProgress(str(path), model, prompt_version, depth)
+        assert progress.completed == set()
+        assert progress.state["batch_id"] is None
+        assert progress.state["model"] == model
+
+
+def test_progress_without_target_is_not_reused(tmp_path):
+    path = tmp_path / "progress.json"
+    path.write_text(json.dumps({"completed": ["coach"], "failed": {}, "batch_id": None, "batch_fingerprints": {}}))
+
+    assert BatchProgress(str(path), "gpt-4o-mini", "3", "full").completed == set()
+
+
+def test_finish_removes_drained_progress(tmp_path):
+    path = tmp_path / "progress.json"
+    progress = saved_progress(path)
+    assert progress.drained
+
+    progress.mark_failed("fitness", "empty report")
+    assert not progress.drained
+
+    progress.state["failed"] = {}
+    progress.finish()
+    assert not path.exists()
+
+
+class FakeAnalyzer:
+    async def generate_report(self, profile_dict, screenshot_data, depth=None):
+        if profile_dict["username"] == "broken":
+            raise RuntimeError("unexpected")
+        if profile_dict["username"] == "empty":
+            return {"ru": "", "en": ""}
+        return {"ru": f"отчет {profile_dict['username']}", "en": ""}
+
+
+class MemoryWriter(ReportWriter):
+    """ReportWriter без базы: запоминает записанные отчеты"""
+
+    def __init__(self, progress: BatchProgress, throughput: Throughput):
+        super().__init__("gpt-4o-mini", 2, progress, throughput)
+        self.written = {}
+
+    async def flush(self):
+        chunk, self._pending = self._pending, []
+        for username, _, reports in chunk:
+            self.written[username] = reports["ru"]
+        self.progress.mark_completed([username for username, _, _ in chunk])
+        self.throughput.done += len(chunk)
+
+
+def test_fanout_isolates_failing_jobs(tmp_path):
+    progress = BatchProgress(str(tmp_path / "progress.json"), "gpt-4o-mini", "3", "full")
+    throughput = Throughput(5)
+    writer = MemoryWriter(progress, throughput)
+    jobs = [({"username": name}, {}) for name in ("coach", "broken", "chef", "empty", "fitness")]
+    jobs = [(profile["username"], profile, screenshot, f"fp-{profile['username']}") for profile, screenshot in jobs]
+
+    asyncio.run(run_fanout(FakeAnalyzer(), jobs, writer, progress, concurrency=2))
+
+    assert set(writer.written) == {"coach", "chef", "fitness"}
+    assert progress.completed == {"coach", "chef", "fitness"}
+    assert progress.state["failed"]["broken"] == "RuntimeError: unexpected"
+    assert progress.state["failed"]["empty"] == "empty report"
+    assert throughput.summary()["failed"] == 2
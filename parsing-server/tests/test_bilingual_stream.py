@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from gpt_analyzer import JSONStringFieldStream, parse_bilingual_output
+
+VALUES = [
+    'Отчет с "кавычками" и \\ обратной чертой',
+    "Строка 1\nСтрока 2\tтаб\r\n",
+    "Юникод é ü   — конец",
+    "Эмодзи 🌟 и 🚀 подряд 👩‍💻",
+    "\\\"",
+    "",
+]
+
+
+def responses(value: str) -> list:
+    """Ответ модели в двух видах: с экранированием не-ASCII (\\uXXXX и суррогатные пары) и без"""
+    data = {"ru": value, "en": "English report"}
+    return [json.dumps(data, ensure_ascii=True), json.dumps(data, ensure_ascii=False)]
+
+
+def streamed(chunks: list) -> tuple:
+    stream = JSONStringFieldStream("ru")
+    text = "".join(stream.feed(chunk) for chunk in chunks)
+    return text, stream.done
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_split_at_every_offset(value):
+    for raw in responses(value):
+        expected = json.loads(raw)["ru"]
+        for offset in range(len(raw) + 1):
+            assert streamed([raw[:offset], raw[offset:]]) == (expected, True), (raw, offset)
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_character_by_character(value):
+    for raw in responses(value):
+        assert streamed(list(raw)) == (value, True)
+
+
+def test_surrogate_pair_is_never_split():
+    raw = json.dumps({"ru": "🌟"}, ensure_ascii=True)
+    stream = JSONStringFieldStream("ru")
+    pieces = [stream.feed(char) for char in raw]
+    assert [piece for piece in pieces if piece] == ["🌟"]
+
+
+def test_text_after_field_is_ignored():
+    stream = JSONStringFieldStream("ru")
+    assert stream.feed('{"en": "first", "ru": "второй"') == "второй"
+    assert stream.done
+    assert stream.feed(', "other": "x"}') == ""
+
+
+def test_truncated_value_yields_prefix():
+    raw = json.dumps({"ru": "Длинный отчет 🌟", "en": "x"}, ensure_ascii=True)
+    cut = raw.index("\\ud83c") + 3
+    text, done = streamed([raw[:cut]])
+    assert text == "Длинный отчет "
+    assert not done
+
+
+def test_parse_bilingual_output_valid_json():
+    raw = json.dumps({"ru": "  Отчет  ", "en": " Report "}, ensure_ascii=False)
+    assert parse_bilingual_output(raw) == {"ru": "Отчет", "en": "Report"}
+
+
+def test_parse_bilingual_output_missing_fields():
+    assert parse_bilingual_output('{"ru": "Отчет", "en": null}') == {"ru": "Отчет", "en": ""}
+
+
+@pytest.mark.parametrize("raw", [
+    '{"ru": "Отчет, оборванный по max_tok',
+    '{"ru": "Отчет", "en": "Rep',
+    "[1, 2]",
+    "",
+])
+def test_parse_bilingual_output_falls_back_to_streamed_text(raw):
+    assert parse_bilingual_output(raw, streamed_ru=" Отчет из потока ") == {"ru": "Отчет из потока", "en": ""}
@@ -0,0 +1,45 @@
+import pytest
+
+from cohort_stats import COHORT_ALL, breakpoints, cohort_bounds, cohort_label, percentile_of
+
+
+def test_breakpoints_interpolate_between_values():
+    points = breakpoints([0.0, 10.0, 20.0, 30.0, 40.0])
+    assert len(points) == 101
+    assert points[0] == 0 and points[100] == 40
+    assert points[50] == 20
+    assert points[10] == pytest.approx(4.0)
+
+
+def test_breakpoints_of_single_value():
+    assert breakpoints([7]) == [7] * 101
+
+
+def test_percentile_of_is_inverse_of_breakpoints():
+    points = breakpoints([float(value) for value in range(1, 1002)])
+    for value in (1, 101, 500.5, 901, 1001):
+        expected = (value - 1) / 10
+        assert percentile_of(value, points) == pytest.approx(expected)
+
+
+def test_percentile_of_out_of_range_values():
+    points = breakpoints([10.0, 20.0, 30.0])
+    assert percentile_of(5, points) == 0.0
+    assert percentile_of(35, points) == 100.0
+
+
+def test_percentile_of_ties_get_middle_of_their_range():
+    # Половина профилей с одинаковым значением: перцентиль - середина их диапазона
+    points = breakpoints(sorted([1.0] * 50 + [float(value) for value in range(2, 52)]))
+    assert percentile_of(1.0, points) == pytest.approx(24.5, abs=0.5)
+    assert percentile_of(7, [7] * 101) == 50.0
+
+
+def test_cohort_bounds_and_labels():
+    assert cohort_bounds(0) == (0, 10)
+    assert cohort_bounds(4) == (10_000, 100_000)
+    assert cohort_bounds(COHORT_ALL) == (0, None)
+    assert cohort_label(4) == "10K-100K"
+    assert cohort_label(6) == "1M-10M"
+    assert cohort_label(2) == "100-1K"
+    assert cohort_label(COHORT_ALL) == "all"
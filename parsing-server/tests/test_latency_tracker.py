@@ -0,0 +1,111 @@
+from contextlib import nullcontext
+
+import pytest
+
+import latency_tracker
+from latency_tracker import DEFAULT_TIMEOUTS_MS, OP_GOTO, LatencyTracker, latency_summary, percentile
+
+
+class TimeoutError_(Exception):
+    """Как playwright TimeoutError: measure узнает таймаут по имени класса"""
+
+
+TimeoutError_.__name__ = "TimeoutError"
+
+
+@pytest.fixture
+def tracker(monkeypatch, clock):
+    monkeypatch.setattr(latency_tracker.time, "perf_counter", clock)
+    monkeypatch.setenv("CAPTURE_LATENCY_MIN_SAMPLES", "20")
+    monkeypatch.setenv("CAPTURE_TIMEOUT_MARGIN", "0.5")
+    monkeypatch.setenv("CAPTURE_TIMEOUT_FLOOR_MS", "3000")
+    monkeypatch.setenv("CAPTURE_TIMEOUT_RESET_AFTER", "3")
+    return LatencyTracker()
+
+
+def measured(tracker: LatencyTracker, clock, duration_ms: float, timeout: bool = False):
+    """Операция OP_GOTO длительностью duration_ms по фальшивым часам"""
+    with pytest.raises(TimeoutError_) if timeout else nullcontext():
+        with tracker.measure(OP_GOTO):
+            clock.advance(duration_ms / 1000)
+            if timeout:
+                raise TimeoutError_()
+
+
+def test_percentile_is_nearest_rank():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 50) == 50
+    assert percentile(ordered, 99) == 99
+    assert percentile(ordered, 100) == 100
+    assert percentile([], 99) == 0.0
+    assert latency_summary([3, 1, 2], (50,)) == {"count": 3, "p50_ms": 2, "max_ms": 3}
+
+
+def test_default_timeout_until_enough_samples(tracker, clock):
+    for _ in range(19):
+        measured(tracker, clock, 4000)
+    assert tracker.timeout_ms(OP_GOTO) == DEFAULT_TIMEOUTS_MS[OP_GOTO]
+    measured(tracker, clock, 4000)
+    assert tracker.timeout_ms(OP_GOTO) == 6000
+
+
+def test_timeout_is_p99_times_margin(tracker, clock):
+    for duration in range(1, 101):
+        measured(tracker, clock, duration * 100)
+    # p99 = 9900 мс, запас 50%
+    assert tracker.timeout_ms(OP_GOTO) == pytest.approx(14850, abs=1)
+
+
+def test_timeout_is_clamped_to_floor_and_default(tracker, clock):
+    for _ in range(20):
+        measured(tracker, clock, 100)
+    assert tracker.timeout_ms(OP_GOTO) == 3000
+
+    for _ in range(200):
+        measured(tracker, clock, 60000)
+    assert tracker.timeout_ms(OP_GOTO) == DEFAULT_TIMEOUTS_MS[OP_GOTO]
+
+
+def test_timeout_is_recorded_as_censored_sample(tracker, clock):
+    for _ in range(20):
+        measured(tracker, clock, 2000)
+    assert tracker.timeout_ms(OP_GOTO) == 3000
+
+    measured(tracker, clock, 3000, timeout=True)
+    # Прошедшее время попало в замеры и подняло p99
+    assert tracker.timeout_ms(OP_GOTO) == 4500
+    assert tracker.stats()[OP_GOTO]["timeouts"] == 1
+    assert tracker.stats()[OP_GOTO]["samples"] == 21
+
+
+def test_consecutive_timeouts_reset_to_default(tracker, clock):
+    for _ in range(20):
+        measured(tracker, clock, 2000)
+    for _ in range(3):
+        measured(tracker, clock, 3000, timeout=True)
+
+    assert tracker.timeout_ms(OP_GOTO) == DEFAULT_TIMEOUTS_MS[OP_GOTO]
+    stats = tracker.stats()[OP_GOTO]
+    assert stats["samples"] == 0
+    assert stats["timeout_resets"] == 1
+
+
+def test_success_interrupts_timeout_streak(tracker, clock):
+    for _ in range(20):
+        measured(tracker, clock, 2000)
+    measured(tracker, clock, 3000, timeout=True)
+    measured(tracker, clock, 3000, timeout=True)
+    measured(tracker, clock, 2000)
+    measured(tracker, clock, 3000, timeout=True)
+
+    assert tracker.stats()[OP_GOTO]["timeout_resets"] == 0
+    assert tracker.stats()[OP_GOTO]["timeouts"] == 3
+
+
+def test_other_errors_are_not_timeouts(tracker, clock):
+    with pytest.raises(ValueError):
+        with tracker.measure(OP_GOTO):
+            clock.advance(1)
+            raise ValueError()
+    assert tracker.stats()[OP_GOTO]["timeouts"] == 0
+    assert tracker.stats()[OP_GOTO]["samples"] == 0
@@ -0,0 +1,188 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import llm_resilience
+from llm_resilience import (
+    BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN,
+    CircuitBreaker, CircuitOpenError, LLMRateLimiter, QuotaExceededError, RetryPolicy, TokenBucket,
+    retry_after_seconds,
+)
+
+
+@pytest.fixture
+def fake_time(monkeypatch, clock):
+    monkeypatch.setattr(llm_resilience.time, "monotonic", clock)
+    return clock
+
+
+def rate_limit_error(headers: dict) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://api.example.com/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_token_bucket_refills_up_to_capacity(fake_time):
+    bucket = TokenBucket(capacity=60, rate=1)
+    bucket.take(60)
+    assert bucket.available == 0
+
+    fake_time.advance(30)
+    assert bucket.available == 30
+    fake_time.advance(1000)
+    assert bucket.available == 60
+
+
+def test_token_bucket_debt_is_served_in_order(fake_time):
+    bucket = TokenBucket(capacity=10, rate=2)
+    bucket.take(10)
+    assert bucket.wait_time(4) == 2.0
+    bucket.take(4)
+    # Следующий ждет и долг предыдущего
+    assert bucket.wait_time(4) == 4.0
+
+
+def test_token_bucket_give_back_is_capped(fake_time):
+    bucket = TokenBucket(capacity=10, rate=1)
+    bucket.take(3)
+    bucket.give_back(100)
+    assert bucket.available == 10
+
+
+def test_limiter_rejects_when_wait_exceeds_max(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_RPM_LIMIT", "60")
+    limiter = LLMRateLimiter()
+    for _ in range(60):
+        asyncio.run(limiter.acquire(0, max_wait=0))
+
+    with pytest.raises(QuotaExceededError) as error:
+        asyncio.run(limiter.acquire(0, max_wait=0.5))
+    assert error.value.retry_after == pytest.approx(1.0)
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_limiter_caps_reservation_and_settles_unused_tokens(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_TPM_LIMIT", "1000")
+    limiter = LLMRateLimiter()
+
+    reserved = asyncio.run(limiter.acquire(5000, max_wait=0))
+    assert reserved == 1000
+    limiter.settle(reserved, used=400)
+    assert limiter.tokens.available == 600
+
+
+def test_limiter_pause_blocks_new_calls(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_RPM_LIMIT", "0")
+    limiter = LLMRateLimiter()
+    limiter.pause(10)
+
+    with pytest.raises(QuotaExceededError):
+        asyncio.run(limiter.acquire(0, max_wait=5))
+    fake_time.advance(10)
+    assert asyncio.run(limiter.acquire(0, max_wait=5)) == 0
+
+
+def test_retry_after_header_variants():
+    assert retry_after_seconds(rate_limit_error({"retry-after-ms": "1500"})) == 1.5
+    assert retry_after_seconds(rate_limit_error({"retry-after": "7"})) == 7.0
+    assert retry_after_seconds(rate_limit_error({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after_seconds(rate_limit_error({})) is None
+    assert retry_after_seconds(ValueError()) is None
+
+
+def test_backoff_is_full_jitter_within_exponential_cap(monkeypatch):
+    monkeypatch.setenv("LLM_RETRY_BASE_DELAY_SECONDS", "1")
+    monkeypatch.setenv("LLM_RETRY_MAX_DELAY_SECONDS", "5")
+    policy = RetryPolicy()
+    error = ValueError()
+
+    monkeypatch.setattr(llm_resilience.random, "uniform", lambda low, high: high)
+    assert [policy.delay(attempt, error) for attempt in (1, 2, 3, 4, 5)] == [1, 2, 4, 5, 5]
+    monkeypatch.setattr(llm_resilience.random, "uniform", lambda low, high: low)
+    assert policy.delay(3, error) == 0
+
+
+def test_backoff_respects_retry_after_up_to_max_delay(monkeypatch):
+    monkeypatch.setenv("LLM_RETRY_MAX_DELAY_SECONDS", "20")
+    monkeypatch.setattr(llm_resilience.random, "uniform", lambda low, high: low)
+    policy = RetryPolicy()
+
+    assert policy.delay(1, rate_limit_error({"retry-after": "3"})) == 3.0
+    assert policy.delay(1, rate_limit_error({"retry-after": "120"})) == 20.0
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_threshold(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_BREAKER_FAILURE_THRESHOLD", "3")
+    monkeypatch.setenv("LLM_BREAKER_COOLDOWN_SECONDS", "30")
+    breaker = CircuitBreaker()
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_after == 30
+
+
+def test_breaker_success_resets_failure_count(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_BREAKER_FAILURE_THRESHOLD", "3")
+    breaker = CircuitBreaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED
+
+
+def test_breaker_half_open_allows_single_probe(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_BREAKER_FAILURE_THRESHOLD", "2")
+    monkeypatch.setenv("LLM_BREAKER_COOLDOWN_SECONDS", "30")
+    breaker = CircuitBreaker()
+    open_breaker(breaker)
+
+    fake_time.advance(30)
+    breaker.before_call()
+    assert breaker.state == BREAKER_HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == BREAKER_CLOSED
+    breaker.before_call()
+
+
+def test_breaker_failed_probe_reopens(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_BREAKER_FAILURE_THRESHOLD", "2")
+    monkeypatch.setenv("LLM_BREAKER_COOLDOWN_SECONDS", "30")
+    breaker = CircuitBreaker()
+    open_breaker(breaker)
+
+    fake_time.advance(30)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.retry_after() == 30
+
+
+def test_breaker_neutral_probe_frees_slot(monkeypatch, fake_time):
+    monkeypatch.setenv("LLM_BREAKER_FAILURE_THRESHOLD", "2")
+    monkeypatch.setenv("LLM_BREAKER_COOLDOWN_SECONDS", "30")
+    breaker = CircuitBreaker()
+    open_breaker(breaker)
+
+    fake_time.advance(30)
+    breaker.before_call()
+    breaker.record_neutral()
+    breaker.before_call()
+    assert breaker.state == BREAKER_HALF_OPEN
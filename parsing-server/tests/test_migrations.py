@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import migrations
+from database import Base
+
+
+@pytest.fixture
+def run_migrations(tmp_path, monkeypatch):
+    """
+    Выполняет scenario() с migrations.engine на отдельной пустой SQLite базе
+
+    Движок создается внутри asyncio.run, как в фикстуре run_db
+    """
+    def run(scenario):
+        async def main():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'migrations.db'}")
+            monkeypatch.setattr(migrations, "engine", engine)
+            try:
+                return await scenario(engine)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_upgrade_fresh_database_to_latest_version(run_migrations):
+    async def scenario(engine):
+        assert await migrations.current_version() == 0
+        applied = await migrations.upgrade()
+        async with engine.connect() as conn:
+            tables = await conn.run_sync(lambda sync_conn: set(inspect(sync_conn).get_table_names()))
+        return applied, await migrations.current_version(), tables
+
+    applied, version, tables = run_migrations(scenario)
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert version == migrations.LATEST_VERSION
+    assert set(Base.metadata.tables) | {"schema_version"} <= tables
+
+
+def test_second_upgrade_is_a_noop(run_migrations):
+    async def scenario(engine):
+        await migrations.upgrade()
+        first = await migrations.history()
+        applied = await migrations.upgrade()
+        return applied, first, await migrations.history(), await migrations.current_version()
+
+    applied, first, second, version = run_migrations(scenario)
+    assert applied == []
+    assert second == first
+    assert all(entry["applied_at"] for entry in second)
+    assert version == migrations.LATEST_VERSION
+
+
+def test_upgrade_database_created_before_migrations(run_migrations):
+    async def scenario(engine):
+        # Схема, созданная init_db до появления миграций: таблицы есть, schema_version нет
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(text("INSERT INTO instagram_profiles (username, report_llm_call_id) VALUES ('coach', 0)"))
+        applied = await migrations.upgrade()
+        async with engine.connect() as conn:
+            call_id = (await conn.execute(text("SELECT report_llm_call_id FROM instagram_profiles"))).scalar_one()
+        return applied, call_id, await migrations.current_version()
+
+    applied, call_id, version = run_migrations(scenario)
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert call_id is None
+    assert version == migrations.LATEST_VERSION
+
+
+def test_check_schema_requires_upgrade_without_auto_migrate(run_migrations, monkeypatch):
+    monkeypatch.setenv("DB_AUTO_MIGRATE", "false")
+
+    async def scenario(engine):
+        with pytest.raises(RuntimeError):
+            await migrations.check_schema()
+        monkeypatch.setenv("DB_AUTO_MIGRATE", "true")
+        await migrations.check_schema()
+        return await migrations.current_version()
+
+    assert run_migrations(scenario) == migrations.LATEST_VERSION
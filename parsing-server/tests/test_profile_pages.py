@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import null
+
+from database import InstagramProfile, decode_cursor, encode_cursor, list_profiles
+
+
+def test_cursor_round_trip():
+    moment = datetime(2026, 3, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor("updated_at", moment, 42), "updated_at") == (moment, 42)
+    assert decode_cursor(encode_cursor("followers", 15000, 7), "followers") == (15000, 7)
+    assert decode_cursor(encode_cursor("followers", None, 7), "followers") == (None, 7)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor("updated_at", datetime(2026, 3, 1), 10 ** 9)
+    assert "=" not in cursor and "+" not in cursor and "/" not in cursor
+
+
+@pytest.mark.parametrize("cursor", ["", "не base64", "bm90IGpzb24", encode_cursor("followers", 1, 1)[:-3]])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError, match="Некорректный cursor"):
+        decode_cursor(cursor, "followers")
+
+
+def test_cursor_for_other_sort_is_rejected():
+    with pytest.raises(ValueError, match="другой сортировки"):
+        decode_cursor(encode_cursor("followers", 1, 1), "updated_at")
+
+
+def seed(followers: list):
+    async def add(session_factory):
+        started = datetime(2026, 1, 1)
+        async with session_factory() as db:
+            for number, value in enumerate(followers):
+                db.add(InstagramProfile(
+                    username=f"user_{number}",
+                    # None в ORM заменился бы значением по умолчанию (0)
+                    followers=null() if value is None else value,
+                    created_at=started + timedelta(minutes=number),
+                    updated_at=started + timedelta(minutes=number),
+                ))
+            await db.commit()
+    return add
+
+
+async def all_pages(session_factory, limit: int, **filters) -> list:
+    pages = []
+    cursor = None
+    async with session_factory() as db:
+        while True:
+            rows, cursor = await list_profiles(db, limit, cursor=cursor, **filters)
+            pages.append([row.username for row in rows])
+            if cursor is None:
+                return pages
+
+
+# Повторяющиеся значения и NULL в колонке сортировки
+FOLLOWERS = [500, None, 1200, 500, None, 90, 1200, 500, None, 3000, 0]
+
+
+@pytest.mark.parametrize("descending", [True, False])
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 20])
+def test_followers_pages_cover_every_row_once_with_nulls_last(run_db, descending, limit):
+    async def scenario(session_factory):
+        await seed(FOLLOWERS)(session_factory)
+        return await all_pages(session_factory, limit, sort="followers", descending=descending)
+
+    pages = run_db(scenario)
+    usernames = [username for page in pages for username in page]
+    assert all(0 < len(page) <= limit for page in pages)
+
+    present = sorted(
+        (number for number, value in enumerate(FOLLOWERS) if value is not None),
+        key=lambda number: (FOLLOWERS[number], number),
+        reverse=descending,
+    )
+    missing = sorted((number for number, value in enumerate(FOLLOWERS) if value is None), reverse=descending)
+    assert usernames == [f"user_{number}" for number in present + missing]
+
+
+def test_updated_at_pages_with_filter(run_db):
+    async def scenario(session_factory):
+        await seed(FOLLOWERS)(session_factory)
+        return await all_pages(session_factory, 2, sort="updated_at", min_followers=500)
+
+    usernames = [username for page in run_db(scenario) for username in page]
+    assert usernames == ["user_9", "user_7", "user_6", "user_3", "user_2", "user_0"]
+
+
+def test_username_prefix_is_escaped(run_db):
+    async def scenario(session_factory):
+        await seed([1, 2])(session_factory)
+        async with session_factory() as db:
+            db.add(InstagramProfile(username="userX1", followers=3))
+            await db.commit()
+            rows, _ = await list_profiles(db, 10, username_prefix="user_")
+        return sorted(row.username for row in rows)
+
+    assert run_db(scenario) == ["user_0", "user_1"]
@@ -0,0 +1,93 @@
+import pytest
+
+from gpt_analyzer import DEPTH_SECTIONS, GPTAnalyzer, REPORT_SECTIONS
+from token_budget import DEPTH_FULL, DEPTH_SHORT
+
+NICHE_SECTIONS = {"audience", "partners"}
+
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setenv("REPORT_BILINGUAL_OUTPUT", "false")
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-4o-mini")
+    return GPTAnalyzer()
+
+
+def profile(**overrides) -> dict:
+    data = {"username": "coach", "followers": 12000, "following": 300, "posts_count": 150,
+            "bio": "Психолог, консультации онлайн", "engagement_rate": 0.034}
+    data.update(overrides)
+    return data
+
+
+SCREENSHOT = {"views": 50000, "interactions": 1200, "new_followers": 80, "messages": 10, "shares": 40}
+
+
+def changed(before: dict, after: dict) -> set:
+    return {section for section in before if before[section] != after[section]}
+
+
+def test_hashes_are_stable_and_cover_depth_sections(analyzer):
+    first = analyzer.section_input_hashes(profile(), SCREENSHOT, DEPTH_FULL)
+    second = analyzer.section_input_hashes(profile(), dict(SCREENSHOT), DEPTH_FULL)
+    assert first == second
+    assert tuple(first) == REPORT_SECTIONS
+    assert len(set(first.values())) == len(first)
+
+    short = analyzer.section_input_hashes(profile(), SCREENSHOT, DEPTH_SHORT)
+    assert tuple(short) == DEPTH_SECTIONS[DEPTH_SHORT]
+    assert short["metrics"] != first["metrics"]
+
+
+def test_metric_change_keeps_niche_sections(analyzer):
+    before = analyzer.section_input_hashes(profile(), SCREENSHOT, DEPTH_FULL)
+    after = analyzer.section_input_hashes(profile(followers=15000), {**SCREENSHOT, "views": 70000}, DEPTH_FULL)
+    assert changed(before, after) == set(REPORT_SECTIONS) - NICHE_SECTIONS
+
+
+def test_audience_scale_change_invalidates_niche_sections(analyzer):
+    before = analyzer.section_input_hashes(profile(followers=9000), SCREENSHOT, DEPTH_FULL)
+    after = analyzer.section_input_hashes(profile(followers=11000), SCREENSHOT, DEPTH_FULL)
+    assert changed(before, after) == set(REPORT_SECTIONS)
+
+
+def test_bio_change_keeps_metrics_section(analyzer):
+    before = analyzer.section_input_hashes(profile(), SCREENSHOT, DEPTH_FULL)
+    after = analyzer.section_input_hashes(profile(bio="Фитнес тренер"), SCREENSHOT, DEPTH_FULL)
+    assert changed(before, after) == set(REPORT_SECTIONS) - {"metrics"}
+
+
+def test_model_change_invalidates_everything(analyzer):
+    before = analyzer.section_input_hashes(profile(), SCREENSHOT, DEPTH_FULL)
+    analyzer.model = "gpt-4o"
+    after = analyzer.section_input_hashes(profile(), SCREENSHOT, DEPTH_FULL)
+    assert changed(before, after) == set(REPORT_SECTIONS)
+
+
+def stored(analyzer, data: dict, screenshot: dict) -> dict:
+    return {
+        section: {"content": f"текст {section}", "input_hash": input_hash}
+        for section, input_hash in analyzer.section_input_hashes(data, screenshot, DEPTH_FULL).items()
+    }
+
+
+def test_reusable_sections_only_unchanged_with_content(analyzer):
+    previous = stored(analyzer, profile(), SCREENSHOT)
+    previous["partners"]["content"] = ""
+
+    reused = analyzer.reusable_sections(profile(followers=15000), SCREENSHOT, DEPTH_FULL, previous)
+    assert reused == {"audience": "текст audience"}
+
+
+def test_reusable_sections_all_when_inputs_unchanged(analyzer):
+    previous = stored(analyzer, profile(), SCREENSHOT)
+    reused = analyzer.reusable_sections(profile(), SCREENSHOT, DEPTH_FULL, previous)
+    assert set(reused) == set(REPORT_SECTIONS)
+
+
+def test_reusable_sections_empty_without_previous_or_in_bilingual_mode(analyzer):
+    assert analyzer.reusable_sections(profile(), SCREENSHOT, DEPTH_FULL, None) == {}
+    previous = stored(analyzer, profile(), SCREENSHOT)
+    analyzer.bilingual = True
+    assert analyzer.reusable_sections(profile(), SCREENSHOT, DEPTH_FULL, previous) == {}
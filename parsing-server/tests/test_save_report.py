@@ -0,0 +1,68 @@
+from sqlalchemy import select
+from sqlalchemy.orm import undefer_group
+
+from database import (
+    InstagramProfile, REPORT_STATUS_DRAFT, REPORT_STATUS_FINAL, REPORT_TEXT_GROUP, save_report, upsert_profile,
+)
+
+
+async def stored(session_factory, username: str) -> InstagramProfile:
+    async with session_factory() as db:
+        return await db.scalar(
+            select(InstagramProfile).options(undefer_group(REPORT_TEXT_GROUP)).where(InstagramProfile.username == username)
+        )
+
+
+def test_draft_is_saved_when_there_is_no_report(run_db):
+    async def scenario(session_factory):
+        async with session_factory() as db:
+            await upsert_profile(db, "coach", {"followers": 1000})
+            saved = await save_report(db, "coach", {"ru": "черновик", "en": ""}, "draft", "v1", status=REPORT_STATUS_DRAFT)
+        assert saved is not None
+        return await stored(session_factory, "coach")
+
+    profile = run_db(scenario)
+    assert profile.report_ru == "черновик"
+    assert profile.report_status == REPORT_STATUS_DRAFT
+    assert not profile.has_final_report
+
+
+def test_draft_does_not_overwrite_final_report(run_db):
+    async def scenario(session_factory):
+        async with session_factory() as db:
+            await upsert_profile(db, "coach", {"followers": 1000})
+            await save_report(db, "coach", {"ru": "итоговый", "en": "final"}, "gpt-4o-mini", "v1")
+            saved = await save_report(db, "coach", {"ru": "черновик", "en": ""}, "draft", "v1", status=REPORT_STATUS_DRAFT)
+        assert saved is None
+        return await stored(session_factory, "coach")
+
+    profile = run_db(scenario)
+    assert profile.report_ru == "итоговый"
+    assert profile.report_model == "gpt-4o-mini"
+    assert profile.report_status == REPORT_STATUS_FINAL
+
+
+def test_draft_does_not_overwrite_legacy_report_without_status(run_db):
+    async def scenario(session_factory):
+        async with session_factory() as db:
+            await upsert_profile(db, "coach", {"followers": 1000})
+            await save_report(db, "coach", {"ru": "старый отчет", "en": ""}, "gpt-4", "v0", status=None)
+            saved = await save_report(db, "coach", {"ru": "черновик", "en": ""}, "draft", "v1", status=REPORT_STATUS_DRAFT)
+        assert saved is None
+        return await stored(session_factory, "coach")
+
+    assert run_db(scenario).report_ru == "старый отчет"
+
+
+def test_final_report_replaces_draft(run_db):
+    async def scenario(session_factory):
+        async with session_factory() as db:
+            await upsert_profile(db, "coach", {"followers": 1000})
+            await save_report(db, "coach", {"ru": "черновик", "en": ""}, "draft", "v1", status=REPORT_STATUS_DRAFT)
+            saved = await save_report(db, "coach", {"ru": "итоговый", "en": ""}, "gpt-4o-mini", "v1")
+        assert saved is not None
+        return await stored(session_factory, "coach")
+
+    profile = run_db(scenario)
+    assert profile.report_ru == "итоговый"
+    assert profile.has_final_report
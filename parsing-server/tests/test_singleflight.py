@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_identical_calls_run_once():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "report"
+
+        results = await asyncio.gather(*(flight.do(("analyze", "coach"), work) for _ in range(5)))
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert results == ["report"] * 5
+    assert stats["operations"]["analyze"] == {"executed": 1, "coalesced": 4}
+    assert stats["in_flight"] == 0
+
+
+def test_sequential_calls_run_again():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        return [await flight.do(("analyze", "coach"), work) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+
+def test_error_is_shared_by_all_waiters():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("LLM недоступен")
+
+        return await asyncio.gather(*(flight.do(("analyze", "coach"), work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_waiter_does_not_cancel_shared_task():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "report"
+
+        first = asyncio.create_task(flight.do(("analyze", "coach"), work))
+        second = asyncio.create_task(flight.do(("analyze", "coach"), work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "report"
+
+
+def test_run_single_flight_keys_include_arguments(monkeypatch):
+    import app
+
+    class FakeSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(app, "SessionLocal", FakeSession)
+    monkeypatch.setattr(app, "single_flight", SingleFlight())
+
+    async def scenario():
+        calls = []
+
+        async def regenerate(db, username, force_refresh, depth):
+            calls.append((force_refresh, depth))
+            await asyncio.sleep(0.01)
+            return f"{username}:{force_refresh}:{depth}"
+
+        results = await asyncio.gather(
+            app.run_single_flight("regenerate-report", "coach", regenerate, False, "full"),
+            app.run_single_flight("regenerate-report", "coach", regenerate, False, "full"),
+            app.run_single_flight("regenerate-report", "coach", regenerate, True, "full"),
+            app.run_single_flight("regenerate-report", "coach", regenerate, False, "short"),
+        )
+        return calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert sorted(calls) == [(False, "full"), (False, "short"), (True, "full")]
+    assert results == ["coach:False:full", "coach:False:full", "coach:True:full", "coach:False:short"]
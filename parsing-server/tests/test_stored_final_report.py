@@ -0,0 +1,60 @@
+from sqlalchemy import select
+
+import app
+from database import InstagramProfile, REPORT_STATUS_DRAFT, save_report, upsert_profile
+
+
+class FakeAnalyzer:
+    def report_fingerprint(self, profile_dict, screenshot_data, depth):
+        return f"{profile_dict['username']}:{depth}"
+
+
+def stored_final_report(run_db, setup, force_refresh: bool = False):
+    async def scenario(session_factory):
+        async with session_factory() as db:
+            await upsert_profile(db, "coach", {"followers": 1000})
+            await setup(db)
+        async with session_factory() as db:
+            profile = await db.scalar(select(InstagramProfile).where(InstagramProfile.username == "coach"))
+            return await app.stored_final_report(FakeAnalyzer(), db, profile, {"username": "coach"}, {}, force_refresh, "short")
+
+    return run_db(scenario)
+
+
+async def cache_report(db):
+    await app.report_cache.put(db, "coach:short", "coach", "gpt-4o-mini", "v1", {"ru": "из кэша", "en": "cached"})
+
+
+async def final_report(db):
+    await save_report(db, "coach", {"ru": "сохраненный", "en": "saved"}, "gpt-4o-mini", "v1")
+
+
+async def draft_report(db):
+    await save_report(db, "coach", {"ru": "черновик", "en": ""}, "draft", "v1", status=REPORT_STATUS_DRAFT)
+
+
+async def nothing(db):
+    pass
+
+
+def test_cached_report_is_returned_instead_of_draft(run_db):
+    assert stored_final_report(run_db, cache_report) == {"ru": "из кэша", "en": "cached", "cached": True}
+
+
+def test_saved_final_report_is_returned_instead_of_draft(run_db):
+    assert stored_final_report(run_db, final_report) == {"ru": "сохраненный", "en": "saved", "stale": True}
+
+
+def test_force_refresh_skips_cache_but_keeps_saved_report(run_db):
+    assert stored_final_report(run_db, cache_report, force_refresh=True) is None
+
+    async def both(db):
+        await cache_report(db)
+        await final_report(db)
+
+    assert stored_final_report(run_db, both, force_refresh=True)["ru"] == "сохраненный"
+
+
+def test_saved_draft_is_not_a_final_report(run_db):
+    assert stored_final_report(run_db, draft_report) is None
+    assert stored_final_report(run_db, nothing) is None
@@ -0,0 +1,133 @@
+"""
+Подсчет токенов промпта и бюджет ответа GPT отчета
+"""
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken используется приближенная оценка
+    tiktoken = None
+
+# Глубина отчета: набор разделов и размер ответа
+DEPTH_SHORT = "short"
+DEPTH_STANDARD = "standard"
+DEPTH_FULL = "full"
+REPORT_DEPTHS = (DEPTH_SHORT, DEPTH_STANDARD, DEPTH_FULL)
+
+# Максимум токенов ответа для каждой глубины
+DEPTH_MAX_TOKENS = {
+    DEPTH_SHORT: 900,
+    DEPTH_STANDARD: 2200,
+    DEPTH_FULL: 4000,
+}
+
+# Насколько полны входные данные профиля
+DATA_STATS = "stats"  # есть статистика за 30 дней со скриншота
+DATA_PUBLIC = "public"  # только публичные счетчики
+DATA_BIO_ONLY = "bio_only"  # счетчики неизвестны, есть биография
+DATA_NONE = "none"  # нет ничего, кроме username
+
+# Без статистики за 30 дней описывать в отчете почти нечего: ответ короче
+PUBLIC_DATA_TOKEN_FACTOR = 0.75
+
+# Служебные токены chat формата на сообщение и на ответ
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Приближенная оценка без tiktoken: кириллица кодируется плотнее латиницы
+CHARS_PER_TOKEN_CYRILLIC = 2.5
+CHARS_PER_TOKEN_OTHER = 4.0
+
+FALLBACK_ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        # Словарь кодировки скачивается при первом использовании - без сети недоступен
+        logger.warning(f"Кодировка tiktoken для {model} недоступна, используется оценка: {e}")
+        return None
+    try:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as e:
+        logger.warning(f"Кодировка tiktoken {FALLBACK_ENCODING} недоступна, используется оценка: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Число токенов текста для модели
+
+    Args:
+        text: Текст
+        model: Имя модели OpenAI
+
+    Returns:
+        int: Точное число токенов (tiktoken) или оценка сверху
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+
+    cyrillic = sum(1 for ch in text if 'Ѐ' <= ch <= 'ӿ')
+    other = len(text) - cyrillic
+    return int(cyrillic / CHARS_PER_TOKEN_CYRILLIC + other / CHARS_PER_TOKEN_OTHER) + 1
+
+
+def count_message_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """Число токенов промпта chat completions (сообщения + служебные токены)"""
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(message.get("content") or "", model)
+        for message in messages
+    ) + TOKENS_PER_REPLY
+
+
+def data_level(profile_data: Dict[str, Any], screenshot_data: Dict[str, Any]) -> str:
+    """Определяет, насколько полны входные данные отчета"""
+    if any((screenshot_data.get(key) or 0) > 0 for key in ("views", "interactions", "new_followers", "messages", "shares")):
+        return DATA_STATS
+    if (profile_data.get('followers') or 0) > 0 or (profile_data.get('posts_count') or 0) > 0:
+        return DATA_PUBLIC
+    bio = (profile_data.get('bio') or '').strip()
+    if bio and bio != 'Not specified':
+        return DATA_BIO_ONLY
+    return DATA_NONE
+
+
+def effective_depth(depth: str, level: str) -> str:
+    """По одной биографии (или без данных) полный отчет не из чего строить - только короткий"""
+    if level in (DATA_BIO_ONLY, DATA_NONE):
+        return DEPTH_SHORT
+    return depth
+
+
+def completion_budget(depth: str, level: str, limit: Optional[int] = None) -> int:
+    """
+    Размер max_tokens для ответа
+
+    Args:
+        depth: Глубина отчета (уже с учетом effective_depth)
+        level: Полнота данных (data_level)
+        limit: Верхняя граница (например, OPENAI_MAX_TOKENS)
+
+    Returns:
+        int: max_tokens
+    """
+    max_tokens = DEPTH_MAX_TOKENS[depth]
+    if level == DATA_PUBLIC and depth != DEPTH_SHORT:
+        max_tokens = int(max_tokens * PUBLIC_DATA_TOKEN_FACTOR)
+    if limit:
+        max_tokens = min(max_tokens, limit)
+    return max_tokens